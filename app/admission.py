@@ -0,0 +1,206 @@
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from config import get_config
+
+config = get_config()
+
+# Highest priority first
+PRIORITIES = ("emergency", "active", "new")
+_RANK = {priority: rank for rank, priority in enumerate(PRIORITIES)}
+
+
+class Overloaded(Exception):
+    """Request shed by admission control; retry after ``retry_after`` seconds"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Overloaded ({reason}), retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    """A queued request, woken by a thread event or an asyncio future"""
+
+    __slots__ = ("priority", "state", "event", "future", "loop")
+
+    def __init__(self, priority: str, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.priority = priority
+        self.state = None  # "granted", "evicted" or "abandoned" once decided
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(self.state)
+
+
+class AdmissionController:
+    """Bounded in-flight limit with a bounded, prioritised wait queue.
+
+    At most ``max_in_flight`` requests hold a slot; up to ``max_queue`` more
+    wait, served in priority order (see ``PRIORITIES``) and FIFO within a
+    priority. When the queue is full, an arrival evicts the newest waiter of
+    a lower priority, or is shed itself. Waiters give up after ``max_wait``
+    seconds. Shed requests get ``Overloaded`` with a Retry-After estimate
+    from the recent slot hold time. Usable from threads (``slot``) and from
+    asyncio (``slot_async``).
+    """
+
+    def __init__(self, max_in_flight: int = 64, max_queue: int = 128, max_wait: float = 10.0):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self._queue: List[Tuple[int, int, _Waiter]] = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._average_hold = 1.0
+        self.admitted: Dict[str, int] = defaultdict(int)
+        self.shed: Dict[Tuple[str, str], int] = defaultdict(int)
+
+    def _enqueue(self, priority: str, loop: Optional[asyncio.AbstractEventLoop] = None) -> Optional[_Waiter]:
+        """Take a free slot (returns None) or queue a waiter; raises Overloaded when full"""
+        rank = _RANK[priority]
+        evicted = None
+        with self._lock:
+            if self.in_flight < self.max_in_flight:
+                self.in_flight += 1
+                self.admitted[priority] += 1
+                return None
+
+            if len(self._queue) >= self.max_queue:
+                worst = max(self._queue, default=None)
+                if worst is None or worst[0] <= rank:
+                    self.shed[(priority, "queue_full")] += 1
+                    raise Overloaded("queue_full", self._retry_after())
+                self._queue.remove(worst)
+                heapq.heapify(self._queue)
+                evicted = worst[2]
+                evicted.state = "evicted"
+                self.shed[(evicted.priority, "evicted")] += 1
+
+            waiter = _Waiter(priority, loop)
+            heapq.heappush(self._queue, (rank, next(self._sequence), waiter))
+        if evicted is not None:
+            evicted.wake()
+        return waiter
+
+    def _abandon(self, waiter: _Waiter, reason: Optional[str]) -> bool:
+        """Withdraw a waiter; True if it was granted a slot in the meantime"""
+        with self._lock:
+            if waiter.state == "granted":
+                return True
+            if waiter.state is None:
+                waiter.state = "abandoned"
+                self._queue = [entry for entry in self._queue if entry[2] is not waiter]
+                heapq.heapify(self._queue)
+                if reason:
+                    self.shed[(waiter.priority, reason)] += 1
+            return False
+
+    def acquire(self, priority: str):
+        """Block until admitted (threads)"""
+        waiter = self._enqueue(priority)
+        if waiter is None:
+            return
+        waiter.event.wait(self.max_wait)
+        self._settle(waiter)
+
+    async def acquire_async(self, priority: str):
+        """Wait until admitted without blocking the event loop"""
+        waiter = self._enqueue(priority, asyncio.get_running_loop())
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.max_wait)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            if self._abandon(waiter, None):
+                self.release()
+            raise
+        self._settle(waiter)
+
+    def _settle(self, waiter: _Waiter):
+        if self._abandon(waiter, "queue_timeout"):
+            return
+        reason = "evicted" if waiter.state == "evicted" else "queue_timeout"
+        raise Overloaded(reason, self._retry_after())
+
+    def release(self, held_seconds: Optional[float] = None):
+        woken = None
+        with self._lock:
+            if held_seconds is not None:
+                self._average_hold += 0.1 * (held_seconds - self._average_hold)
+            while self._queue:
+                _, _, waiter = heapq.heappop(self._queue)
+                if waiter.state is None:
+                    waiter.state = "granted"
+                    self.admitted[waiter.priority] += 1
+                    woken = waiter
+                    break
+            else:
+                self.in_flight -= 1
+        if woken is not None:
+            woken.wake()
+
+    def _retry_after(self) -> int:
+        """Seconds until the current queue has likely drained"""
+        backlog = (len(self._queue) + 1) / max(self.max_in_flight, 1)
+        return max(1, min(30, math.ceil(self._average_hold * backlog)))
+
+    @contextmanager
+    def slot(self, priority: str):
+        self.acquire(priority)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - started)
+
+    @asynccontextmanager
+    async def slot_async(self, priority: str):
+        await self.acquire_async(priority)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - started)
+
+    def export_state(self) -> Dict:
+        """Gauges and counters for the metrics exporter"""
+        with self._lock:
+            queued = {priority: 0 for priority in PRIORITIES}
+            for _, _, waiter in self._queue:
+                queued[waiter.priority] += 1
+            return {
+                "in_flight": self.in_flight,
+                "limit": self.max_in_flight,
+                "queued": queued,
+                "admitted": dict(self.admitted),
+                "shed": [{"priority": priority, "reason": reason, "count": count}
+                         for (priority, reason), count in self.shed.items()],
+            }
+
+
+# Global controller for requests that wait on the upstream provider (per worker)
+admission_controller = AdmissionController(
+    max_in_flight=config.admission_max_in_flight,
+    max_queue=config.admission_max_queue,
+    max_wait=config.admission_max_wait_seconds
+)
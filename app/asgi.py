@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+from fastapi import FastAPI, Header, Response
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from slowapi import _rate_limit_exceeded_handler
+from slowapi.errors import RateLimitExceeded
+from config import get_config  # loads .env
+from chat_api import router, limiter, grok_client
+import preload
+from static_assets import AssetBundle
+
+config = get_config()
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Widget files minified, hashed and precompressed once at startup
+widget_assets = AssetBundle(os.path.join(parent_dir, "widget"))
+
+# Set once the warm-up after startup has finished; reported by /ready
+readiness = {"ready": False, "warm_up": None}
+
+# Production entry point: the async chat API under uvicorn workers, e.g.
+#   gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+app = FastAPI(title="Chatbot Engine", version=config.widget_version)
+app.state.limiter = limiter
+app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=[origin.strip() for origin in config.allowed_origins.split(",")],
+    allow_methods=["*"],
+    allow_headers=["*"]
+)
+app.include_router(router)
+
+@app.get("/")
+async def root():
+    return {"message": "Chatbot Engine Running", "widget_url": "/widget/widget.js"}
+
+@app.on_event("startup")
+async def schedule_warm_up():
+    # The server accepts connections right away; /ready turns 200 once this is done
+    app.state.warm_up_task = asyncio.get_running_loop().create_task(warm_up())
+
+async def warm_up():
+    """Build caches (cheap when preloaded) and open upstream connections.
+
+    A failure is logged and the instance still becomes ready, degraded:
+    caches then fill on first use, which is slower but serves traffic.
+    """
+    started = time.perf_counter()
+    try:
+        summary = preload.warm_up()
+    except Exception as e:
+        logging.getLogger('chatbot.errors').exception(f"Warm-up failed, serving degraded: {type(e).__name__}: {e}")
+        summary = {"degraded": True, "error": type(e).__name__}
+    if config.warm_upstream_connections > 0:
+        try:
+            summary["upstream_connections"] = await grok_client.open_pool(config.warm_upstream_connections)
+        except Exception as e:
+            logging.getLogger('chatbot.errors').error(f"Upstream warm-up failed: {type(e).__name__}")
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    readiness["warm_up"] = summary
+    readiness["ready"] = True
+
+@app.get("/ready")
+async def ready():
+    """200 once warmed up; unlike /health, 503 while the instance is still starting"""
+    if not readiness["ready"]:
+        return JSONResponse({"status": "starting"}, status_code=503)
+    return {"status": "ready", "warm_up": readiness["warm_up"]}
+
+@app.get("/health")
+async def health():
+    return {
+        "status": "healthy",
+        "services": {
+            "grok_api": bool(config.grok_api_key),
+            "gemini_api": bool(config.gemini_api_key)
+        }
+    }
+
+@app.get("/widget/{filename}")
+async def serve_widget(
+    filename: str,
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None)
+):
+    status, headers, body = widget_assets.respond(filename, if_none_match, accept_encoding)
+    return Response(body, status_code=status, headers=headers)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host=config.host, port=int(os.getenv('PORT', config.port)))
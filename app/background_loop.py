@@ -0,0 +1,78 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+from typing import Any, Coroutine, Optional
+
+
+class BackgroundLoop:
+    """A long-lived event loop in a daemon thread, for sync code that needs to await.
+
+    Sync handlers submit coroutines with ``run``; the loop and anything
+    created on it (connection pools, clients) outlive the request, so each
+    call pays neither loop setup nor TLS handshakes. The thread is started
+    on first use and again in a forked child, where it does not survive.
+    """
+
+    def __init__(self, name: str = "background-loop"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The running loop, started if needed"""
+        loop = self._loop
+        if loop is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return loop
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._start()
+            return self._loop
+
+    def _start(self):
+        loop = asyncio.new_event_loop()
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            loop.call_soon(ready.set)
+            loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name=self.name, daemon=True)
+        self._thread.start()
+        ready.wait()
+        self._loop = loop
+        self._pid = os.getpid()
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """Run ``coro`` on the loop and wait for its result.
+
+        On timeout (the builtin ``TimeoutError``) or if the caller is
+        interrupted, the coroutine is cancelled so it does not keep holding a
+        connection.
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            # A distinct class before Python 3.11 (the pinned runtime is 3.10)
+            raise TimeoutError(f"Coroutine did not finish within {timeout}s") from None
+        except BaseException:
+            future.cancel()
+            raise
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the loop and wait for its thread"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = None
+        if loop is None or self._pid != os.getpid():
+            return
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        if not thread.is_alive():
+            loop.close()
@@ -1,21 +1,29 @@
-from fastapi import APIRouter, HTTPException, Request, Header
+from fastapi import APIRouter, HTTPException, Request, Header, Response
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, List, Dict
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 import uuid
-import time
+import tracemalloc
 import asyncio
 from grok_client import GrokClient
-from gemini_client import GeminiClient
 from knowledge_manager import KnowledgeManager
 from rule_engine import RuleEngine
 from prompt_builder import PromptBuilder
+from prompt_assembly import knowledge_fragments
+from token_budget import count_tokens, prompt_budget
+from stage_machine import stage_classifier
+from metrics_export import MetricsExporter
+from profiling import profiler
+from memory_accounting import memory_accountant, process_memory
+from token_accounting import token_accountant
+from tracing import tracer, trace_ring
+from admission import admission_controller, Overloaded
 from security import SecurityValidator
 from conversation_manager import conversation_manager
 from operational_safety import abuse_detector, observability_metrics, medical_safety
 from logger import logger
-from config import get_config
+from config import get_config, GenerationProfile
 
 router = APIRouter()
 config = get_config()
@@ -31,6 +39,12 @@ class ChatResponse(BaseModel):
     version: str = config.widget_version
     debug_info: Optional[dict] = None
 
+class ProfilingRequest(BaseModel):
+    mode: str = "sample"
+    max_requests: Optional[int] = 100
+    max_seconds: Optional[float] = 30.0
+    interval_ms: float = 5.0
+
 class KnowledgeExpansionRequest(BaseModel):
     raw_text: str
     source_tag: str
@@ -38,41 +52,131 @@ class KnowledgeExpansionRequest(BaseModel):
 
 # Initialize components
 grok_client = GrokClient()
-gemini_client = GeminiClient()
 knowledge_manager = KnowledgeManager()
 rule_engine = RuleEngine()
 prompt_builder = PromptBuilder()
 
+# Knowledge expansion is rare (and off by default); its client is built on first use
+_gemini_client = None
+
+def _get_gemini_client():
+    global _gemini_client
+    if _gemini_client is None:
+        from gemini_client import GeminiClient
+        _gemini_client = GeminiClient()
+    return _gemini_client
+
+# The API has no stage machine; every chat request uses this generation stage
+CHAT_STAGE = "default"
+
+def _cache_counts() -> Dict:
+    """(hits, misses) of the request-path caches"""
+    fragments = knowledge_fragments.get_stats()
+    tokens = count_tokens.cache_info()
+    stages = stage_classifier.cache_info()
+    return {
+        "knowledge_fragments": (fragments["hits"], fragments["misses"]),
+        "token_counts": (tokens.hits, tokens.misses),
+        "stage_decisions": (stages.hits, stages.misses),
+    }
+
+metrics_exporter = MetricsExporter(
+    observability_metrics,
+    directory=config.metrics_dir,
+    interval=config.metrics_publish_interval,
+    gauges=lambda: {
+        "active_sessions": len(conversation_manager.conversations),
+        "abuse_tracked_ips": len(abuse_detector.ip_requests),
+        "log_records_dropped": logger.dropped_records,
+        "process_resident_bytes": process_memory().get("resident_bytes", 0),
+    },
+    caches=_cache_counts,
+    memory=lambda: memory_accountant.last_report,
+    tokens=token_accountant.export_state,
+    admission=admission_controller.export_state
+)
+
+# In-process structures reported by /admin/memory and /metrics
+memory_accountant.register("conversations", lambda: conversation_manager.conversations)
+memory_accountant.register("abuse_ip_requests", lambda: abuse_detector.ip_requests)
+memory_accountant.register("abuse_ip_errors", lambda: abuse_detector.ip_errors)
+memory_accountant.register("latency_histograms", lambda: observability_metrics,
+                           entries=lambda metrics: len(metrics.phase_times) + 1)
+memory_accountant.register("rate_limiter", lambda: limiter._storage,
+                           entries=lambda storage: len(getattr(storage, "storage", {})))
+memory_accountant.register("knowledge_fragments", lambda: knowledge_fragments,
+                           entries=lambda cache: cache.get_stats()["entries"])
+memory_accountant.register("trace_ring", lambda: trace_ring._traces)
+
+@router.on_event("startup")
+async def start_metrics_publisher():
+    metrics_exporter.start()
+    memory_accountant.start(config.memory_report_interval)
+    token_accountant.start(config.token_rollup_interval)
+
+@router.on_event("shutdown")
+async def close_upstream_clients():
+    await grok_client.aclose()
+
+@router.get("/metrics")
+def metrics():
+    """Prometheus text-format metrics, merged across workers"""
+    return Response(metrics_exporter.render(), media_type="text/plain; version=0.0.4")
+
 @router.post("/chat", response_model=ChatResponse)
 @limiter.limit(f"{config.rate_limit_requests}/{config.rate_limit_window}seconds")
-async def chat(request: ChatRequest, http_request: Request):
-    start_time = time.time()
+async def chat(chat_request: ChatRequest, request: Request):
+    # slowapi finds the Starlette request by the parameter name ``request``
+    # No stage machine on this path, so profiles carry no stage
+    with profiler.request("/chat"), \
+            tracer.start_trace("POST /chat", request.headers.get("traceparent"), stage=CHAT_STAGE):
+        return await _handle_chat(chat_request, request)
+
+async def _handle_chat(request: ChatRequest, http_request: Request):
+    timer = observability_metrics.start_timer()
     session_id = request.session_id or str(uuid.uuid4())
     client_ip = get_remote_address(http_request)
     user_agent = http_request.headers.get("user-agent", "")
     debug_info = {} if config.debug_mode else None
     
     try:
+        # Rate limit, abuse and block checks share one counter update
+        ip_verdict = await _off_loop(abuse_detector.shared, abuse_detector.check_ip, client_ip, user_agent)
+        if ip_verdict.rate_limited:
+            raise HTTPException(status_code=429, detail="Rate limit exceeded")
+        
         # Check for abuse patterns
-        if abuse_detector.check_request_abuse(client_ip, user_agent):
+        if ip_verdict.abusive:
             logger.log_security_event("rate_limit_abuse", client_ip, {
                 "user_agent": user_agent,
                 "session_id": session_id[:8] + "***"
             })
             raise HTTPException(status_code=429, detail="Too many requests")
         
-        if abuse_detector.is_ip_blocked(client_ip):
+        if ip_verdict.blocked:
             logger.log_security_event("ip_blocked", client_ip, {"reason": "too_many_errors"})
             raise HTTPException(status_code=403, detail="Access denied")
         
-        # Security validation
-        sanitized_message = SecurityValidator.sanitize_user_input(request.message)
+        # Security validation: sanitize, filter injections and flag abuse in one pass
+        verdict = SecurityValidator.scan_user_input(request.message)
+        sanitized_message = verdict.text
+        
+        timer.lap("sanitize")
         
         if not sanitized_message.strip():
             raise HTTPException(status_code=400, detail="Invalid message")
         
+        # Shed load before the provider quota is hit
+        exhausted_budget = token_accountant.check_budget(session_id)
+        if exhausted_budget:
+            logger.log_security_event("token_budget_exceeded", client_ip, {
+                "budget": exhausted_budget,
+                "session_id": session_id[:8] + "***"
+            })
+            raise HTTPException(status_code=429, detail="Token budget exceeded")
+        
         # Check for suspicious message content
-        if abuse_detector.check_message_abuse(sanitized_message):
+        if verdict.suspicious:
             logger.log_security_event("suspicious_message", client_ip, {
                 "message_length": len(sanitized_message),
                 "session_id": session_id[:8] + "***"
@@ -90,63 +194,91 @@ async def chat(request: ChatRequest, http_request: Request):
                 sanitized_message, 
                 max_results=config.max_knowledge_entries
             )
+            timer.lap("retrieval")
             
-            # Get conversation context
-            conversation_context = conversation_manager.get_conversation_context(session_id)
+            # Get recent conversation turns
+            history = conversation_manager.get_conversation_turns(session_id)
+            timer.lap("context")
             
             if config.debug_mode:
                 debug_info.update({
                     "knowledge_matches": len(relevant_knowledge),
-                    "conversation_context_length": len(conversation_context),
+                    "conversation_turns": len(history),
                     "sanitized_message": sanitized_message
                 })
                 
         except Exception as e:
             logger.log_api_error("knowledge_system", e, {"session_id": session_id})
-            abuse_detector.log_error(client_ip)
+            await _off_loop(abuse_detector.shared, abuse_detector.log_error, client_ip)
             rules = "Be helpful and accurate."
             relevant_knowledge = []
-            conversation_context = ""
+            history = []
+        
+        # Fit rules, knowledge and history into the prompt token budget
+        generation = knowledge_manager.generation
+        with tracer.span("token_budget.allocate"):
+            budget = prompt_budget.allocate(
+                rules=rules,
+                knowledge=relevant_knowledge,
+                history=history,
+                user_message=sanitized_message,
+                knowledge_text=lambda entry: knowledge_fragments.get(entry, generation),
+                fixed_text=prompt_builder.system_template.source
+            )
         
-        # Build prompt with context limits
-        prompt = prompt_builder.build_chat_prompt(
-            rules=rules,
-            knowledge=relevant_knowledge,
+        # Build messages with a stable system prefix
+        messages = prompt_builder.build_chat_messages(
+            rules=budget.rules,
+            knowledge=budget.knowledge,
             user_message=sanitized_message,
-            conversation_context=conversation_context
+            history=budget.history,
+            knowledge_generation=generation
         )
-        
-        prompt = SecurityValidator.limit_context_size(prompt)
+        timer.lap("prompt_build")
         
         if config.debug_mode:
-            debug_info["prompt_length"] = len(prompt)
-            # Only show prompt preview in debug mode, never in production
-            if config.debug_mode:
-                debug_info["prompt_preview"] = prompt[:200] + "..." if len(prompt) > 200 else prompt
+            debug_info["prompt_length"] = sum(len(m["content"]) for m in messages)
+            debug_info["message_count"] = len(messages)
+            debug_info["prompt_tokens_estimate"] = budget.tokens
+            debug_info["dropped_units"] = budget.dropped
         
-        # Get response from Grok with retries
-        response, token_usage = await _get_response_with_retry(grok_client, prompt, session_id)
+        # Get response from Grok with retries, within the admission limit
+        async with admission_controller.slot_async(_admission_priority(session_id, sanitized_message)):
+            timer.lap("admission")
+            response, token_usage = await _get_response_with_retry(
+                grok_client, messages, session_id, config.generation_profile(CHAT_STAGE)
+            )
+        timer.lap("upstream")
+        
+        if token_usage:
+            await _off_loop(token_accountant.shared_backend, token_accountant.record,
+                            CHAT_STAGE, "grok", token_usage, session_id,
+                            saved={"prompt_budget": budget.dropped["tokens"]})
         
         # Check if medical disclaimer is required
-        if medical_safety.requires_medical_disclaimer(sanitized_message, relevant_knowledge):
+        disclaimer_added = medical_safety.requires_medical_disclaimer(sanitized_message, relevant_knowledge)
+        if disclaimer_added:
             response = medical_safety.add_medical_disclaimer(response)
+        timer.lap("disclaimer")
         
         # Add to conversation history
         conversation_manager.add_message(session_id, sanitized_message, response)
         
         # Log successful interaction (no sensitive data)
-        processing_time = time.time() - start_time
+        processing_time = timer.elapsed()
         logger.log_chat(session_id, sanitized_message, response, processing_time, client_ip)
-        observability_metrics.record_request(processing_time)
         
         if config.log_token_usage and token_usage:
             logger.chat_logger.info(f"Token usage - Session: {session_id[:8]}***, Tokens: {token_usage}")
+        timer.lap("logging")
+        observability_metrics.record_request(processing_time)
         
         if config.debug_mode:
             debug_info.update({
                 "processing_time": processing_time,
                 "token_usage": token_usage,
-                "medical_disclaimer_added": medical_safety.requires_medical_disclaimer(sanitized_message, relevant_knowledge)
+                "medical_disclaimer_added": disclaimer_added,
+                "traceparent": tracer.traceparent()
             })
         
         return ChatResponse(
@@ -155,13 +287,18 @@ async def chat(request: ChatRequest, http_request: Request):
             debug_info=debug_info if config.debug_mode else None
         )
         
+    except Overloaded as e:
+        # Shed, not the client's fault: no abuse error, just a fast retryable 503
+        observability_metrics.record_error(f"overloaded_{e.reason}")
+        raise HTTPException(status_code=503, detail="Server busy, please retry",
+                            headers={"Retry-After": str(e.retry_after)})
     except HTTPException:
-        abuse_detector.log_error(client_ip)
+        await _off_loop(abuse_detector.shared, abuse_detector.log_error, client_ip)
         observability_metrics.record_error("http_exception")
         raise
     except Exception as e:
         logger.log_api_error("chat_endpoint", e, {"session_id": session_id})
-        abuse_detector.log_error(client_ip)
+        await _off_loop(abuse_detector.shared, abuse_detector.log_error, client_ip)
         observability_metrics.record_error("general_exception")
         return ChatResponse(
             response="I'm experiencing technical difficulties. Please try again.",
@@ -172,11 +309,11 @@ async def chat(request: ChatRequest, http_request: Request):
 @router.post("/expand-knowledge")
 @limiter.limit("10/hour")
 async def expand_knowledge(
-    request: KnowledgeExpansionRequest, 
-    http_request: Request,
+    expansion: KnowledgeExpansionRequest,
+    request: Request,
     x_admin_key: Optional[str] = Header(None)
 ):
-    client_ip = get_remote_address(http_request)
+    client_ip = get_remote_address(request)
     
     # Check if knowledge expansion is enabled
     if not config.expand_knowledge_enabled:
@@ -186,23 +323,19 @@ async def expand_knowledge(
         raise HTTPException(status_code=403, detail="Knowledge expansion is disabled")
     
     # Validate admin key
-    if config.admin_api_key and x_admin_key != config.admin_api_key:
-        logger.log_security_event("invalid_admin_key", client_ip, {
-            "provided_key_length": len(x_admin_key) if x_admin_key else 0
-        })
-        raise HTTPException(status_code=401, detail="Invalid admin key")
+    _require_admin_key(client_ip, x_admin_key)
     
     try:
         # Validate input length
-        if len(request.raw_text) > config.max_context_length:
+        if len(expansion.raw_text) > config.max_context_length:
             raise HTTPException(status_code=400, detail="Text too long")
         
         # Process with Gemini with retries
         structured_knowledge = await _expand_knowledge_with_retry(
-            gemini_client, 
-            request.raw_text, 
-            request.source_tag,
-            request.domain
+            _get_gemini_client(), 
+            expansion.raw_text, 
+            expansion.source_tag,
+            expansion.domain
         )
         
         # Validate output
@@ -210,8 +343,8 @@ async def expand_knowledge(
         
         if not validated_knowledge:
             logger.log_knowledge_expansion(
-                request.source_tag, 
-                len(request.raw_text), 
+                expansion.source_tag, 
+                len(expansion.raw_text), 
                 0, 
                 False
             )
@@ -219,15 +352,15 @@ async def expand_knowledge(
         
         # Add domain tags to knowledge entries
         for entry in validated_knowledge:
-            entry["domain"] = request.domain
+            entry["domain"] = expansion.domain
         
         # Save to expanded knowledge
         knowledge_manager.add_expanded_knowledge(validated_knowledge)
         
         # Log successful expansion
         logger.log_knowledge_expansion(
-            request.source_tag,
-            len(request.raw_text),
+            expansion.source_tag,
+            len(expansion.raw_text),
             len(validated_knowledge),
             True
         )
@@ -235,7 +368,7 @@ async def expand_knowledge(
         return {
             "status": "success", 
             "entries_added": len(validated_knowledge),
-            "domain": request.domain
+            "domain": expansion.domain
         }
         
     except HTTPException:
@@ -243,30 +376,159 @@ async def expand_knowledge(
         raise
     except Exception as e:
         logger.log_api_error("knowledge_expansion", e, {
-            "source_tag": request.source_tag,
-            "text_length": len(request.raw_text),
-            "domain": request.domain
+            "source_tag": expansion.source_tag,
+            "text_length": len(expansion.raw_text),
+            "domain": expansion.domain
         })
         observability_metrics.record_error("knowledge_expansion_general")
         raise HTTPException(status_code=500, detail="Knowledge expansion failed")
 
-async def _get_response_with_retry(client, prompt: str, session_id: str):
+@router.post("/admin/profile")
+async def start_profiling(
+    request: ProfilingRequest,
+    http_request: Request,
+    x_admin_key: Optional[str] = Header(None)
+):
+    """Profile the next N chat requests or T seconds, whichever ends first"""
+    client_ip = get_remote_address(http_request)
+    
+    _require_admin_key(client_ip, x_admin_key, required=True)
+    
+    try:
+        profiler.start(request.mode, request.max_requests, request.max_seconds, request.interval_ms)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    logger.log_security_event("profiling_started", client_ip, {"mode": request.mode})
+    return profiler.status()
+
+@router.get("/admin/profile")
+async def get_profile(
+    http_request: Request,
+    stop: bool = False,
+    x_admin_key: Optional[str] = Header(None)
+):
+    """Collapsed stacks collected so far (flamegraph.pl / speedscope input)"""
+    client_ip = get_remote_address(http_request)
+    _require_admin_key(client_ip, x_admin_key, required=True)
+    
+    if stop:
+        profiler.stop()
+    status = profiler.status()
+    return Response(profiler.collapsed(), media_type="text/plain", headers={
+        "X-Profiling-Active": str(status["active"]).lower(),
+        "X-Profiling-Requests": str(status["requests_profiled"])
+    })
+
+@router.get("/admin/memory")
+async def memory_report(
+    http_request: Request,
+    x_admin_key: Optional[str] = Header(None)
+):
+    """Entry counts and approximate deep sizes of in-process structures"""
+    _require_admin_key(get_remote_address(http_request), x_admin_key, required=True)
+    return {
+        "structures": memory_accountant.report(),
+        "process": process_memory(),
+        "tracemalloc": tracemalloc.is_tracing()
+    }
+
+@router.post("/admin/memory/tracemalloc")
+async def tracemalloc_control(
+    http_request: Request,
+    action: str = "diff",
+    top: int = 20,
+    x_admin_key: Optional[str] = Header(None)
+):
+    """Start tracing (baseline snapshot), diff against the baseline, or stop"""
+    _require_admin_key(get_remote_address(http_request), x_admin_key, required=True)
+    if action == "start":
+        memory_accountant.start_tracemalloc()
+        return {"status": "started"}
+    if action == "stop":
+        memory_accountant.stop_tracemalloc()
+        return {"status": "stopped"}
+    if action == "diff":
+        try:
+            return {"top": memory_accountant.tracemalloc_diff(top)}
+        except RuntimeError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    raise HTTPException(status_code=400, detail="Unknown action")
+
+@router.get("/admin/traces")
+async def recent_traces(
+    http_request: Request,
+    limit: int = 20,
+    min_duration_ms: float = 0.0,
+    x_admin_key: Optional[str] = Header(None)
+):
+    """Most recent finished traces, newest first"""
+    _require_admin_key(get_remote_address(http_request), x_admin_key, required=True)
+    return {"traces": trace_ring.recent(limit, min_duration_ms)}
+
+@router.get("/admin/traces/{trace_id}")
+async def get_trace(
+    trace_id: str,
+    http_request: Request,
+    x_admin_key: Optional[str] = Header(None)
+):
+    """One trace with all of its spans"""
+    _require_admin_key(get_remote_address(http_request), x_admin_key, required=True)
+    trace = trace_ring.get(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace
+
+def _require_admin_key(client_ip: str, x_admin_key: Optional[str], required: bool = False):
+    """Reject requests without the configured admin key.
+    
+    Diagnostic endpoints pass ``required`` so they stay closed when no key is configured.
+    """
+    if required and not config.admin_api_key:
+        raise HTTPException(status_code=403, detail="This endpoint requires ADMIN_API_KEY")
+    if config.admin_api_key and x_admin_key != config.admin_api_key:
+        logger.log_security_event("invalid_admin_key", client_ip, {
+            "provided_key_length": len(x_admin_key) if x_admin_key else 0
+        })
+        raise HTTPException(status_code=401, detail="Invalid admin key")
+
+async def _off_loop(shared_store, func, *args, **kwargs):
+    """Call ``func`` in a thread when it talks to a shared store (SQLite/Redis
+    calls block); purely in-process calls are cheaper inline"""
+    if shared_store is None:
+        return func(*args, **kwargs)
+    return await asyncio.to_thread(func, *args, **kwargs)
+
+def _admission_priority(session_id: str, message: str) -> str:
+    """Emergencies first, then sessions already in conversation, then new ones"""
+    signals = stage_classifier.signals(stage_classifier.normalize(message), len(message.split()))
+    if "emergency" in signals:
+        return "emergency"
+    return "active" if session_id in conversation_manager.conversations else "new"
+
+async def _get_response_with_retry(client, messages: List[Dict], session_id: str,
+                                  profile: Optional[GenerationProfile] = None):
     """Get response with retry logic and fallback"""
     last_error = None
     
     for attempt in range(config.max_retries):
-        try:
-            response, token_usage = await client.chat(prompt)
-            return response, token_usage
-        except Exception as e:
-            last_error = e
-            observability_metrics.record_api_failure("grok_api")
-            if attempt < config.max_retries - 1:
-                await asyncio.sleep(config.retry_delay * (attempt + 1))
-            logger.log_api_error("grok_api", e, {
-                "session_id": session_id,
-                "attempt": attempt + 1
-            })
+        # Retries cascade to the profile's fallback model when one is configured
+        if attempt > 0 and profile and profile.fallback_model:
+            profile = profile.copy(update={"model": profile.fallback_model, "fallback_model": None})
+        with tracer.span("upstream.attempt", attempt=attempt + 1) as span:
+            try:
+                response, token_usage = await client.chat(messages, profile)
+                return response, token_usage
+            except Exception as e:
+                span.record_error(e)
+                last_error = e
+                observability_metrics.record_api_failure("grok_api")
+                logger.log_api_error("grok_api", e, {
+                    "session_id": session_id,
+                    "attempt": attempt + 1
+                })
+        if attempt < config.max_retries - 1:
+            await asyncio.sleep(config.retry_delay * (attempt + 1))
     
     # Fallback response
     return "I'm having trouble connecting to my AI service. Please try again in a moment.", None
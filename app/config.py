@@ -1,16 +1,25 @@
 import os
-from typing import Optional
-from pydantic import BaseSettings
+from typing import Dict, List, Optional
+from pydantic import BaseModel, BaseSettings
 from dotenv import load_dotenv
 
 # Load .env from project root and app directory
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.dirname(__file__)), ".env"), override=False)
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), ".env"), override=False)
 
+class GenerationProfile(BaseModel):
+    """Sampling settings for one kind of chat completion"""
+    model: str
+    max_tokens: int = 1000
+    temperature: float = 0.7
+    stop: Optional[List[str]] = None
+    # Model to use for retries when the primary model fails
+    fallback_model: Optional[str] = None
+
 class AppConfig(BaseSettings):
-    # API Keys
-    grok_api_key: str
-    gemini_api_key: str
+    # API Keys (checked by validate_required_keys and the provider clients)
+    grok_api_key: str = ""
+    gemini_api_key: str = ""
     admin_api_key: Optional[str] = None
     
     # Server Configuration
@@ -36,11 +45,29 @@ class AppConfig(BaseSettings):
     rate_limit_requests: int = 60
     rate_limit_window: int = 60
     expand_knowledge_enabled: bool = False
+    abuse_tracker_max_keys: int = 10000
+    # Rate limit and abuse counters shared by all workers:
+    # sqlite:////path/state.db (one node) or redis://host:6379/0 (many nodes)
+    shared_state_url: Optional[str] = None
     
     # API Settings
     api_timeout: int = 30
     max_retries: int = 3
     retry_delay: float = 1.0
+    # Pooled upstream connections per worker (each waiting chat request holds one)
+    upstream_max_connections: int = 500
+    upstream_max_keepalive_connections: int = 100
+    # Idle seconds before a pooled connection closes (httpx defaults to 5,
+    # which would drop the warm-up connections before the first request)
+    upstream_keepalive_expiry: float = 90.0
+    # Upstream connections opened during warm-up, before /ready reports ready
+    warm_upstream_connections: int = 2
+    # Admission control per worker: requests waiting on the provider beyond
+    # max_in_flight queue (emergency first, then active, then new sessions);
+    # beyond max_queue, or after max_wait_seconds, they get a 503 + Retry-After
+    admission_max_in_flight: int = 64
+    admission_max_queue: int = 128
+    admission_max_wait_seconds: float = 10.0
     
     # Widget Settings
     allowed_origins: str = "*"
@@ -51,13 +78,78 @@ class AppConfig(BaseSettings):
     max_conversation_history: int = 10
     conversation_token_limit: int = 4000
     
+    # Prompt token budgets per conversation stage ("default" covers the rest)
+    prompt_token_budgets: Dict[str, int] = {
+        "default": 4000,
+        "greeting": 2500,
+        "symptom_gathering": 3000,
+        "follow_up_questions": 3000,
+        "conclusion": 5000,
+        "emergency_conclusion": 3000,
+        "goodbye": 2500
+    }
+    rules_token_budget: int = 2000
+    knowledge_token_share: float = 0.4
+    
+    # Generation profiles per conversation stage ("default" covers the rest).
+    # Question-asking stages get short output caps; conclusion gets the larger model.
+    generation_profiles: Dict[str, GenerationProfile] = {
+        "default": GenerationProfile(model="llama-3.1-8b-instant", max_tokens=1000, temperature=0.7),
+        "greeting": GenerationProfile(model="llama-3.1-8b-instant", max_tokens=120, temperature=0.8),
+        "symptom_gathering": GenerationProfile(model="llama-3.1-8b-instant", max_tokens=150, temperature=0.5,
+                                               stop=["\nUser:"]),
+        "follow_up_questions": GenerationProfile(model="llama-3.1-8b-instant", max_tokens=150, temperature=0.5,
+                                                 stop=["\nUser:"]),
+        "conclusion": GenerationProfile(model="llama-3.3-70b-versatile", max_tokens=1200, temperature=0.6,
+                                        fallback_model="llama-3.1-8b-instant"),
+        "emergency_conclusion": GenerationProfile(model="llama-3.1-8b-instant", max_tokens=300, temperature=0.2),
+        "goodbye": GenerationProfile(model="llama-3.1-8b-instant", max_tokens=120, temperature=0.8)
+    }
+    conversation_hot_turns: int = 4
+    compress_cold_turns: bool = False
+    
     # Logging
     log_token_usage: bool = False
+    # Records waiting for the background log writer; more are dropped and counted
+    log_queue_size: int = 10000
+    log_batch_size: int = 256
+    # Log sinks rotate at whichever cap is hit first; rotated segments are
+    # compressed ("gzip", "zstd" if installed, or "none") and pruned
+    log_max_bytes: int = 10 * 1024 * 1024
+    log_max_age_seconds: int = 86400
+    log_backup_count: int = 14
+    log_retention_days: int = 14
+    log_compression: str = "gzip"
+    
+    # Metrics: with several workers, each publishes snapshots to this
+    # directory and /metrics merges them
+    metrics_dir: Optional[str] = None
+    metrics_publish_interval: float = 5.0
+    # Token accounting: daily rollup files and budgets (0 = unlimited). Requests
+    # over budget are shed before reaching the provider.
+    token_rollup_dir: Optional[str] = "logs/token_usage"
+    token_rollup_interval: float = 300.0
+    session_token_budget: int = 0
+    daily_token_budget: int = 0
+    # Tracing: fraction of requests traced (callers' traceparent decisions are
+    # honoured), plus every request slower than the threshold (0 disables).
+    # Finished traces are kept in memory and written to logs/traces.jsonl.
+    trace_sample_rate: float = 0.01
+    trace_slow_threshold_ms: float = 2000.0
+    trace_ring_size: int = 200
+    trace_to_file: bool = True
+    # Seconds between memory accounting reports (0 disables the periodic report)
+    memory_report_interval: float = 60.0
     
     class Config:
         env_file = ".env"
         case_sensitive = False
 
+    def generation_profile(self, stage: str = "default") -> GenerationProfile:
+        """Get the generation profile for a conversation stage"""
+        profile = self.generation_profiles.get(stage) or self.generation_profiles.get("default")
+        return profile or GenerationProfile(model=self.grok_model)
+    
     def validate_required_keys(self):
         """Validate that required API keys are present"""
         if not self.grok_api_key:
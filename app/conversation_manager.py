@@ -1,71 +1,71 @@
 from typing import List, Dict, Optional
 from config import get_config
+from conversation_turns import SessionHistory, Turn
 from logger import logger
+from token_budget import count_tokens
+from tracing import tracer
 import json
 
 config = get_config()
 
 class ConversationManager:
     def __init__(self):
-        self.conversations: Dict[str, List[Dict]] = {}
+        self.conversations: Dict[str, SessionHistory] = {}
     
+    @tracer.traced("conversation.add_message")
     def add_message(self, session_id: str, user_message: str, bot_response: str):
         """Add message pair to conversation history"""
         if session_id not in self.conversations:
-            self.conversations[session_id] = []
+            self.conversations[session_id] = SessionHistory(
+                hot_turns=config.conversation_hot_turns,
+                compress_cold=config.compress_cold_turns
+            )
         
-        self.conversations[session_id].append({
-            "user": user_message,
-            "bot": bot_response,
-            "timestamp": self._get_timestamp()
-        })
+        self.conversations[session_id].add_turn(user_message, bot_response)
         
         # Trim if exceeds limits
         self._trim_conversation(session_id)
     
-    def get_conversation_context(self, session_id: str, max_tokens: int = None) -> str:
-        """Get conversation history as context string with token limits"""
+    @tracer.traced("conversation.get_turns")
+    def get_conversation_turns(self, session_id: str, max_tokens: int = None) -> List[Turn]:
+        """Get the most recent complete turns that fit within the token limit, oldest first"""
         if session_id not in self.conversations:
-            return ""
+            return []
         
         max_tokens = max_tokens or config.conversation_token_limit
         conversation = self.conversations[session_id]
         
-        # Build context from most recent messages
-        context_parts = []
+        turns = []
         estimated_tokens = 0
         
-        for message in reversed(conversation):
-            user_part = f"User: {message['user']}"
-            bot_part = f"Assistant: {message['bot']}"
-            
-            # Rough token estimation (4 chars ≈ 1 token)
-            part_tokens = (len(user_part) + len(bot_part)) // 4
+        for turn in reversed(list(conversation)):
+            part_tokens = count_tokens(turn.user) + count_tokens(turn.bot or "")
             
             if estimated_tokens + part_tokens > max_tokens:
                 break
             
-            context_parts.insert(0, user_part)
-            context_parts.insert(0, bot_part)
+            turns.append(turn)
             estimated_tokens += part_tokens
         
-        return "\n".join(context_parts) if context_parts else ""
+        turns.reverse()
+        return turns
+    
+    def get_conversation_context(self, session_id: str, max_tokens: int = None) -> str:
+        """Get conversation history as context string with token limits"""
+        context_parts = []
+        for turn in self.get_conversation_turns(session_id, max_tokens):
+            context_parts.append(f"User: {turn.user}")
+            context_parts.append(f"Assistant: {turn.bot}")
+        
+        return "\n".join(context_parts)
     
     def _trim_conversation(self, session_id: str):
         """Trim conversation to stay within limits"""
         if session_id not in self.conversations:
             return
         
-        conversation = self.conversations[session_id]
-        
         # Keep only recent messages
-        if len(conversation) > config.max_conversation_history:
-            self.conversations[session_id] = conversation[-config.max_conversation_history:]
-    
-    def _get_timestamp(self) -> str:
-        """Get current timestamp"""
-        from datetime import datetime
-        return datetime.utcnow().isoformat()
+        self.conversations[session_id].trim(config.max_conversation_history)
     
     def clear_conversation(self, session_id: str):
         """Clear conversation history for session"""
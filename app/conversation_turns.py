@@ -0,0 +1,131 @@
+import json
+import time
+import zlib
+from typing import Iterator, List, Optional, Tuple
+
+
+class Turn:
+    """Single user/assistant exchange with minimal per-object overhead"""
+
+    __slots__ = ("user", "bot", "timestamp")
+
+    def __init__(self, user: str, bot: Optional[str] = None, timestamp: Optional[float] = None):
+        self.user = user
+        self.bot = bot
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    def as_tuple(self) -> Tuple[str, Optional[str], float]:
+        return (self.user, self.bot, self.timestamp)
+
+    def to_dict(self) -> dict:
+        """Expanded representation for debugging and export"""
+        return {"user": self.user, "bot": self.bot, "timestamp": self.timestamp}
+
+    def __repr__(self) -> str:
+        return f"Turn(user={self.user!r}, bot={self.bot!r}, timestamp={self.timestamp!r})"
+
+
+class SessionHistory:
+    """Ordered turns of one session, optionally keeping older turns zlib-compressed.
+
+    The most recent ``hot_turns`` turns stay as ``Turn`` objects. When
+    ``compress_cold`` is enabled, older turns are packed ``cold_chunk`` at a
+    time into compressed blobs and only expanded when the full history is read.
+    """
+
+    __slots__ = ("_hot", "_cold", "_cold_count", "hot_turns", "cold_chunk", "compress_cold")
+
+    def __init__(self, hot_turns: int = 4, cold_chunk: int = 4, compress_cold: bool = False):
+        self._hot: List[Turn] = []
+        self._cold: List[Tuple[int, bytes]] = []
+        self._cold_count = 0
+        self.hot_turns = hot_turns
+        self.cold_chunk = max(cold_chunk, 1)
+        self.compress_cold = compress_cold
+
+    def __len__(self) -> int:
+        return self._cold_count + len(self._hot)
+
+    def __iter__(self) -> Iterator[Turn]:
+        for _, blob in self._cold:
+            for user, bot, timestamp in self._unpack(blob):
+                yield Turn(user, bot, timestamp)
+        yield from self._hot
+
+    def add_turn(self, user: str, bot: Optional[str] = None) -> Turn:
+        """Append a new turn; ``bot`` may be filled in later via ``set_response``"""
+        turn = Turn(user, bot)
+        self._hot.append(turn)
+        self._maybe_compress()
+        return turn
+
+    def set_response(self, bot: str):
+        """Attach the assistant reply to the most recent turn"""
+        if self._hot:
+            self._hot[-1].bot = bot
+
+    def pop_turn(self) -> Optional[Turn]:
+        """Remove the most recent turn, e.g. when its request was shed"""
+        return self._hot.pop() if self._hot else None
+
+    def recent(self, count: int) -> List[Turn]:
+        """Return the newest ``count`` turns, touching cold storage only if needed"""
+        if count <= len(self._hot):
+            return self._hot[len(self._hot) - count:] if count > 0 else []
+        return list(self)[-count:]
+
+    def trim(self, max_turns: int):
+        """Drop the oldest turns so at most ``max_turns`` remain"""
+        excess = len(self) - max_turns
+        if excess <= 0:
+            return
+
+        while self._cold and excess > 0:
+            count, blob = self._cold[0]
+            if count <= excess:
+                self._cold.pop(0)
+                self._cold_count -= count
+                excess -= count
+            else:
+                remaining = self._unpack(blob)[excess:]
+                self._cold[0] = (len(remaining), self._pack(remaining))
+                self._cold_count -= excess
+                excess = 0
+
+        if excess > 0:
+            del self._hot[:excess]
+
+    def clear(self):
+        self._hot.clear()
+        self._cold.clear()
+        self._cold_count = 0
+
+    def render(self) -> str:
+        """Render the history as ``User:``/``Assistant:`` lines"""
+        lines = []
+        for turn in self:
+            lines.append(f"User: {turn.user}")
+            if turn.bot is not None:
+                lines.append(f"Assistant: {turn.bot}")
+        return "\n".join(lines)
+
+    def _maybe_compress(self):
+        if not self.compress_cold or len(self._hot) < self.hot_turns + self.cold_chunk:
+            return
+
+        # Only complete turns are ever moved to cold storage
+        chunk = self._hot[:self.cold_chunk]
+        if any(turn.bot is None for turn in chunk):
+            return
+
+        self._cold.append((len(chunk), self._pack([turn.as_tuple() for turn in chunk])))
+        self._cold_count += len(chunk)
+        del self._hot[:self.cold_chunk]
+
+    @staticmethod
+    def _pack(rows: List[Tuple[str, Optional[str], float]]) -> bytes:
+        return zlib.compress(json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+    @staticmethod
+    def _unpack(blob: bytes) -> List[Tuple[str, Optional[str], float]]:
+        return [tuple(row) for row in json.loads(zlib.decompress(blob).decode("utf-8"))]
@@ -0,0 +1,42 @@
+import gc
+import os
+
+# gunicorn -c gunicorn.conf.py asgi:app   (run from app/)
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+# One worker by default: conversation history, the slowapi limiter and
+# per-session token budgets live in process memory, so with more workers a
+# session's turns land on random workers (losing history) and those limits
+# are multiplied by the worker count. SHARED_STATE_URL only shares the abuse
+# counters and the daily token budget.
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = 60
+graceful_timeout = 30
+
+# Import the app and build read-only state once in the master; workers share
+# it copy-on-write. The collector stays off in the master until the state is
+# frozen, so it never touches (and dirties) pages the workers will share.
+preload_app = os.getenv("PRELOAD_APP", "true").lower() != "false"
+if preload_app:
+    gc.disable()
+
+
+def on_starting(server):
+    if workers > 1:
+        server.log.warning(f"{workers} workers: conversation history and per-session limits "
+                           "are per worker, so sessions lose context between turns")
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    import preload
+    summary = preload.warm_up()
+    preload.freeze_shared_state()
+    server.log.info(f"Preloaded shared state: {summary}, {gc.get_freeze_count()} objects frozen")
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import preload
+        preload.after_fork()
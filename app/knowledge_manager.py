@@ -6,6 +6,7 @@ from pathlib import Path
 from datetime import datetime
 from config import get_config
 from logger import logger
+from tracing import tracer
 
 config = get_config()
 
@@ -16,6 +17,12 @@ class KnowledgeManager:
         self.expanded_knowledge_file = self.knowledge_dir / "expanded_knowledge.json"
         self.backup_dir = self.knowledge_dir / "backups"
         
+        # Parsed knowledge is reused until either file changes on disk;
+        # ``generation`` increments on every reload so derived caches can expire
+        self.generation = 0
+        self._knowledge_cache = None
+        self._knowledge_signature = None
+        
         # Ensure directories exist
         self.knowledge_dir.mkdir(exist_ok=True)
         self.backup_dir.mkdir(exist_ok=True)
@@ -84,12 +91,29 @@ class KnowledgeManager:
         except Exception as e:
             logger.error_logger.error(f"Failed to cleanup backups: {e}")
     
+    def _file_signature(self):
+        """Modification time and size of both knowledge files"""
+        signature = []
+        for file_path in (self.core_knowledge_file, self.expanded_knowledge_file):
+            try:
+                stat = file_path.stat()
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+    
     def load_all_knowledge(self) -> List[Dict]:
-        """Load both core and expanded knowledge"""
-        core = self._load_json(self.core_knowledge_file)
-        expanded = self._load_json(self.expanded_knowledge_file)
-        return core + expanded
+        """Load both core and expanded knowledge (shared cached list - do not mutate)"""
+        signature = self._file_signature()
+        if self._knowledge_cache is None or signature != self._knowledge_signature:
+            core = self._load_json(self.core_knowledge_file)
+            expanded = self._load_json(self.expanded_knowledge_file)
+            self._knowledge_cache = core + expanded
+            self._knowledge_signature = signature
+            self.generation += 1
+        return self._knowledge_cache
     
+    @tracer.traced("knowledge.find_relevant")
     def find_relevant_knowledge(self, user_message: str, max_results: int = 5) -> List[Dict]:
         """Find knowledge entries relevant to user message with improved ranking"""
         all_knowledge = self.load_all_knowledge()
@@ -155,6 +179,7 @@ class KnowledgeManager:
         current_expanded = self._load_json(self.expanded_knowledge_file)
         current_expanded.extend(new_entries)
         self._save_json_atomic(self.expanded_knowledge_file, current_expanded)
+        self._knowledge_cache = None
     
     def add_core_knowledge(self, new_entries: List[Dict]):
         """Add new entries to core knowledge with atomic write"""
@@ -163,4 +188,5 @@ class KnowledgeManager:
         
         current_core = self._load_json(self.core_knowledge_file)
         current_core.extend(new_entries)
-        self._save_json_atomic(self.core_knowledge_file, current_core)
\ No newline at end of file
+        self._save_json_atomic(self.core_knowledge_file, current_core)
+        self._knowledge_cache = None
\ No newline at end of file
@@ -0,0 +1,130 @@
+from array import array
+from typing import Dict, List
+
+
+class LatencyHistogram:
+    """Fixed-memory log-linear latency histogram (HDR-style).
+
+    Values are recorded in microseconds. Each power-of-two range is split
+    into ``2 ** (precision_bits - 1)`` linear sub-buckets, so any reported
+    percentile is within about ``2 ** -precision_bits`` of the true value
+    while memory stays a single array of a few hundred counters.
+    """
+
+    PERCENTILES = (("p50", 50.0), ("p90", 90.0), ("p99", 99.0), ("p999", 99.9))
+
+    def __init__(self, max_seconds: float = 120.0, precision_bits: int = 6):
+        self.precision_bits = precision_bits
+        self._sub_buckets = 1 << precision_bits
+        self._half = self._sub_buckets >> 1
+        self._max_value = int(max_seconds * 1_000_000)
+        self._counts = array("Q", bytes(8 * (self._index(self._max_value) + 1)))
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def _index(self, value: int) -> int:
+        if value < self._sub_buckets:
+            return value
+        shift = value.bit_length() - self.precision_bits
+        return self._half * shift + (value >> shift)
+
+    def _bucket_bounds(self, index: int):
+        """Lowest value and width of a bucket, in microseconds"""
+        if index < self._sub_buckets:
+            return index, 1
+        shift = index // self._half - 1
+        return (index - self._half * shift) << shift, 1 << shift
+
+    def record(self, seconds: float):
+        """Record one latency sample given in seconds"""
+        value = min(max(int(seconds * 1_000_000), 0), self._max_value)
+        self._counts[self._index(value)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, percent: float) -> float:
+        """Latency in seconds below which ``percent`` of the samples fall"""
+        if not self.count:
+            return 0.0
+        rank = max(1, -(-self.count * percent // 100))
+        seen = 0
+        for index, bucket_count in enumerate(self._counts):
+            if not bucket_count:
+                continue
+            seen += bucket_count
+            if seen >= rank:
+                low, width = self._bucket_bounds(index)
+                # Report the bucket midpoint, never above the largest sample seen
+                return min((low + width / 2) / 1_000_000, self.max)
+        return self.max
+
+    def merge(self, other: "LatencyHistogram"):
+        """Add another histogram with the same layout into this one"""
+        if len(other._counts) != len(self._counts):
+            raise ValueError("Cannot merge histograms with different layouts")
+        for index, bucket_count in enumerate(other._counts):
+            if bucket_count:
+                self._counts[index] += bucket_count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def count_at_or_below(self, bounds: List[float]) -> List[int]:
+        """Cumulative sample counts for ascending upper bounds in seconds.
+
+        A bucket counts towards a bound only when its highest value is within
+        it, so a bound never over-counts; samples in a bucket straddling the
+        bound count towards the next bound (an error within the precision).
+        """
+        limits = [int(bound * 1_000_000) for bound in bounds]
+        totals = [0] * len(limits)
+        for index, bucket_count in enumerate(self._counts):
+            if not bucket_count:
+                continue
+            low, width = self._bucket_bounds(index)
+            high = low + width - 1
+            for position, limit in enumerate(limits):
+                if high <= limit:
+                    totals[position] += bucket_count
+        return totals
+
+    def to_dict(self) -> Dict:
+        """Compact state (non-empty buckets only) for export to other processes"""
+        return {
+            "max_seconds": self._max_value / 1_000_000,
+            "precision_bits": self.precision_bits,
+            "buckets": {index: count for index, count in enumerate(self._counts) if count},
+            "count": self.count,
+            "total": self.total,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict) -> "LatencyHistogram":
+        histogram = cls(max_seconds=state["max_seconds"], precision_bits=state["precision_bits"])
+        for index, count in state["buckets"].items():
+            histogram._counts[int(index)] = count
+        histogram.count = state["count"]
+        histogram.total = state["total"]
+        histogram.max = state["max"]
+        return histogram
+
+    def reset(self):
+        self._counts = array("Q", bytes(8 * len(self._counts)))
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def snapshot(self) -> Dict:
+        """Count, mean, max and p50/p90/p99/p999 in seconds"""
+        summary = {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+        }
+        for name, percent in self.PERCENTILES:
+            summary[name] = self.percentile(percent)
+        return summary
@@ -0,0 +1,318 @@
+import gzip
+import io
+import json
+import logging
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; gzip is always available
+    zstandard = None
+
+SEGMENT_SUFFIX = ".jsonl"
+COMPRESSED_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+# A rotated segment is compressed only after it has gone unmodified this long,
+# so other workers can flush their last batch into it and reopen first
+SETTLE_SECONDS = 2.0
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per line: timestamp, level, then the message fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.utcfromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+        }
+        if isinstance(record.msg, dict):
+            entry.update(record.msg)
+        else:
+            entry["message"] = record.getMessage()
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry)
+
+
+class SegmentCompressor:
+    """Background thread that compresses rotated segments and applies retention"""
+
+    def __init__(self, settle_seconds: float = SETTLE_SECONDS):
+        self.settle_seconds = settle_seconds
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, segment: Path, sink: "RotatingJsonlHandler"):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="log-compressor", daemon=True)
+                self._thread.start()
+        self._queue.put((segment, sink))
+
+    def wait(self):
+        """Block until every submitted segment has been processed"""
+        self._queue.join()
+
+    def after_fork(self):
+        """Drop the parent's queue and thread; a new thread starts on the next submit"""
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _run(self):
+        while True:
+            segment, sink = self._queue.get()
+            try:
+                self._wait_until_settled(segment)
+                compress_segment(segment, sink.compression)
+                sink.apply_retention()
+            except Exception as e:
+                print(f"Log segment compression failed for {segment}: {e}", file=sys.stderr)
+            finally:
+                self._queue.task_done()
+
+    def _wait_until_settled(self, segment: Path):
+        while True:
+            try:
+                idle = time.time() - segment.stat().st_mtime
+            except FileNotFoundError:
+                return
+            if idle >= self.settle_seconds:
+                return
+            time.sleep(self.settle_seconds - idle)
+
+
+segment_compressor = SegmentCompressor()
+
+
+def rotated_segments(directory: Path, name: str) -> List[Path]:
+    """Rotated (possibly compressed) segments of a sink, oldest first"""
+    return sorted(path for path in Path(directory).glob(f"{name}.*{SEGMENT_SUFFIX}*")
+                  if not path.name.endswith(".tmp"))
+
+
+def compress_segment(segment: Path, compression: str) -> Path:
+    """Compress a rotated segment next to itself and remove the original"""
+    if compression == "zstd" and zstandard is None:
+        compression = "gzip"
+    if compression not in COMPRESSED_SUFFIXES or not segment.exists():
+        return segment
+
+    target = segment.with_name(segment.name + COMPRESSED_SUFFIXES[compression])
+    partial = target.with_name(target.name + ".tmp")
+    with open(segment, "rb") as source, open(partial, "wb") as raw:
+        if compression == "zstd":
+            with zstandard.ZstdCompressor(level=6).stream_writer(raw) as writer:
+                shutil.copyfileobj(source, writer)
+        else:
+            with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6) as writer:
+                shutil.copyfileobj(source, writer)
+    os.replace(partial, target)
+    segment.unlink()
+    return target
+
+
+class RotatingJsonlHandler(logging.FileHandler):
+    """JSONL file sink rotated by size and age, with compressed, retained segments.
+
+    The active file is ``<name>.jsonl``. A segment is rotated once it exceeds
+    ``max_bytes`` or is older than ``max_age_seconds``; it is renamed to
+    ``<name>.<UTC time>.jsonl`` and handed to the background compressor, which
+    then drops segments beyond ``backup_count`` or ``retention_days``.
+    Flushing is left to the caller (the batching queue listener).
+
+    Several workers may share one sink: before each write the handler checks
+    that its open file is still the active one and reopens it if another
+    worker rotated it away, and it sizes segments by the shared file.
+    """
+
+    def __init__(self, directory: Path, name: str, max_bytes: int = 10 * 1024 * 1024,
+                 max_age_seconds: int = 86400, backup_count: int = 14, retention_days: int = 14,
+                 compression: str = "gzip"):
+        self.directory = Path(directory)
+        self.name_stem = name
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.backup_count = backup_count
+        self.retention_days = retention_days
+        self.compression = compression
+        super().__init__(self.directory / f"{name}{SEGMENT_SUFFIX}", encoding="utf-8")
+        self._segment_started = time.time()
+        self._segment_bytes = self._current_size()
+        self._inode = os.fstat(self.stream.fileno()).st_ino if self.stream else None
+
+        # Segments left uncompressed by an earlier run
+        for segment in self.segments():
+            if segment.name.endswith(SEGMENT_SUFFIX):
+                segment_compressor.submit(segment, self)
+
+    def _current_size(self) -> int:
+        try:
+            return os.path.getsize(self.baseFilename)
+        except OSError:
+            return 0
+
+    def segments(self) -> List[Path]:
+        """Rotated segments of this sink, oldest first"""
+        return rotated_segments(self.directory, self.name_stem)
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            line = self.format(record) + self.terminator
+            self._follow_active_file()
+            if self._should_rotate(record.created, len(line)):
+                self.rotate()
+            if self.stream is None:
+                self.stream = self._open()
+                self._inode = os.fstat(self.stream.fileno()).st_ino
+                self._segment_bytes = self._current_size()
+            self.stream.write(line)
+            self._segment_bytes += len(line)
+        except Exception:
+            self.handleError(record)
+
+    def _follow_active_file(self):
+        """Close our stream if another worker rotated the file; track the shared size"""
+        if self.stream is None:
+            return
+        try:
+            active = os.stat(self.baseFilename)
+        except FileNotFoundError:
+            active = None
+        if active is None or active.st_ino != self._inode:
+            # Our last batch was flushed into the rotated segment, which the
+            # compressor leaves alone until it settles
+            self.stream.close()
+            self.stream = None
+            self._segment_started = time.time()
+            self._segment_bytes = 0
+        else:
+            self._segment_bytes = max(self._segment_bytes, active.st_size)
+
+    def _should_rotate(self, now: float, incoming: int) -> bool:
+        if self._segment_bytes == 0:
+            return False
+        if self._segment_bytes + incoming > self.max_bytes:
+            return True
+        return self.max_age_seconds > 0 and now - self._segment_started > self.max_age_seconds
+
+    def rotate(self):
+        written_inode = None
+        if self.stream is not None:
+            written_inode = os.fstat(self.stream.fileno()).st_ino
+            self.stream.close()
+            self.stream = None
+        self._segment_started = time.time()
+        self._segment_bytes = 0
+
+        active = Path(self.baseFilename)
+        try:
+            if written_inode is not None and active.stat().st_ino != written_inode:
+                # Another worker already rotated the file we were writing
+                return
+        except FileNotFoundError:
+            return
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S.%f")
+        segment = active.with_name(f"{self.name_stem}.{stamp}{SEGMENT_SUFFIX}")
+        os.replace(active, segment)
+        segment_compressor.submit(segment, self)
+
+    def apply_retention(self):
+        """Remove segments beyond the count and age limits"""
+        segments = self.segments()
+        excess = len(segments) - self.backup_count if self.backup_count > 0 else 0
+        cutoff = time.time() - self.retention_days * 86400
+        for index, segment in enumerate(segments):
+            try:
+                if index < excess or (self.retention_days > 0 and segment.stat().st_mtime < cutoff):
+                    segment.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _open_segment(path: Path):
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.suffix == ".zst":
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is required to read {path}")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True),
+                                encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def read_log(directory: str, name: str, since: Optional[str] = None, until: Optional[str] = None,
+             level: Optional[str] = None, where: Optional[Dict[str, Any]] = None) -> Iterator[Dict]:
+    """Stream entries of one sink across rotated segments and the active file.
+
+    Compressed segments are decompressed on the fly. ``since``/``until`` are
+    ISO timestamps (prefixes such as ``2024-05-01`` work); ``where`` matches
+    top-level fields exactly. Lines that cannot match are rejected by a
+    substring test before being parsed.
+    """
+    paths = rotated_segments(Path(directory), name) + [Path(directory) / f"{name}{SEGMENT_SUFFIX}"]
+
+    where = dict(where or {})
+    if level:
+        where["level"] = level.upper()
+    needles = [f"{json.dumps(key)}: {json.dumps(value)}" for key, value in where.items()]
+
+    for path in paths:
+        if not path.exists():
+            continue
+        with _open_segment(path) as lines:
+            for line in lines:
+                if not all(needle in line for needle in needles):
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                timestamp = entry.get("timestamp", "")
+                if since and timestamp < since:
+                    continue
+                if until and timestamp[:len(until)] > until:
+                    continue
+                if all(entry.get(key) == value for key, value in where.items()):
+                    yield entry
+
+
+def _parse_where(pairs: List[str]) -> Dict[str, Any]:
+    where = {}
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        try:
+            where[key] = json.loads(value)
+        except json.JSONDecodeError:
+            where[key] = value
+    return where
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Stream and filter structured chatbot logs")
+    parser.add_argument("name", help="sink name: chat, errors, knowledge, security or traces")
+    parser.add_argument("--dir", default="logs")
+    parser.add_argument("--since")
+    parser.add_argument("--until")
+    parser.add_argument("--level")
+    parser.add_argument("--where", action="append", default=[], metavar="FIELD=VALUE")
+    parser.add_argument("--count", action="store_true", help="only print the number of matches")
+    args = parser.parse_args()
+
+    entries = read_log(args.dir, args.name, args.since, args.until, args.level, _parse_where(args.where))
+    if args.count:
+        print(sum(1 for _ in entries))
+    else:
+        for entry in entries:
+            print(json.dumps(entry))
@@ -1,57 +1,142 @@
+import atexit
 import logging
-import json
+import logging.handlers
 import os
-from datetime import datetime
+import queue
 from pathlib import Path
 from typing import Dict, Any
+from config import get_config
 from operational_safety import secret_masker
+from log_sinks import JsonLinesFormatter, RotatingJsonlHandler
+
+config = get_config()
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue records without formatting them; drop and count when the queue is full"""
+    
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting happens on the writer thread; only tracebacks must be
+        # rendered now, while they are still available
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+    
+    def emit(self, record: logging.LogRecord):
+        try:
+            self.enqueue(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """Write queued records to the handler of their logger, flushing once per batch"""
+    
+    def __init__(self, log_queue: queue.Queue, routes: Dict[str, logging.Handler], batch_size: int = 256):
+        super().__init__(log_queue, *routes.values())
+        self.routes = routes
+        self.batch_size = batch_size
+    
+    def handle(self, record: logging.LogRecord):
+        handler = self.routes.get(record.name)
+        if handler is not None and record.levelno >= handler.level:
+            handler.handle(record)
+    
+    def enqueue_sentinel(self):
+        # Block rather than drop: the sentinel must get through to stop the thread
+        self.queue.put(self._sentinel)
+    
+    def _monitor(self):
+        log_queue = self.queue
+        stopping = False
+        while not stopping:
+            batch = [log_queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(log_queue.get_nowait())
+                except queue.Empty:
+                    break
+            for record in batch:
+                if record is self._sentinel:
+                    stopping = True
+                else:
+                    self.handle(record)
+            for handler in self.handlers:
+                handler.flush()
 
 class ChatbotLogger:
     def __init__(self):
-        self.logs_dir = Path("logs")
-        self.logs_dir.mkdir(exist_ok=True)
+        self.logs_dir = Path(config.logs_dir)
+        self.logs_dir.mkdir(parents=True, exist_ok=True)
         
         # Configure loggers
         self.setup_loggers()
     
     def setup_loggers(self):
-        """Setup different loggers for different purposes"""
+        """Setup different loggers for different purposes.
+        
+        Loggers only enqueue records; a background listener formats them and
+        writes them in batches to rotating JSONL sinks (logs/<name>.jsonl), so
+        slow disks never block a request.
+        """
+        self.log_queue = queue.Queue(maxsize=config.log_queue_size)
+        self.queue_handler = DroppingQueueHandler(self.log_queue)
+        routes = {}
         
         # Chat logger - NO sensitive data
-        self.chat_logger = logging.getLogger('chatbot.chat')
-        self.chat_logger.setLevel(logging.INFO)
-        chat_handler = logging.FileHandler(self.logs_dir / 'chat.log')
-        chat_handler.setFormatter(logging.Formatter(
-            '%(asctime)s - %(levelname)s - %(message)s'
-        ))
-        self.chat_logger.addHandler(chat_handler)
+        self.chat_logger = self._queued_logger('chatbot.chat', logging.INFO, 'chat', routes)
         
         # API error logger - masked secrets
-        self.error_logger = logging.getLogger('chatbot.errors')
-        self.error_logger.setLevel(logging.ERROR)
-        error_handler = logging.FileHandler(self.logs_dir / 'errors.log')
-        error_handler.setFormatter(logging.Formatter(
-            '%(asctime)s - %(levelname)s - %(message)s'
-        ))
-        self.error_logger.addHandler(error_handler)
+        self.error_logger = self._queued_logger('chatbot.errors', logging.ERROR, 'errors', routes)
         
         # Knowledge expansion logger
-        self.knowledge_logger = logging.getLogger('chatbot.knowledge')
-        self.knowledge_logger.setLevel(logging.INFO)
-        knowledge_handler = logging.FileHandler(self.logs_dir / 'knowledge.log')
-        knowledge_handler.setFormatter(logging.Formatter(
-            '%(asctime)s - %(levelname)s - %(message)s'
-        ))
-        self.knowledge_logger.addHandler(knowledge_handler)
+        self.knowledge_logger = self._queued_logger('chatbot.knowledge', logging.INFO, 'knowledge', routes)
         
         # Security/abuse logger
-        self.security_logger = logging.getLogger('chatbot.security')
-        self.security_logger.setLevel(logging.WARNING)
-        security_handler = logging.FileHandler(self.logs_dir / 'security.log')
-        security_handler.setFormatter(logging.Formatter(
-            '%(asctime)s - %(levelname)s - %(message)s'
-        ))
-        self.security_logger.addHandler(security_handler)
+        self.security_logger = self._queued_logger('chatbot.security', logging.WARNING, 'security', routes)
+        
+        # Finished request traces (see tracing.py)
+        self.trace_logger = self._queued_logger('chatbot.traces', logging.INFO, 'traces', routes)
+        
+        self.listener = BatchingQueueListener(self.log_queue, routes, batch_size=config.log_batch_size)
+        self.listener.start()
+        atexit.register(self.shutdown)
+    
+    def _queued_logger(self, name: str, level: int, sink: str, routes: Dict[str, logging.Handler]) -> logging.Logger:
+        queued_logger = logging.getLogger(name)
+        queued_logger.setLevel(level)
+        queued_logger.addHandler(self.queue_handler)
+        
+        file_handler = RotatingJsonlHandler(
+            self.logs_dir, sink,
+            max_bytes=config.log_max_bytes,
+            max_age_seconds=config.log_max_age_seconds,
+            backup_count=config.log_backup_count,
+            retention_days=config.log_retention_days,
+            compression=config.log_compression
+        )
+        file_handler.setFormatter(JsonLinesFormatter())
+        routes[name] = file_handler
+        return queued_logger
+    
+    def after_fork(self):
+        """Give a forked worker its own queue and writer thread (threads do not survive fork)"""
+        self.log_queue = queue.Queue(maxsize=config.log_queue_size)
+        self.queue_handler.queue = self.log_queue
+        self.listener = BatchingQueueListener(self.log_queue, self.listener.routes, batch_size=config.log_batch_size)
+        self.listener.start()
+    
+    @property
+    def dropped_records(self) -> int:
+        return self.queue_handler.dropped
+    
+    def shutdown(self):
+        """Write out everything still queued and stop the listener thread"""
+        if self.listener._thread is not None:
+            self.listener.stop()
     
     def log_chat(self, session_id: str, user_message: str, bot_response: str, 
                  processing_time: float, ip_address: str = "unknown"):
@@ -61,10 +146,9 @@ class ChatbotLogger:
             'user_message_length': len(user_message),
             'bot_response_length': len(bot_response),
             'processing_time': processing_time,
-            'ip_hash': hash(ip_address) % 10000,  # Hash IP for privacy
-            'timestamp': datetime.utcnow().isoformat()
+            'ip_hash': hash(ip_address) % 10000  # Hash IP for privacy
         }
-        self.chat_logger.info(json.dumps(log_data))
+        self.chat_logger.info(log_data)
     
     def log_api_error(self, api_name: str, error: Exception, context: Dict[str, Any]):
         """Log API errors with masked secrets"""
@@ -80,10 +164,9 @@ class ChatbotLogger:
             'api': api_name,
             'error_type': type(error).__name__,
             'error_message': secret_masker.mask_secrets(str(error)),
-            'context': safe_context,
-            'timestamp': datetime.utcnow().isoformat()
+            'context': safe_context
         }
-        self.error_logger.error(json.dumps(log_data))
+        self.error_logger.error(log_data)
     
     def log_knowledge_expansion(self, source_tag: str, raw_text_length: int, 
                                entries_created: int, success: bool):
@@ -92,24 +175,22 @@ class ChatbotLogger:
             'source_tag': source_tag,
             'raw_text_length': raw_text_length,
             'entries_created': entries_created,
-            'success': success,
-            'timestamp': datetime.utcnow().isoformat()
+            'success': success
         }
-        self.knowledge_logger.info(json.dumps(log_data))
+        self.knowledge_logger.info(log_data)
     
     def log_security_event(self, event_type: str, ip_address: str, details: Dict[str, Any]):
         """Log security events and abuse attempts"""
         log_data = {
             'event_type': event_type,
             'ip_hash': hash(ip_address) % 10000,  # Hash IP for privacy
-            'details': details,
-            'timestamp': datetime.utcnow().isoformat()
+            'details': details
         }
-        self.security_logger.warning(json.dumps(log_data))
+        self.security_logger.warning(log_data)
     
     def log_observability(self, metrics: Dict[str, Any]):
         """Log system metrics for observability"""
-        self.chat_logger.info(f"METRICS: {json.dumps(metrics)}")
+        self.chat_logger.info({'metrics': metrics})
 
 # Global logger instance
 logger = ChatbotLogger()
\ No newline at end of file
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import os
 import json
@@ -6,16 +6,29 @@ import httpx
 import asyncio
 import uuid
 import time
-from dotenv import load_dotenv
+from conversation_turns import SessionHistory
+from stage_machine import stage_classifier
+from response_templates import ResponseTemplates
+from prompt_assembly import CompiledTemplate
+from token_budget import count_tokens, prompt_budget
+from token_accounting import token_accountant
+from config import get_config
+from memory_accounting import memory_accountant, process_memory
+from tracing import tracer
+from profiling import profiler
+from admission import admission_controller, Overloaded
+from static_assets import AssetBundle
 
-# Robust path handling for .env loading
+# .env files are loaded by config (imported above)
 basedir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(basedir)
-load_dotenv(dotenv_path=os.path.join(parent_dir, ".env"), override=False)
-load_dotenv(dotenv_path=os.path.join(basedir, ".env"), override=False)
 
 app = Flask(__name__)
 CORS(app)
+config = get_config()
+
+# Widget files minified, hashed and precompressed once at startup
+widget_assets = AssetBundle(os.path.join(parent_dir, "widget"))
 
 # Configuration
 GROK_API_KEY = os.getenv("GROK_API_KEY")
@@ -24,6 +37,13 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 # Simple conversation memory
 conversations = {}
 conversation_stages = {}
+memory_accountant.register("main_conversations", lambda: conversations)
+memory_accountant.register("main_conversation_stages", lambda: conversation_stages)
+
+# Stages answered locally without an LLM round trip (see rules/stage_templates.json)
+response_templates = ResponseTemplates(
+    os.getenv("STAGE_TEMPLATES_FILE", os.path.join(parent_dir, "rules", "stage_templates.json"))
+)
 
 @app.route('/')
 def root():
@@ -39,8 +59,38 @@ def health():
         }
     }
 
+@app.route('/admin/memory')
+def memory_report():
+    """Entry counts and approximate deep sizes of in-process structures"""
+    if not config.admin_api_key or request.headers.get('X-Admin-Key') != config.admin_api_key:
+        return jsonify({"error": "Invalid admin key"}), 401
+    return jsonify({"structures": memory_accountant.report(), "process": process_memory()})
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+def profile():
+    """POST starts profiling the next chat requests; GET returns the collapsed stacks"""
+    if not config.admin_api_key or request.headers.get('X-Admin-Key') != config.admin_api_key:
+        return jsonify({"error": "Invalid admin key"}), 401
+    if request.method == 'POST':
+        options = request.get_json(silent=True) or {}
+        try:
+            profiler.start(options.get("mode", "sample"), options.get("max_requests", 100),
+                           options.get("max_seconds", 30.0), options.get("interval_ms", 5.0))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify(profiler.status())
+    if request.args.get("stop") == "true":
+        profiler.stop()
+    return Response(profiler.collapsed(), mimetype="text/plain")
+
 @app.route('/chat', methods=['POST'])
 def chat():
+    # The stage is tagged once the stage machine has picked it
+    with profiler.request("/chat") as profiled, \
+            tracer.start_trace("POST /chat", request.headers.get("traceparent")):
+        return _handle_chat(profiled)
+
+def _handle_chat(profiled):
     try:
         data = request.get_json()
         message = data.get('message', '')
@@ -49,39 +99,54 @@ def chat():
         if not message:
             return jsonify({"error": "Message required"}), 400
         
+        # Shed load before the provider quota is hit
+        if token_accountant.check_budget(session_id):
+            return jsonify({"error": "Token budget exceeded"}), 429
+        
         # Get conversation history and stage
         if session_id not in conversations:
-            conversations[session_id] = []
+            conversations[session_id] = SessionHistory()
             conversation_stages[session_id] = "greeting"
         
         current_stage = conversation_stages[session_id]
+        history = conversations[session_id]
         
         # Add user message to history
-        conversations[session_id].append(f"User: {message}")
+        history.add_turn(message)
         
-        # Build context from conversation history (use full history for better context)
-        conversation_context = "\n".join(conversations[session_id])
+        # Render the history for stage detection (use full history for better context)
+        conversation_context = history.render()
         
         # Determine next stage based on current stage and user input
-        total_user_messages = len([msg for msg in conversations[session_id] if msg.startswith("User:")])
-        next_stage = determine_next_stage(current_stage, message, conversation_context, total_user_messages)
+        total_user_messages = len(history)
+        with tracer.span("stage_machine.next_stage"):
+            next_stage = determine_next_stage(current_stage, message, conversation_context, total_user_messages)
+        profiled.set_stage(next_stage)
         
         # Handle Session Reset
         if next_stage == "greeting" and (current_stage == "conclusion" or current_stage == "goodbye"):
             # Archive old conversation or just clear it
-            conversations[session_id] = [f"User: {message}"] # Keep just the new greeting
-            conversation_context = f"User: {message}" # Reset context for the API call
+            history.clear()
+            history.add_turn(message) # Keep just the new greeting
             
             # Important: Ensure we don't accidentally pull in old relevant knowledge
             # (Though call_groq_api re-evaluates relevant_knowledge based on current message anyway)
             
         conversation_stages[session_id] = next_stage
         
-        # Simple chat response using httpx
-        response = call_groq_api(message, conversation_context, current_stage, next_stage)
+        # Simple chat response using httpx; earlier turns go upstream as real
+        # messages and the current one is sent once, as the final user message
+        previous_turns = history.recent(len(history))[:-1]
+        try:
+            response = call_groq_api(message, previous_turns, current_stage, next_stage, session_id)
+        except Overloaded as e:
+            # Shed before reaching the provider: undo this turn so the retry starts clean
+            history.pop_turn()
+            conversation_stages[session_id] = current_stage
+            return jsonify({"error": "Server busy, please retry"}), 503, {"Retry-After": str(e.retry_after)}
         
         # Add bot response to conversation history
-        conversations[session_id].append(f"Assistant: {response}")
+        history.set_response(response)
         
         # Add stage info for debugging
         debug_info = {"current_stage": current_stage, "next_stage": next_stage} if os.getenv("DEBUG") else None
@@ -104,103 +169,24 @@ def chat():
 
 def determine_next_stage(current_stage, message, context, user_message_count):
     """Determine conversation flow stage using smart logic"""
-    message_lower = message.lower().strip().strip('.,!?')
-    
-    # Emergency keywords - skip to conclusion
-    emergency_keywords = ["chest pain", "can't breathe", "severe bleeding", "emergency"]
-    if any(keyword in message_lower for keyword in emergency_keywords):
-        return "emergency_conclusion"
-    
-    # Restart detection - if user greets again after conclusion/goodbye, reset
-    # Check for restart BEFORE length checks to allow resetting long conversations
-    restart_keywords = ["hi", "hello", "hey", "start over", "restart", "new chat", "greetings"]
-    
-    if current_stage == "conclusion" or current_stage == "goodbye":
-        is_restart = False
-        for keyword in restart_keywords:
-             # Check if keyword is exactly the message OR keyword is in the message words
-             if keyword == message_lower or keyword in message_lower.split():
-                 is_restart = True
-                 break
-        
-        if is_restart:
-            return "greeting"
-    
-    # Prioritize treatment requests - if user asks for treatment, give it immediately
-    treatment_keywords = ["treatment", "cure", "medicine", "remedy", "what should i do", "how to treat", "how to fix", "tell me the treatment"]
-    if any(keyword in message_lower for keyword in treatment_keywords):
-        return "conclusion"
-    
-    # Handle confusion - if user says "what?" they need clarification, not new conversation
-    confusion_words = ["what", "what?", "huh", "huh?", "confused", "don't understand"]
-    if any(word in message_lower for word in confusion_words) and len(context.split('\n')) > 1:
-        return "conclusion"  # Provide summary instead of resetting
-    
-    # User wants conclusion - detect frustration or request for advice
-    conclusion_signals = [
-        "what" in message_lower and ("do" in message_lower or "should" in message_lower),
-        "help" in message_lower and len(message.split()) <= 3,
-        "advice" in message_lower,
-        "recommend" in message_lower,
-        "serious" in message_lower and "fix" in message_lower,
-        "joking" in message_lower,
-        message_lower in ["nothing", "no", "nah", "nahhhh", "none", "ok", "okay", "fine"]
-    ]
-    
-    # Force conclusion if user seems frustrated or conversation is long
-    # Only force conclusion if we are not already in conclusion or goodbye stages
-    if (any(conclusion_signals) or user_message_count >= 5) and current_stage not in ["conclusion", "goodbye"]:
-        return "conclusion"
-    
-    # Goodbye detection
-    goodbye_keywords = ["bye", "goodbye", "thanks", "thank you", "that's all"]
-    if any(keyword in message_lower for keyword in goodbye_keywords):
-        return "goodbye"
+    # Transition rules live in stage_machine.TRANSITIONS / PROGRESSION
+    return stage_classifier.next_stage(current_stage, message, context, user_message_count)
 
-    # Smart stage progression based on information gathered
-    if current_stage == "greeting":
-        return "symptom_gathering"
-    elif current_stage == "symptom_gathering":
-        # Move to follow-up after basic info is gathered
-        if user_message_count >= 2:
-            return "follow_up_questions"
-        return "symptom_gathering"
-    elif current_stage == "follow_up_questions":
-        # Move to conclusion after sufficient follow-up
-        if user_message_count >= 4:
-            return "conclusion"
-        return "follow_up_questions"
-    elif current_stage == "conclusion":
-        return "goodbye"
-    else:
-        return "greeting"
-
-def call_groq_api(message, conversation_context="", current_stage="greeting", next_stage="symptom_gathering"):
+def load_system_rules():
+    """Read rules/rules.txt once; it becomes the fixed system prefix of every request"""
     try:
-        # Load and use knowledge base
-        relevant_knowledge = ""
-        try:
-            with open('../knowledge/core_knowledge.json', 'r', encoding='utf-8') as f:
-                knowledge_data = json.load(f)
-                # Find relevant knowledge entries
-                for entry in knowledge_data:
-                    keywords = entry.get('symptoms_or_keywords', [])
-                    if any(keyword.lower() in message.lower() for keyword in keywords):
-                        relevant_knowledge += f"\nRelevant info: {entry.get('response_guidance', '')}"
-                        break  # Use first match
-        except:
-            pass
-        
-        # Stage-based system prompts
-        stage_prompts = {
-            "greeting": "You are a friendly AI health assistant. Greet the user warmly and ask what health concerns they have today. Keep it brief and welcoming.",
-            
-            "symptom_gathering": f"""You are gathering initial symptom information. 
+        with open(os.path.join(parent_dir, "rules", "rules.txt"), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return "You are a friendly AI health assistant. Be helpful and accurate."
 
-Conversation so far:
-{conversation_context}
+SYSTEM_RULES = load_system_rules()
 
-{relevant_knowledge}
+# Stage-based system prompts, compiled once at import
+STAGE_PROMPTS = {
+    "greeting": CompiledTemplate("You are a friendly AI health assistant. Greet the user warmly and ask what health concerns they have today. Keep it brief and welcoming."),
+    
+    "symptom_gathering": CompiledTemplate("""You are gathering initial symptom information. 
 
 Ask specific questions about:
 - Main symptoms and location
@@ -208,14 +194,9 @@ Ask specific questions about:
 - Severity (1-10 scale)
 - What makes it better/worse
 
-Keep responses under 2 sentences. Ask ONE specific question.""",
-            
-            "follow_up_questions": f"""You are gathering detailed follow-up information.
-
-Conversation so far:
-{conversation_context}
-
-{relevant_knowledge}
+Keep responses under 2 sentences. Ask ONE specific question."""),
+    
+    "follow_up_questions": CompiledTemplate("""You are gathering detailed follow-up information.
 
 Ask about:
 - Associated symptoms
@@ -223,14 +204,9 @@ Ask about:
 - Previous treatments tried
 - Impact on daily life
 
-Keep responses under 2 sentences. Ask ONE specific follow-up question.""",
-            
-            "conclusion": f"""You are providing final medical assessment and recommendations.
-
-Conversation so far:
-{conversation_context}
-
-{relevant_knowledge}
+Keep responses under 2 sentences. Ask ONE specific follow-up question."""),
+    
+    "conclusion": CompiledTemplate("""You are providing final medical assessment and recommendations.
 
 Analyze the conversation and provide a structured response using Markdown:
 1. **Summary of Key Symptoms**: Briefly list the symptoms mentioned.
@@ -238,50 +214,101 @@ Analyze the conversation and provide a structured response using Markdown:
 3. **Actionable Recommendations**: Provide specific advice.
 4. **When to Seek Medical Care**: Clear warning signs.
 
-Format your response with clear headings (e.g., ## Summary) and bullet points. Be concise but complete. End with a caring message.""",
-            
-            "emergency_conclusion": f"""EMERGENCY RESPONSE NEEDED.
-
-Conversation so far:
-{conversation_context}
-
-{relevant_knowledge}
+Format your response with clear headings (e.g., ## Summary) and bullet points. Be concise but complete. End with a caring message."""),
+    
+    "emergency_conclusion": CompiledTemplate("""EMERGENCY RESPONSE NEEDED.
 
 Provide:
 1. 'These symptoms require immediate medical attention.'
 2. 'Please call emergency services or go to the nearest emergency room.'
 3. Brief explanation why it's urgent
-4. 'Do not wait - seek help now.'""",
-            
-            "goodbye": "Thank the user for using the health assistant. Wish them well and remind them to seek professional medical care for serious concerns. Keep it brief and caring."
-        }
+4. 'Do not wait - seek help now.'"""),
+    
+    "goodbye": CompiledTemplate("Thank the user for using the health assistant. Wish them well and remind them to seek professional medical care for serious concerns. Keep it brief and caring.")
+}
+
+def call_groq_api(message, previous_turns=None, current_stage="greeting", next_stage="symptom_gathering",
+                  session_id=None):
+    try:
+        # Load and use knowledge base
+        matched_entries = []
+        try:
+            with open('../knowledge/core_knowledge.json', 'r', encoding='utf-8') as f:
+                knowledge_data = json.load(f)
+                # Find relevant knowledge entries
+                for entry in knowledge_data:
+                    keywords = entry.get('symptoms_or_keywords', [])
+                    if any(keyword.lower() in message.lower() for keyword in keywords):
+                        matched_entries.append(entry)
+                        break  # Use first match
+        except:
+            pass
+        
+        # Fully templated stages (greeting, goodbye, emergency) never wait on the LLM
+        matched_guidance = matched_entries[0].get('response_guidance', '') if matched_entries else ""
+        templated_response = response_templates.render(next_stage, reason=matched_guidance)
+        if templated_response is not None:
+            # At least the rules and the message would have been sent upstream
+            token_accountant.record_saved("response_template", count_tokens(SYSTEM_RULES) + count_tokens(message))
+            return templated_response
+        
+        stage_prompt = STAGE_PROMPTS.get(next_stage, STAGE_PROMPTS["greeting"]).render()
+        
+        # Keep whole rules sections, knowledge and turns within the stage's token budget
+        budget = prompt_budget.allocate(
+            rules=SYSTEM_RULES,
+            knowledge=matched_entries,
+            history=previous_turns or [],
+            user_message=message,
+            stage=next_stage,
+            fixed_text=stage_prompt
+        )
+        for entry in budget.knowledge:
+            stage_prompt += f"\n\nRelevant info: {entry.get('response_guidance', '')}"
         
-        system_prompt = stage_prompts.get(next_stage, stage_prompts["greeting"])
+        # Static rules first so the prefix is identical on every turn, then the
+        # stage instructions and knowledge, then the real conversation
+        messages = [
+            {"role": "system", "content": budget.rules},
+            {"role": "system", "content": stage_prompt}
+        ]
+        for turn in budget.history:
+            messages.append({"role": "user", "content": turn.user})
+            if turn.bot:
+                messages.append({"role": "assistant", "content": turn.bot})
+        messages.append({"role": "user", "content": message})
         
-        with httpx.Client() as client:
-            response = client.post(
-                "https://api.groq.com/openai/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {GROK_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": message}
-                    ],
-                    "model": "llama-3.1-8b-instant",
-                    "temperature": 0.7,
-                    "max_tokens": 1000
-                },
-                timeout=30
-            )
+        profile = config.generation_profile(next_stage)
+        payload = {
+            "messages": messages,
+            "model": profile.model,
+            "temperature": profile.temperature,
+            "max_tokens": profile.max_tokens
+        }
+        if profile.stop:
+            payload["stop"] = profile.stop
+        
+        # Earlier turns mean an active session, which queues ahead of new ones
+        with admission_controller.slot("active" if previous_turns else "new"), httpx.Client() as client:
+            headers = {
+                "Authorization": f"Bearer {GROK_API_KEY}",
+                "Content-Type": "application/json"
+            }
+            response = _post_completion(client, headers, payload, next_stage)
+            
+            # Cascade to the cheaper model if the profile's primary model fails
+            if response.status_code not in (200, 401) and profile.fallback_model:
+                print(f"Groq API Status: {response.status_code}, retrying with {profile.fallback_model}")
+                payload["model"] = profile.fallback_model
+                response = _post_completion(client, headers, payload, next_stage)
             
             print(f"Groq API Status: {response.status_code}")  # Debug log
             print(f"Groq API Response: {response.text[:200]}")  # Debug log
             
             if response.status_code == 200:
                 result = response.json()
+                token_accountant.record(next_stage, "grok", result.get("usage"), session_id,
+                                        saved={"prompt_budget": budget.dropped["tokens"]})
                 if "choices" in result and len(result["choices"]) > 0:
                     return result["choices"][0]["message"]["content"]
                 else:
@@ -293,15 +320,35 @@ Provide:
             else:
                 return f"API returned status {response.status_code}. Please try again."
                 
+    except Overloaded:
+        raise
     except httpx.TimeoutException:
         return "Request timed out. Please try again."
     except Exception as e:
         print(f"Groq API Error: {str(e)}")  # Debug log
         return f"Technical error: {str(e)[:100]}. Please try again."
 
+def _post_completion(client, headers, payload, stage):
+    """One upstream completion request, traced and carrying the trace context"""
+    with tracer.span("upstream.attempt", stage=stage, model=payload["model"]) as span:
+        traceparent = tracer.traceparent()
+        if traceparent:
+            headers = {**headers, "traceparent": traceparent}
+        response = client.post(
+            "https://api.groq.com/openai/v1/chat/completions",
+            headers=headers,
+            json=payload,
+            timeout=30
+        )
+        span.set_attribute("status_code", response.status_code)
+        return response
+
 @app.route('/widget/<path:filename>')
 def serve_widget(filename):
-    return send_from_directory('../widget', filename)
+    status, headers, body = widget_assets.respond(
+        filename, request.headers.get('If-None-Match'), request.headers.get('Accept-Encoding')
+    )
+    return Response(body, status=status, headers=headers)
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 8000))
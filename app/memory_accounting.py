@@ -0,0 +1,186 @@
+import gc
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from array import array
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+_ATOMIC = (str, bytes, bytearray, int, float, bool, complex, type(None), array, range)
+
+
+def approx_deep_size(obj: Any, sample: int = 200) -> int:
+    """Approximate deep size in bytes, following containers, ``__dict__`` and ``__slots__``.
+
+    Containers with more than ``sample`` items are measured on their first
+    ``sample`` items and extrapolated, so large structures cost a bounded walk.
+    Objects reachable more than once are counted once.
+    """
+    seen = set()
+
+    def size_of(item: Any) -> int:
+        if id(item) in seen:
+            return 0
+        seen.add(id(item))
+        total = sys.getsizeof(item)
+        if isinstance(item, _ATOMIC) or isinstance(item, type):
+            return total
+
+        if isinstance(item, dict):
+            children = item.items()
+            count = len(item)
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            children = item
+            count = len(item)
+        else:
+            children = None
+            count = 0
+
+        if children is not None:
+            measured = 0
+            walked = 0
+            for child in children:
+                if walked == sample:
+                    break
+                if isinstance(child, tuple) and isinstance(item, dict):
+                    measured += size_of(child[0]) + size_of(child[1])
+                else:
+                    measured += size_of(child)
+                walked += 1
+            if walked:
+                total += measured * count // walked
+            return total
+
+        attributes = getattr(item, "__dict__", None)
+        if attributes is not None:
+            total += size_of(attributes)
+        for cls in type(item).__mro__:
+            for slot in getattr(cls, "__slots__", ()):
+                if hasattr(item, slot) and slot not in ("__dict__", "__weakref__"):
+                    total += size_of(getattr(item, slot))
+        return total
+
+    return size_of(obj)
+
+
+def process_memory() -> Dict[str, int]:
+    """Resident and peak memory of this process, where the platform reports them"""
+    usage = {}
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+        usage["resident_bytes"] = pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        usage["peak_resident_bytes"] = peak if sys.platform == "darwin" else peak * 1024
+    return usage
+
+
+class MemoryAccountant:
+    """Entry counts and approximate deep sizes of registered in-process structures.
+
+    Structures are registered as callables returning the live object, so
+    reports always see the current instance. ``start`` refreshes the report
+    from a daemon thread; ``last_report`` is what metrics read, so scrapes
+    never walk the structures themselves.
+    """
+
+    def __init__(self, sample: int = 200):
+        self.sample = sample
+        self._targets: Dict[str, Callable[[], Any]] = {}
+        self._counters: Dict[str, Callable[[Any], int]] = {}
+        self.last_report: Dict[str, Dict[str, int]] = {}
+        self.last_report_at: Optional[float] = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._tracemalloc_baseline = None
+
+    def register(self, name: str, target: Callable[[], Any], entries: Callable[[Any], int] = len):
+        self._targets[name] = target
+        self._counters[name] = entries
+
+    def report(self) -> Dict[str, Dict[str, int]]:
+        """Measure every registered structure now"""
+        report = {}
+        for name, target in list(self._targets.items()):
+            for attempt in range(3):
+                try:
+                    structure = target()
+                    report[name] = {
+                        "entries": self._counters[name](structure),
+                        "approx_bytes": approx_deep_size(structure, self.sample),
+                    }
+                    break
+                except RuntimeError:
+                    # Mutated by a request while being walked; try again
+                    report[name] = {"error": "changed during measurement"}
+                except Exception as e:
+                    report[name] = {"error": type(e).__name__}
+                    break
+        self.last_report = report
+        self.last_report_at = time.time()
+        return report
+
+    def start(self, interval: float):
+        """Refresh ``last_report`` every ``interval`` seconds from a daemon thread"""
+        if interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,), name="memory-accounting", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self, interval: float):
+        self.report()
+        while not self._stop.wait(interval):
+            self.report()
+
+    def start_tracemalloc(self, frames: int = 10):
+        """Start tracing allocations and take the baseline snapshot"""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self._tracemalloc_baseline = self._take_snapshot()
+
+    def tracemalloc_diff(self, top: int = 20, key_type: str = "lineno") -> List[Dict]:
+        """Top allocation changes since the baseline snapshot"""
+        if self._tracemalloc_baseline is None or not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running; start it first")
+        snapshot = self._take_snapshot()
+        return [
+            {
+                "location": str(stat.traceback[0]),
+                "size_diff_bytes": stat.size_diff,
+                "size_bytes": stat.size,
+                "count_diff": stat.count_diff,
+            }
+            for stat in snapshot.compare_to(self._tracemalloc_baseline, key_type)[:top]
+        ]
+
+    @staticmethod
+    def _take_snapshot() -> tracemalloc.Snapshot:
+        gc.collect()
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+
+    def stop_tracemalloc(self):
+        self._tracemalloc_baseline = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+# Global accountant; modules register their structures with it
+memory_accountant = MemoryAccountant()
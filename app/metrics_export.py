@@ -0,0 +1,466 @@
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from latency_histogram import LatencyHistogram
+
+# Histogram bucket bounds (seconds) exposed to Prometheus
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Quantiles computed from the merged histograms
+LATENCY_QUANTILES = (("0.5", 50.0), ("0.9", 90.0), ("0.99", 99.0), ("0.999", 99.9))
+
+
+class WorkerMetricsFile:
+    """Fixed-size mmap'd file holding the latest metrics snapshot of one worker.
+
+    The header is a sequence number and a payload length. The writer makes
+    the sequence odd while it copies the payload in and even again after,
+    so readers can detect and retry a torn read without any locking.
+    """
+
+    HEADER = struct.Struct("<QI")
+    PREFIX = "worker-"
+    # Counters of exited workers, so cluster totals never go backwards
+    RETIRED = "retired.json"
+
+    def __init__(self, directory: str, pid: Optional[int] = None, size: int = 1 << 20):
+        self.pid = pid or os.getpid()
+        self.path = Path(directory) / f"{self.PREFIX}{self.pid}.mmap"
+        self.size = size
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "wb") as handle:
+            handle.truncate(size)
+        self._file = open(self.path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._sequence = 0
+
+    def write(self, payload: bytes):
+        if self.HEADER.size + len(payload) > self.size:
+            raise ValueError("Metrics snapshot does not fit the worker file")
+        self._sequence += 1
+        self.HEADER.pack_into(self._map, 0, self._sequence, 0)
+        self._map[self.HEADER.size:self.HEADER.size + len(payload)] = payload
+        self._sequence += 1
+        self.HEADER.pack_into(self._map, 0, self._sequence, len(payload))
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    @classmethod
+    def read(cls, path: Path, attempts: int = 3) -> Optional[bytes]:
+        """Read a consistent payload from a worker file, or None"""
+        with open(path, "rb") as handle:
+            with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for _ in range(attempts):
+                    sequence, length = cls.HEADER.unpack_from(mapped, 0)
+                    if sequence % 2 == 0:
+                        payload = mapped[cls.HEADER.size:cls.HEADER.size + length]
+                        if cls.HEADER.unpack_from(mapped, 0)[0] == sequence:
+                            return payload if length else None
+                    time.sleep(0.001)
+        return None
+
+    @classmethod
+    def read_all(cls, directory: str) -> List[Dict]:
+        """Snapshots of every live worker; exited workers are folded into the retired counters"""
+        snapshots = []
+        for path in sorted(Path(directory).glob(f"{cls.PREFIX}*.mmap")):
+            pid = int(path.stem[len(cls.PREFIX):])
+            if not _pid_alive(pid):
+                cls._retire(path)
+                continue
+            payload = cls.read(path)
+            if payload:
+                snapshots.append(json.loads(payload))
+        return snapshots
+
+    @classmethod
+    def read_retired(cls, directory: str) -> Optional[Dict]:
+        try:
+            return json.loads((Path(directory) / cls.RETIRED).read_text())
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    def _retire(cls, path: Path):
+        """Add an exited worker's counters to the retired snapshot, then remove its file"""
+        directory = path.parent
+        with open(directory / f"{cls.RETIRED}.lock", "a") as lock:
+            # Concurrent scrapes must fold each file exactly once
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not path.exists():
+                return
+            payload = cls.read(path)
+            if payload:
+                retired = cls.read_retired(str(directory))
+                merged = merge_counters([retired, json.loads(payload)] if retired else [json.loads(payload)])
+                partial = directory / f"{cls.RETIRED}.tmp"
+                partial.write_text(json.dumps(merged, separators=(",", ":")))
+                os.replace(partial, directory / cls.RETIRED)
+            path.unlink()
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsExporter:
+    """Expose metrics of all workers in the Prometheus text format.
+
+    Each worker publishes a snapshot of its counters to its own mmap'd file
+    from a background thread every ``interval`` seconds; a scrape merges the
+    files instead of asking other workers, so it adds nothing to their
+    request paths. Without a directory only the local worker is reported.
+    """
+
+    def __init__(self, metrics, directory: Optional[str] = None, interval: float = 5.0,
+                 gauges: Callable[[], Dict[str, float]] = None,
+                 caches: Callable[[], Dict[str, Tuple[int, int]]] = None,
+                 memory: Callable[[], Dict[str, Dict[str, int]]] = None,
+                 tokens: Callable[[], Dict] = None,
+                 admission: Callable[[], Dict] = None):
+        self.metrics = metrics
+        self.directory = directory
+        self.interval = interval
+        self.gauges = gauges or (lambda: {})
+        self.caches = caches or (lambda: {})
+        self.memory = memory or (lambda: {})
+        self.tokens = tokens or (lambda: {"usage": [], "saved": {}, "shed": {}})
+        self.admission = admission or (lambda: {})
+        self._file = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def snapshot(self) -> Dict:
+        """Current state of this worker"""
+        state = self.metrics.export_state()
+        state["pid"] = os.getpid()
+        state["gauges"] = self.gauges()
+        state["caches"] = {name: list(counts) for name, counts in self.caches().items()}
+        state["memory"] = self.memory()
+        state["tokens"] = self.tokens()
+        state["admission"] = self.admission()
+        return state
+
+    def publish(self):
+        if not self.directory:
+            return
+        # Reopen after a fork so every worker owns its own file
+        if self._file is None or self._file.pid != os.getpid():
+            self._file = WorkerMetricsFile(self.directory)
+        self._file.write(json.dumps(self.snapshot(), separators=(",", ":")).encode("utf-8"))
+
+    def start(self):
+        """Publish periodically from a daemon thread"""
+        if not self.directory or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics-publisher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.publish()
+            except Exception:
+                pass
+
+    def collect(self) -> List[Dict]:
+        """Snapshots of all workers, with this worker's taken fresh"""
+        if not self.directory:
+            return [self.snapshot()]
+        self.publish()
+        return WorkerMetricsFile.read_all(self.directory)
+
+    def render(self) -> str:
+        snapshots = self.collect()
+        retired = WorkerMetricsFile.read_retired(self.directory) if self.directory else None
+        return render_prometheus(snapshots, retired)
+
+
+def _merge_histograms(states: List[Dict]) -> Optional[LatencyHistogram]:
+    merged = None
+    for state in states:
+        histogram = LatencyHistogram.from_dict(state)
+        if merged is None:
+            merged = histogram
+        else:
+            merged.merge(histogram)
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels.items()) + "}"
+
+
+def _histogram_lines(name: str, histogram: LatencyHistogram, labels: Dict[str, str]) -> List[str]:
+    lines = []
+    counts = histogram.count_at_or_below(list(LATENCY_BUCKETS))
+    for bound, count in zip(LATENCY_BUCKETS, counts):
+        lines.append(f"{name}_bucket{_format_labels({**labels, 'le': repr(bound)})} {count}")
+    lines.append(f"{name}_bucket{_format_labels({**labels, 'le': '+Inf'})} {histogram.count}")
+    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.total}")
+    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+    return lines
+
+
+def merge_counters(snapshots: List[Dict]) -> Dict:
+    """One snapshot holding the summed counters and histograms of ``snapshots``.
+
+    Gauges (sessions, memory, admission in-flight and queue depth) describe
+    live workers only and are dropped.
+    """
+    merged = {
+        "start_time": min(snapshot.get("start_time", 0) for snapshot in snapshots),
+        "requests": sum(snapshot["requests"] for snapshot in snapshots),
+        "errors": sum(snapshot["errors"] for snapshot in snapshots),
+        "api_failures": {},
+        "response_times": _merge_histograms([snapshot["response_times"] for snapshot in snapshots]).to_dict(),
+        "phases": {},
+        "gauges": {},
+        "caches": {},
+        "memory": {},
+        "tokens": {"usage": [], "saved": {}, "shed": {}},
+        "admission": {"admitted": {}, "shed": []},
+    }
+    phases: Dict[str, List[Dict]] = {}
+    usage: Dict[Tuple[str, str], Dict[str, int]] = {}
+    admission_shed: Dict[Tuple[str, str], int] = {}
+    for snapshot in snapshots:
+        for provider, count in snapshot["api_failures"].items():
+            merged["api_failures"][provider] = merged["api_failures"].get(provider, 0) + count
+        for phase, state in snapshot["phases"].items():
+            phases.setdefault(phase, []).append(state)
+        for cache, (hits, misses) in snapshot["caches"].items():
+            totals = merged["caches"].setdefault(cache, [0, 0])
+            totals[0] += hits
+            totals[1] += misses
+        tokens = snapshot.get("tokens", {})
+        for row in tokens.get("usage", []):
+            totals = usage.setdefault((row["stage"], row["provider"]), {"prompt": 0, "completion": 0, "turns": 0})
+            for field in totals:
+                totals[field] += row[field]
+        for name in ("saved", "shed"):
+            for key, count in tokens.get(name, {}).items():
+                merged["tokens"][name][key] = merged["tokens"][name].get(key, 0) + count
+        admission = snapshot.get("admission", {})
+        for priority, count in admission.get("admitted", {}).items():
+            merged["admission"]["admitted"][priority] = merged["admission"]["admitted"].get(priority, 0) + count
+        for row in admission.get("shed", []):
+            key = (row["priority"], row["reason"])
+            admission_shed[key] = admission_shed.get(key, 0) + row["count"]
+    merged["phases"] = {phase: _merge_histograms(states).to_dict() for phase, states in phases.items()}
+    merged["tokens"]["usage"] = [{"stage": stage, "provider": provider, **totals}
+                                 for (stage, provider), totals in usage.items()]
+    merged["admission"]["shed"] = [{"priority": priority, "reason": reason, "count": count}
+                                   for (priority, reason), count in admission_shed.items()]
+    return merged
+
+
+def render_prometheus(snapshots: List[Dict], retired: Optional[Dict] = None) -> str:
+    """Merge worker snapshots and format them in the Prometheus text exposition format.
+
+    ``retired`` (see ``merge_counters``) adds the counters of exited workers.
+    """
+    workers = len(snapshots)
+    if retired is not None:
+        snapshots = snapshots + [retired]
+    lines = [
+        "# HELP chatbot_workers Worker processes reporting metrics",
+        "# TYPE chatbot_workers gauge",
+        f"chatbot_workers {workers}",
+        "# HELP chatbot_requests_total Chat requests answered",
+        "# TYPE chatbot_requests_total counter",
+        f"chatbot_requests_total {sum(s['requests'] for s in snapshots)}",
+        "# HELP chatbot_errors_total Chat requests that failed",
+        "# TYPE chatbot_errors_total counter",
+        f"chatbot_errors_total {sum(s['errors'] for s in snapshots)}",
+    ]
+
+    failures: Dict[str, int] = {}
+    for snapshot in snapshots:
+        for provider, count in snapshot["api_failures"].items():
+            failures[provider] = failures.get(provider, 0) + count
+    lines += [
+        "# HELP chatbot_upstream_failures_total Failed upstream API calls by provider",
+        "# TYPE chatbot_upstream_failures_total counter",
+    ]
+    lines += [f"chatbot_upstream_failures_total{_format_labels({'provider': p})} {c}"
+              for p, c in sorted(failures.items())]
+
+    response = _merge_histograms([s["response_times"] for s in snapshots])
+    if response is not None:
+        lines += [
+            "# HELP chatbot_response_seconds Chat request latency",
+            "# TYPE chatbot_response_seconds histogram",
+        ]
+        lines += _histogram_lines("chatbot_response_seconds", response, {})
+        lines += [
+            "# HELP chatbot_response_quantile_seconds Chat request latency quantiles across workers",
+            "# TYPE chatbot_response_quantile_seconds gauge",
+        ]
+        lines += [
+            f"chatbot_response_quantile_seconds{_format_labels({'quantile': q})} {response.percentile(p)}"
+            for q, p in LATENCY_QUANTILES
+        ]
+
+    phases: Dict[str, List[Dict]] = {}
+    for snapshot in snapshots:
+        for phase, state in snapshot["phases"].items():
+            phases.setdefault(phase, []).append(state)
+    if phases:
+        lines += [
+            "# HELP chatbot_phase_seconds Time spent in each phase of a chat request",
+            "# TYPE chatbot_phase_seconds histogram",
+        ]
+        for phase in sorted(phases):
+            lines += _histogram_lines("chatbot_phase_seconds", _merge_histograms(phases[phase]), {"phase": phase})
+
+    caches: Dict[str, List[int]] = {}
+    for snapshot in snapshots:
+        for cache, (hits, misses) in snapshot["caches"].items():
+            totals = caches.setdefault(cache, [0, 0])
+            totals[0] += hits
+            totals[1] += misses
+    lines += [
+        "# HELP chatbot_cache_hits_total Cache hits by cache",
+        "# TYPE chatbot_cache_hits_total counter",
+    ]
+    lines += [f"chatbot_cache_hits_total{_format_labels({'cache': name})} {hits}"
+              for name, (hits, _) in sorted(caches.items())]
+    lines += [
+        "# HELP chatbot_cache_misses_total Cache misses by cache",
+        "# TYPE chatbot_cache_misses_total counter",
+    ]
+    lines += [f"chatbot_cache_misses_total{_format_labels({'cache': name})} {misses}"
+              for name, (_, misses) in sorted(caches.items())]
+
+    usage: Dict[Tuple[str, str], List[int]] = {}
+    saved: Dict[str, int] = {}
+    shed: Dict[str, int] = {}
+    for snapshot in snapshots:
+        tokens = snapshot.get("tokens", {})
+        for row in tokens.get("usage", []):
+            totals = usage.setdefault((row["stage"], row["provider"]), [0, 0, 0])
+            totals[0] += row["prompt"]
+            totals[1] += row["completion"]
+            totals[2] += row["turns"]
+        for reason, count in tokens.get("saved", {}).items():
+            saved[reason] = saved.get(reason, 0) + count
+        for budget, count in tokens.get("shed", {}).items():
+            shed[budget] = shed.get(budget, 0) + count
+    lines += [
+        "# HELP chatbot_llm_tokens_total Upstream tokens by stage, provider and kind",
+        "# TYPE chatbot_llm_tokens_total counter",
+    ]
+    for (stage, provider), (prompt, completion, _) in sorted(usage.items()):
+        labels = {"stage": stage, "provider": provider}
+        lines.append(f"chatbot_llm_tokens_total{_format_labels({**labels, 'kind': 'prompt'})} {prompt}")
+        lines.append(f"chatbot_llm_tokens_total{_format_labels({**labels, 'kind': 'completion'})} {completion}")
+    lines += [
+        "# HELP chatbot_llm_turns_total Upstream completions by stage and provider",
+        "# TYPE chatbot_llm_turns_total counter",
+    ]
+    lines += [f"chatbot_llm_turns_total{_format_labels({'stage': stage, 'provider': provider})} {turns}"
+              for (stage, provider), (_, _, turns) in sorted(usage.items())]
+    lines += [
+        "# HELP chatbot_llm_tokens_saved_total Tokens not sent upstream, by reason",
+        "# TYPE chatbot_llm_tokens_saved_total counter",
+    ]
+    lines += [f"chatbot_llm_tokens_saved_total{_format_labels({'reason': reason})} {count}"
+              for reason, count in sorted(saved.items())]
+    lines += [
+        "# HELP chatbot_token_budget_shed_total Requests refused because a token budget was exhausted",
+        "# TYPE chatbot_token_budget_shed_total counter",
+    ]
+    lines += [f"chatbot_token_budget_shed_total{_format_labels({'budget': budget})} {count}"
+              for budget, count in sorted(shed.items())]
+
+    in_flight = 0
+    queued: Dict[str, int] = {}
+    admitted: Dict[str, int] = {}
+    admission_shed: Dict[Tuple[str, str], int] = {}
+    for snapshot in snapshots:
+        admission = snapshot.get("admission", {})
+        in_flight += admission.get("in_flight", 0)
+        for priority, count in admission.get("queued", {}).items():
+            queued[priority] = queued.get(priority, 0) + count
+        for priority, count in admission.get("admitted", {}).items():
+            admitted[priority] = admitted.get(priority, 0) + count
+        for row in admission.get("shed", []):
+            key = (row["priority"], row["reason"])
+            admission_shed[key] = admission_shed.get(key, 0) + row["count"]
+    lines += [
+        "# HELP chatbot_admission_in_flight Requests holding an upstream admission slot",
+        "# TYPE chatbot_admission_in_flight gauge",
+        f"chatbot_admission_in_flight {in_flight}",
+        "# HELP chatbot_admission_queue_depth Requests waiting for an admission slot, by priority",
+        "# TYPE chatbot_admission_queue_depth gauge",
+    ]
+    lines += [f"chatbot_admission_queue_depth{_format_labels({'priority': priority})} {count}"
+              for priority, count in sorted(queued.items())]
+    lines += [
+        "# HELP chatbot_admission_admitted_total Requests admitted upstream, by priority",
+        "# TYPE chatbot_admission_admitted_total counter",
+    ]
+    lines += [f"chatbot_admission_admitted_total{_format_labels({'priority': priority})} {count}"
+              for priority, count in sorted(admitted.items())]
+    lines += [
+        "# HELP chatbot_admission_shed_total Requests shed with a 503, by priority and reason",
+        "# TYPE chatbot_admission_shed_total counter",
+    ]
+    lines += [f"chatbot_admission_shed_total{_format_labels({'priority': priority, 'reason': reason})} {count}"
+              for (priority, reason), count in sorted(admission_shed.items())]
+
+    memory: Dict[str, List[int]] = {}
+    for snapshot in snapshots:
+        for structure, usage in snapshot.get("memory", {}).items():
+            if "approx_bytes" in usage:
+                totals = memory.setdefault(structure, [0, 0])
+                totals[0] += usage["entries"]
+                totals[1] += usage["approx_bytes"]
+    if memory:
+        lines += [
+            "# HELP chatbot_memory_entries Entries held by in-process structures",
+            "# TYPE chatbot_memory_entries gauge",
+        ]
+        lines += [f"chatbot_memory_entries{_format_labels({'structure': name})} {entries}"
+                  for name, (entries, _) in sorted(memory.items())]
+        lines += [
+            "# HELP chatbot_memory_bytes Approximate deep size of in-process structures",
+            "# TYPE chatbot_memory_bytes gauge",
+        ]
+        lines += [f"chatbot_memory_bytes{_format_labels({'structure': name})} {size}"
+                  for name, (_, size) in sorted(memory.items())]
+
+    gauges: Dict[str, float] = {}
+    for snapshot in snapshots:
+        for name, value in snapshot["gauges"].items():
+            gauges[name] = gauges.get(name, 0) + value
+    for name, value in sorted(gauges.items()):
+        lines += [f"# TYPE chatbot_{name} gauge", f"chatbot_{name} {value}"]
+
+    return "\n".join(lines) + "\n"
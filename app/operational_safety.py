@@ -1,89 +1,187 @@
+import logging
 import re
 import time
-from typing import Dict, List, Optional
-from collections import defaultdict, deque
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional
+from collections import defaultdict
 from datetime import datetime, timedelta
 from config import get_config
+from security import SecurityConfig
+from shared_state import BackendUnavailable, SharedWindowCounters, create_counter_backend
+from latency_histogram import LatencyHistogram
+from window_counters import SlidingWindowCounter, WindowedCounterStore
+from tracing import tracer
 
 config = get_config()
 
 class SecretMasker:
     """Utility to mask secrets in logs and debug output"""
     
+    # (prefix kept in the output, secret value replaced with ***MASKED***)
     SECRET_PATTERNS = [
-        r'(api[_-]?key["\s]*[:=]["\s]*)([a-zA-Z0-9_-]{20,})',
-        r'(token["\s]*[:=]["\s]*)([a-zA-Z0-9_.-]{20,})',
-        r'(password["\s]*[:=]["\s]*)([^\s"]{8,})',
-        r'(secret["\s]*[:=]["\s]*)([a-zA-Z0-9_-]{16,})',
-        r'Bearer\s+([a-zA-Z0-9_.-]{20,})',
-        r'sk-[a-zA-Z0-9]{20,}',  # OpenAI-style keys
-        r'xai-[a-zA-Z0-9]{20,}', # Grok-style keys
+        (r'api[_-]?key["\s]*[:=]["\s]*', r'[a-zA-Z0-9_-]{20,}'),
+        (r'token["\s]*[:=]["\s]*', r'[a-zA-Z0-9_.-]{20,}'),
+        (r'password["\s]*[:=]["\s]*', r'[^\s"]{8,}'),
+        (r'secret["\s]*[:=]["\s]*', r'[a-zA-Z0-9_-]{16,}'),
+        (r'Bearer\s+', r'[a-zA-Z0-9_.-]{20,}'),
+        (r'', r'sk-[a-zA-Z0-9]{20,}'),  # OpenAI-style keys
+        (r'', r'xai-[a-zA-Z0-9]{20,}'), # Grok-style keys
     ]
     
+    # Every pattern contains one of these (lower-case); text without any of
+    # them cannot contain a secret and skips the regex entirely
+    TRIGGER_WORDS = ('key', 'token', 'password', 'secret', 'bearer', 'sk-', 'xai-')
+    
+    # Masked results are cached for repeated strings up to this length
+    CACHE_MAX_LENGTH = 4096
+    
+    _regex = re.compile(
+        "|".join(f"(?P<p{i}>{prefix}){secret}" for i, (prefix, secret) in enumerate(SECRET_PATTERNS)),
+        re.IGNORECASE
+    )
+    
     @staticmethod
     def mask_secrets(text: str) -> str:
         """Mask secrets in text for safe logging"""
         if not text:
             return text
         
-        masked_text = text
-        for pattern in SecretMasker.SECRET_PATTERNS:
-            masked_text = re.sub(pattern, r'\1***MASKED***', masked_text, flags=re.IGNORECASE)
-        
-        return masked_text
+        if len(text) <= SecretMasker.CACHE_MAX_LENGTH:
+            return _mask_secrets_cached(text)
+        return SecretMasker._mask(text)
+    
+    @staticmethod
+    def _mask(text: str) -> str:
+        lowered = text.lower()
+        if not any(word in lowered for word in SecretMasker.TRIGGER_WORDS):
+            return text
+        return SecretMasker._regex.sub(lambda m: m.group(m.lastgroup) + '***MASKED***', text)
+
+@lru_cache(maxsize=1024)
+def _mask_secrets_cached(text: str) -> str:
+    return SecretMasker._mask(text)
+
+class IPVerdict(NamedTuple):
+    """Outcome of the per-request IP checks"""
+    rate_limited: bool
+    abusive: bool
+    blocked: bool
 
 class AbuseDetector:
     """Detect and log abuse patterns"""
     
-    def __init__(self):
-        self.ip_requests = defaultdict(deque)
-        self.ip_errors = defaultdict(int)
-        self.suspicious_patterns = [
-            r'<script',
-            r'javascript:',
-            r'eval\(',
-            r'document\.',
-            r'window\.',
-            r'alert\(',
-            r'prompt\(',
-            r'confirm\(',
-        ]
+    REQUEST_WINDOW = 3600
+    
+    def __init__(self, shared_counters: Optional[SharedWindowCounters] = None):
+        # Per-minute buckets over the last hour; memory is bounded by the key cap
+        self.ip_requests = WindowedCounterStore(
+            window_seconds=self.REQUEST_WINDOW, bucket_seconds=60, max_keys=config.abuse_tracker_max_keys
+        )
+        self.ip_errors = WindowedCounterStore(
+            window_seconds=self.REQUEST_WINDOW, bucket_seconds=60, max_keys=config.abuse_tracker_max_keys
+        )
+        # Counters shared by all workers; the per-process stores above are the
+        # fallback while the shared store is unreachable
+        self.shared = shared_counters
+        self.shared_failures = 0
+        self.suspicious_patterns = SecurityConfig.SUSPICIOUS_PATTERNS
+        self._suspicious_regex = re.compile("|".join(self.suspicious_patterns), re.IGNORECASE)
+    
+    def _shared_update(self, ip: str, amounts: Dict[str, int], now: float) -> Optional[Dict[str, float]]:
+        """Update shared counters in one batch; None when the shared store is unavailable"""
+        if self.shared is None:
+            return None
+        try:
+            return self.shared.update(ip, amounts, now)
+        except BackendUnavailable:
+            # Failed recently and already reported; skip the store until it is retried
+            self.shared_failures += 1
+            return None
+        except Exception as e:
+            self.shared_failures += 1
+            logging.getLogger('chatbot.errors').error(
+                f"Shared abuse state unavailable, using per-process counters: {type(e).__name__}"
+            )
+            return None
+    
+    @tracer.traced("abuse_detector.check_ip")
+    def check_ip(self, ip: str, user_agent: str = "") -> IPVerdict:
+        """Count this request and run every per-IP check with one shared-store operation"""
+        now = time.time()
+        counts = self._shared_update(ip, {"chat": 1, "requests": 1, "errors": 0}, now)
+        tracer.current_span().set_attribute("shared_store", counts is not None)
+        if counts is not None:
+            return IPVerdict(
+                rate_limited=counts["chat"] > config.rate_limit_requests,
+                abusive=self._is_abusive(counts["requests"], user_agent),
+                blocked=counts["errors"] > 50
+            )
+        
+        # Per-process counters; the chat rate limit is left to the route limiter
+        request_count = self.ip_requests.add(ip, now)
+        return IPVerdict(
+            rate_limited=False,
+            abusive=self._is_abusive(request_count, user_agent),
+            blocked=self.ip_errors.count(ip, now) > 50
+        )
     
     def check_request_abuse(self, ip: str, user_agent: str = "") -> bool:
         """Check if request shows abuse patterns"""
         now = time.time()
+        counts = self._shared_update(ip, {"requests": 1}, now)
+        if counts is not None:
+            return self._is_abusive(counts["requests"], user_agent)
         
-        # Clean old requests (last hour)
-        cutoff = now - 3600
-        while self.ip_requests[ip] and self.ip_requests[ip][0] < cutoff:
-            self.ip_requests[ip].popleft()
-        
-        # Add current request
-        self.ip_requests[ip].append(now)
-        
+        # Count this request within the last hour
+        return self._is_abusive(self.ip_requests.add(ip, now), user_agent)
+    
+    def _is_abusive(self, request_count: float, user_agent: str) -> bool:
         # Check rate (more than 100 requests per hour)
-        if len(self.ip_requests[ip]) > 100:
+        if request_count > 100:
             return True
         
         # Check for suspicious user agent patterns
         if user_agent and any(pattern in user_agent.lower() for pattern in ['bot', 'crawler', 'spider', 'scraper']):
-            if len(self.ip_requests[ip]) > 10:  # Lower threshold for bots
+            if request_count > 10:  # Lower threshold for bots
                 return True
         
         return False
     
     def check_message_abuse(self, message: str) -> bool:
         """Check if message contains suspicious patterns"""
-        message_lower = message.lower()
-        return any(re.search(pattern, message_lower) for pattern in self.suspicious_patterns)
+        return self._suspicious_regex.search(message) is not None
     
     def log_error(self, ip: str):
         """Log error for IP tracking"""
-        self.ip_errors[ip] += 1
+        now = time.time()
+        if self._shared_update(ip, {"errors": 1}, now) is None:
+            self.ip_errors.add(ip, now)
     
     def is_ip_blocked(self, ip: str) -> bool:
         """Check if IP should be blocked due to errors"""
-        return self.ip_errors[ip] > 50  # Block after 50 errors
+        now = time.time()
+        counts = self._shared_update(ip, {"errors": 0}, now)
+        if counts is not None:
+            return counts["errors"] > 50
+        return self.ip_errors.count(ip, now) > 50  # Block after 50 errors within an hour
+
+class RequestTimer:
+    """Times consecutive phases of one request"""
+    
+    __slots__ = ("metrics", "start", "_last")
+    
+    def __init__(self, metrics: "ObservabilityMetrics"):
+        self.metrics = metrics
+        self.start = self._last = time.perf_counter()
+    
+    def lap(self, phase: str):
+        """Record the time since the previous lap as ``phase``"""
+        now = time.perf_counter()
+        self.metrics.record_phase(phase, now - self._last)
+        self._last = now
+    
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
 
 class ObservabilityMetrics:
     """Track system metrics for observability"""
@@ -92,15 +190,27 @@ class ObservabilityMetrics:
         self.request_count = 0
         self.error_count = 0
         self.api_failures = defaultdict(int)
-        self.response_times = deque(maxlen=1000)
-        self.response_timestamps = deque(maxlen=1000)
+        self.response_times = LatencyHistogram()
+        self.phase_times: Dict[str, LatencyHistogram] = {}
+        # One-second buckets over the last minute
+        self.recent_requests = SlidingWindowCounter(60)
         self.start_time = time.time()
     
+    def start_timer(self) -> RequestTimer:
+        return RequestTimer(self)
+    
     def record_request(self, response_time: float):
         """Record successful request"""
         self.request_count += 1
-        self.response_times.append(response_time)
-        self.response_timestamps.append(time.time())
+        self.response_times.record(response_time)
+        self.recent_requests.add(int(time.time()))
+    
+    def record_phase(self, phase: str, duration: float):
+        """Record time spent in one phase of request handling"""
+        histogram = self.phase_times.get(phase)
+        if histogram is None:
+            histogram = self.phase_times[phase] = LatencyHistogram()
+        histogram.record(duration)
     
     def record_error(self, error_type: str = "general"):
         """Record error"""
@@ -110,19 +220,32 @@ class ObservabilityMetrics:
         """Record API failure"""
         self.api_failures[api_name] += 1
     
+    def export_state(self) -> Dict:
+        """Raw counters and histogram buckets, for merging across workers"""
+        return {
+            "start_time": self.start_time,
+            "requests": self.request_count,
+            "errors": self.error_count,
+            "api_failures": dict(self.api_failures),
+            "response_times": self.response_times.to_dict(),
+            "phases": {phase: histogram.to_dict() for phase, histogram in list(self.phase_times.items())},
+        }
+    
     def get_metrics(self) -> Dict:
         """Get current metrics"""
         uptime = time.time() - self.start_time
-        avg_response_time = sum(self.response_times) / len(self.response_times) if self.response_times else 0
+        response_time = self.response_times.snapshot()
         
         return {
             "uptime_seconds": uptime,
             "total_requests": self.request_count,
             "total_errors": self.error_count,
             "error_rate": self.error_count / max(self.request_count, 1),
-            "avg_response_time": avg_response_time,
+            "avg_response_time": response_time["mean"],
+            "response_time": response_time,
+            "phases": {phase: histogram.snapshot() for phase, histogram in self.phase_times.items()},
             "api_failures": dict(self.api_failures),
-            "requests_per_minute": len([t for t in self.response_timestamps if time.time() - t < 60])
+            "requests_per_minute": self.recent_requests.total(int(time.time()))
         }
 
 class MedicalSafetyEnforcer:
@@ -167,6 +290,13 @@ class MedicalSafetyEnforcer:
 
 # Global instances
 secret_masker = SecretMasker()
-abuse_detector = AbuseDetector()
+_shared_backend = create_counter_backend(config.shared_state_url)
+abuse_detector = AbuseDetector(
+    SharedWindowCounters(_shared_backend, {
+        "chat": config.rate_limit_window,
+        "requests": AbuseDetector.REQUEST_WINDOW,
+        "errors": AbuseDetector.REQUEST_WINDOW
+    }) if _shared_backend else None
+)
 observability_metrics = ObservabilityMetrics()
 medical_safety = MedicalSafetyEnforcer()
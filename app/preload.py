@@ -0,0 +1,54 @@
+import gc
+from typing import Dict
+
+from config import get_config
+from chat_api import knowledge_manager, rule_engine, prompt_builder
+from prompt_assembly import knowledge_fragments
+from token_budget import count_tokens, split_rules
+from log_sinks import segment_compressor
+from logger import logger
+
+config = get_config()
+
+# Preload-and-fork worker model (see gunicorn.conf.py):
+#   master: import the app with gc disabled, warm_up(), freeze_shared_state(), fork
+#   worker: after_fork()
+# Everything built before the fork is shared copy-on-write; freezing it keeps
+# the collector in the workers from writing to (and so copying) those pages.
+
+
+def warm_up() -> Dict[str, int]:
+    """Build the read-only state every request needs: rules, knowledge and their derived caches"""
+    rules = rule_engine.load_rules()
+    knowledge = knowledge_manager.load_all_knowledge()
+    generation = knowledge_manager.generation
+
+    split_rules(rules)
+    count_tokens(rules)
+    for entry in knowledge:
+        knowledge_fragments.get(entry, generation)
+    # Renders and caches the rules-only system message
+    prompt_builder.build_chat_messages(rules, [], "", knowledge_generation=generation)
+
+    return {
+        "rules_tokens": count_tokens(rules),
+        "knowledge_entries": len(knowledge),
+        "knowledge_generation": generation,
+    }
+
+
+def freeze_shared_state():
+    """Move every object allocated so far out of the collector's reach (call right before forking)"""
+    gc.collect()
+    gc.freeze()
+
+
+def after_fork():
+    """Per-worker setup: threads and queues do not survive fork.
+
+    Connection pools (upstream HTTP client, shared-state SQLite/Redis
+    connections) are opened lazily per process and need no reset here.
+    """
+    gc.enable()
+    logger.after_fork()
+    segment_compressor.after_fork()
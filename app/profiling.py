@@ -0,0 +1,249 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+# inspect.CO_COROUTINE, without importing inspect at startup
+_CO_COROUTINE = 0x0080
+
+class _NullRequest:
+    """Context manager used while profiling is off"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set_stage(self, stage: str):
+        pass
+
+
+_NULL_REQUEST = _NullRequest()
+
+
+class _ProfiledRequest:
+    """Tags the handler frame for the sampler, or runs cProfile around the request"""
+
+    __slots__ = ("profiler", "endpoint", "stage", "scope", "frame_id", "profile")
+
+    def __init__(self, profiler: "Profiler", endpoint: str, stage: Optional[str]):
+        self.profiler = profiler
+        self.endpoint = endpoint
+        self.stage = stage
+        self.scope = ""
+        self.frame_id = None
+        self.profile = None
+
+    @property
+    def tags(self) -> str:
+        return f"endpoint={self.endpoint};stage={self.stage or 'none'}{self.scope}"
+
+    def __enter__(self):
+        # The frame executing the ``with`` statement is the request handler
+        frame = sys._getframe(1)
+        self.frame_id = id(frame)
+        if self.profiler.mode == "cprofile" and frame.f_code.co_flags & _CO_COROUTINE:
+            # cProfile stays on across awaits, recording whatever the loop runs meanwhile
+            self.scope = ";scope=event_loop"
+        self.profiler._begin(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._end(self)
+        return False
+
+    def set_stage(self, stage: str):
+        """Tag the request with a stage only known once handling has started"""
+        self.stage = stage
+        self.profiler._retag(self)
+
+
+class Profiler:
+    """On-demand profiler producing collapsed stacks (flamegraph.pl / speedscope input).
+
+    Two modes:
+      sample   - a background thread samples the stacks of in-flight requests
+                 every ``interval`` seconds; cheap enough for production
+      cprofile - deterministic cProfile of individual requests, one at a time.
+                 cProfile follows a whole thread, so in an async handler it also
+                 records other requests the event loop runs while the profiled
+                 one awaits; those profiles are tagged ``scope=event_loop``
+
+    A session ends after ``max_requests`` requests or ``max_seconds``,
+    whichever comes first. Request handlers wrap their work in
+    ``profiler.request(endpoint, stage)``; while no session is running that
+    returns a shared no-op context manager, so profiling costs nothing when off.
+    Every stack is prefixed with the request's ``endpoint=...;stage=...`` tags.
+    Handlers that learn the stage later call ``set_stage`` on the context
+    manager: a cProfile run is filed under the final stage, samples taken
+    before the call keep ``stage=none``.
+    """
+
+    MODES = ("sample", "cprofile")
+
+    def __init__(self):
+        self.active = False
+        self.mode = None
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.started_at = None
+        self.ends_at = None
+        self.max_requests = None
+        self.interval = 0.005
+        self.requests_profiled = 0
+        self._tagged: Dict[int, str] = {}
+        self._stacks: Counter = Counter()
+        self._stats: Dict[str, "pstats.Stats"] = {}
+        self._profiling_request = None
+        self._sampler = None
+
+    def start(self, mode: str = "sample", max_requests: Optional[int] = 100, max_seconds: Optional[float] = 30.0,
+              interval_ms: float = 5.0):
+        """Start a profiling session, discarding the output of the previous one"""
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown profiling mode: {mode}")
+        with self._lock:
+            self.active = False
+            self._reset()
+            self.mode = mode
+            self.started_at = time.time()
+            self.ends_at = self.started_at + max_seconds if max_seconds else None
+            self.max_requests = max_requests
+            self.interval = max(interval_ms, 1.0) / 1000
+            self.active = True
+        if mode == "sample":
+            self._sampler = threading.Thread(target=self._sample_loop, name="profiler-sampler", daemon=True)
+            self._sampler.start()
+
+    def stop(self):
+        self.active = False
+
+    def request(self, endpoint: str, stage: Optional[str] = None):
+        """Context manager around one request's handling"""
+        if not self.active:
+            return _NULL_REQUEST
+        if self._expired():
+            self.active = False
+            return _NULL_REQUEST
+        return _ProfiledRequest(self, endpoint, stage)
+
+    def _begin(self, request: _ProfiledRequest):
+        if self.mode == "cprofile":
+            # cProfile can only follow one request at a time
+            with self._lock:
+                if self._profiling_request is not None or not self.active:
+                    return
+                self._profiling_request = request
+            # Imported on first use; most processes never profile
+            import cProfile
+            request.profile = cProfile.Profile()
+            request.profile.enable()
+        else:
+            self._tagged[request.frame_id] = request.tags
+
+    def _retag(self, request: _ProfiledRequest):
+        if request.frame_id in self._tagged:
+            self._tagged[request.frame_id] = request.tags
+
+    def _end(self, request: _ProfiledRequest):
+        if request.profile is not None:
+            request.profile.disable()
+            import pstats
+            with self._lock:
+                stats = self._stats.get(request.tags)
+                if stats is None:
+                    self._stats[request.tags] = pstats.Stats(request.profile)
+                else:
+                    stats.add(request.profile)
+                self._profiling_request = None
+            self._count_request()
+        elif request.frame_id in self._tagged:
+            del self._tagged[request.frame_id]
+            self._count_request()
+
+    def _count_request(self):
+        self.requests_profiled += 1
+        if self.max_requests and self.requests_profiled >= self.max_requests:
+            self.active = False
+
+    def _expired(self) -> bool:
+        return self.ends_at is not None and time.time() >= self.ends_at
+
+    def _sample_loop(self):
+        sampler_id = threading.get_ident()
+        while self.active and not self._expired():
+            if self._tagged:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id != sampler_id:
+                        self._record_sample(frame)
+            time.sleep(self.interval)
+        self.active = False
+
+    def _record_sample(self, frame):
+        names: List[str] = []
+        tags = None
+        while frame is not None:
+            if tags is None:
+                tags = self._tagged.get(id(frame))
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        if tags is not None:
+            names.append(tags)
+            self._stacks[";".join(reversed(names))] += 1
+
+    def collapsed(self) -> str:
+        """Output so far as collapsed stacks: ``frame;frame;frame count`` per line"""
+        if self.mode == "cprofile":
+            lines = []
+            with self._lock:
+                for tags, stats in sorted(self._stats.items()):
+                    lines.extend(_collapse_stats(tags, stats))
+            return "\n".join(lines) + ("\n" if lines else "")
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+    def status(self) -> Dict:
+        if self.active and self._expired():
+            self.active = False
+        return {
+            "active": self.active,
+            "mode": self.mode,
+            "started_at": self.started_at,
+            "ends_at": self.ends_at,
+            "max_requests": self.max_requests,
+            "requests_profiled": self.requests_profiled,
+            "samples": sum(list(self._stacks.values())),
+        }
+
+
+def _collapse_stats(tags: str, stats: "pstats.Stats") -> List[str]:
+    """Caller;callee edges of a cProfile run, weighted by own time in microseconds"""
+    lines = []
+    for func, (_, _, own_time, _, callers) in stats.stats.items():
+        name = _function_name(func)
+        if not callers:
+            weight = int(own_time * 1_000_000)
+            if weight:
+                lines.append(f"{tags};{name} {weight}")
+            continue
+        for caller, caller_stats in callers.items():
+            weight = int(caller_stats[2] * 1_000_000)
+            if weight:
+                lines.append(f"{tags};{_function_name(caller)};{name} {weight}")
+    return lines
+
+
+def _function_name(func) -> str:
+    filename, _, name = func
+    return f"{os.path.basename(filename)}:{name}" if filename != "~" else name
+
+
+# Global profiler shared by request handlers
+profiler = Profiler()
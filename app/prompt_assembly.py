@@ -0,0 +1,98 @@
+from string import Formatter
+from typing import Dict, List, Tuple
+
+
+class CompiledTemplate:
+    """Template parsed once into static text and named slots.
+
+    Rendering only concatenates prebuilt parts, so no format string is
+    re-parsed per request. Literal braces use the usual ``{{``/``}}`` escapes.
+    """
+
+    __slots__ = ("source", "_parts", "_slots")
+
+    def __init__(self, source: str):
+        self.source = source
+        parts: List[str] = []
+        slots: List[Tuple[int, str]] = []
+        literal = []
+        for text, field, spec, conversion in Formatter().parse(source):
+            literal.append(text)
+            if field is None:
+                continue
+            if spec or conversion:
+                raise ValueError(f"Unsupported format spec in template slot '{field}'")
+            parts.append("".join(literal))
+            literal = []
+            slots.append((len(parts), field))
+            parts.append("")
+        parts.append("".join(literal))
+
+        self._parts = parts
+        self._slots = slots
+
+    @property
+    def fields(self) -> List[str]:
+        return [name for _, name in self._slots]
+
+    def render(self, **values: str) -> str:
+        if not self._slots:
+            return self._parts[0]
+        parts = self._parts.copy()
+        for index, name in self._slots:
+            parts[index] = values[name]
+        return "".join(parts)
+
+
+class KnowledgeFragmentCache:
+    """Rendered prompt text for knowledge entries, cached per knowledge generation"""
+
+    FIELDS = (
+        ("topic", "Unknown"),
+        ("domain", "general"),
+        ("response_guidance", "No guidance available"),
+        ("confidence", "unknown"),
+        ("risk_level", "unknown"),
+    )
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.generation = None
+        self._fragments: Dict[Tuple, str] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, entry: Dict, generation: int) -> str:
+        """Return the rendered fragment for ``entry`` (without its ``Entry N:`` header)"""
+        if generation != self.generation:
+            self._fragments.clear()
+            self.generation = generation
+
+        key = tuple(entry.get(field, default) for field, default in self.FIELDS)
+        fragment = self._fragments.get(key)
+        if fragment is not None:
+            self.hits += 1
+            return fragment
+
+        self.misses += 1
+        topic, domain, guidance, confidence, risk_level = key
+        fragment = (
+            f"\n- Topic: {topic}\n- Domain: {domain}\n- Guidance: {guidance}"
+            f"\n- Confidence: {confidence}\n- Risk Level: {risk_level}\n"
+        )
+        if len(self._fragments) >= self.max_entries:
+            self._fragments.clear()
+        self._fragments[key] = fragment
+        return fragment
+
+    def get_stats(self) -> Dict:
+        return {
+            "generation": self.generation,
+            "entries": len(self._fragments),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# Global fragment cache shared by prompt builders
+knowledge_fragments = KnowledgeFragmentCache()
@@ -0,0 +1,82 @@
+import json
+import random
+from pathlib import Path
+from string import Formatter
+from typing import Dict, List, Optional
+
+
+class _Defaults(dict):
+    """Mapping that renders unknown placeholders as empty strings"""
+
+    def __missing__(self, key):
+        return ""
+
+
+class ResponseTemplates:
+    """Local responses for fully templated conversation stages.
+
+    Templates are loaded once from a JSON file mapping a stage name to a list
+    of variants. A stage missing from the file is not templated and callers
+    fall back to the LLM. The optional ``_defaults`` object supplies values
+    for placeholders such as ``{reason}``.
+    """
+
+    def __init__(self, templates_file: Path, rng: Optional[random.Random] = None):
+        self.templates_file = Path(templates_file)
+        self.templates: Dict[str, List[str]] = {}
+        self.defaults: Dict[str, str] = {}
+        self._placeholders: Dict[str, bool] = {}
+        self._rng = rng or random.Random()
+        self.load()
+
+    def load(self):
+        """(Re)load templates from disk; a missing or invalid file disables templating"""
+        try:
+            with open(self.templates_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError, UnicodeDecodeError) as e:
+            print(f"Stage templates unavailable ({self.templates_file}): {e}")
+            data = {}
+
+        if not isinstance(data, dict):
+            data = {}
+
+        self.defaults = data.pop("_defaults", {})
+        self.templates = {}
+        self._placeholders = {}
+        for stage, variants in data.items():
+            if not isinstance(variants, list):
+                continue
+
+            valid = []
+            for variant in variants:
+                if not isinstance(variant, str) or not variant.strip():
+                    continue
+                try:
+                    fields = [field for _, field, _, _ in Formatter().parse(variant) if field]
+                except ValueError:
+                    print(f"Skipping malformed template for stage '{stage}': {variant[:50]}")
+                    continue
+                # Remember which variants need formatting so plain ones are returned as-is
+                self._placeholders[variant] = bool(fields)
+                valid.append(variant)
+
+            if valid:
+                self.templates[stage] = valid
+
+    def handles(self, stage: str) -> bool:
+        return stage in self.templates
+
+    def render(self, stage: str, **values) -> Optional[str]:
+        """Return a rendered response for ``stage`` or None if it is not templated"""
+        variants = self.templates.get(stage)
+        if not variants:
+            return None
+
+        variant = variants[0] if len(variants) == 1 else self._rng.choice(variants)
+        if not self._placeholders[variant]:
+            return variant
+
+        fields = _Defaults(self.defaults)
+        fields.update({key: value for key, value in values.items() if value})
+        return variant.format_map(fields)
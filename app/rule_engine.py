@@ -5,6 +5,10 @@ class RuleEngine:
         self.rules_dir = Path("rules")
         self.rules_file = self.rules_dir / "rules.txt"
         
+        # Rules text is reused until the file changes on disk
+        self._rules_cache = None
+        self._rules_signature = None
+        
         # Ensure rules directory exists
         self.rules_dir.mkdir(exist_ok=True)
         
@@ -37,10 +41,15 @@ class RuleEngine:
             f.write(default_rules)
     
     def load_rules(self) -> str:
-        """Load rules from rules.txt file"""
+        """Load rules from rules.txt file (cached until the file changes)"""
         try:
-            with open(self.rules_file, 'r', encoding='utf-8') as f:
-                return f.read()
+            stat = self.rules_file.stat()
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if self._rules_cache is None or signature != self._rules_signature:
+                with open(self.rules_file, 'r', encoding='utf-8') as f:
+                    self._rules_cache = f.read()
+                self._rules_signature = signature
+            return self._rules_cache
         except FileNotFoundError:
             self._create_default_rules()
             return self.load_rules()
@@ -1,11 +1,11 @@
 import re
 import json
-from typing import Dict, List, Any
+from typing import Dict, List, Any, NamedTuple
 from pydantic import BaseModel, ValidationError
+from tracing import tracer
 
 class SecurityConfig:
     MAX_MESSAGE_LENGTH = 2000
-    MAX_CONTEXT_LENGTH = 8000
     MAX_KNOWLEDGE_ENTRIES = 10
     BLOCKED_PATTERNS = [
         r'ignore\s+previous\s+instructions',
@@ -16,6 +16,40 @@ class SecurityConfig:
         r'forget\s+everything',
         r'new\s+instructions',
     ]
+    # Script-injection markers; messages containing them are flagged, not rewritten
+    SUSPICIOUS_PATTERNS = [
+        r'<script',
+        r'javascript:',
+        r'eval\(',
+        r'document\.',
+        r'window\.',
+        r'alert\(',
+        r'prompt\(',
+        r'confirm\(',
+    ]
+
+class InputVerdict(NamedTuple):
+    """Result of scanning one user message"""
+    text: str
+    filtered_count: int
+    suspicious: bool
+    truncated: bool
+
+def _compile_input_scanner(flags: int = 0):
+    """One alternation covering both injection filters and abuse markers.
+    
+    Patterns are lower-case and normally run against the lower-cased message,
+    which is much faster than an IGNORECASE alternation.
+    """
+    blocked = "|".join(f"(?:{p})" for p in SecurityConfig.BLOCKED_PATTERNS)
+    suspicious = "|".join(f"(?:{p})" for p in SecurityConfig.SUSPICIOUS_PATTERNS)
+    return re.compile(f"(?P<blocked>{blocked})|(?P<suspicious>{suspicious})", flags)
+
+_INPUT_SCANNER = _compile_input_scanner()
+_INPUT_SCANNER_IGNORECASE = _compile_input_scanner(re.IGNORECASE)
+
+# Control characters other than whitespace; whitespace runs are collapsed separately
+_CONTROL_CHARS = {code: None for code in range(32) if not chr(code).isspace()}
 
 class KnowledgeEntrySchema(BaseModel):
     topic: str
@@ -29,18 +63,49 @@ class SecurityValidator:
     @staticmethod
     def sanitize_user_input(message: str) -> str:
         """Sanitize user input to prevent prompt injection"""
-        if len(message) > SecurityConfig.MAX_MESSAGE_LENGTH:
+        return SecurityValidator.scan_user_input(message).text
+    
+    @staticmethod
+    @tracer.traced("security.scan_user_input")
+    def scan_user_input(message: str) -> InputVerdict:
+        """Sanitize, filter injection patterns and flag abuse markers in one pass"""
+        truncated = len(message) > SecurityConfig.MAX_MESSAGE_LENGTH
+        if truncated:
             message = message[:SecurityConfig.MAX_MESSAGE_LENGTH]
         
-        # Remove potential injection patterns
-        for pattern in SecurityConfig.BLOCKED_PATTERNS:
-            message = re.sub(pattern, '[FILTERED]', message, flags=re.IGNORECASE)
+        # Drop control characters and collapse whitespace first so neither can
+        # split a blocked phrase
+        message = " ".join(message.translate(_CONTROL_CHARS).split())
+        
+        # Match offsets on the lower-cased copy map back to the original unless
+        # lower-casing changed the length (a few non-ASCII characters do)
+        lowered = message.lower()
+        if len(lowered) == len(message):
+            matches = _INPUT_SCANNER.finditer(lowered)
+        else:
+            matches = _INPUT_SCANNER_IGNORECASE.finditer(message)
         
-        # Remove excessive whitespace and control characters
-        message = re.sub(r'\s+', ' ', message).strip()
-        message = ''.join(char for char in message if ord(char) >= 32 or char in '\n\t')
+        parts = []
+        position = 0
+        filtered_count = 0
+        suspicious = False
+        for match in matches:
+            kind = match.lastgroup
+            if kind == "suspicious":
+                suspicious = True
+                continue
+            parts.append(message[position:match.start()])
+            parts.append('[FILTERED]')
+            filtered_count += 1
+            position = match.end()
+        parts.append(message[position:])
         
-        return message
+        return InputVerdict(
+            text="".join(parts).strip(),
+            filtered_count=filtered_count,
+            suspicious=suspicious,
+            truncated=truncated
+        )
     
     @staticmethod
     def validate_knowledge_json(data: Any) -> List[Dict]:
@@ -65,18 +130,3 @@ class SecurityValidator:
                 continue  # Skip invalid entries
         
         return validated_entries
-    
-    @staticmethod
-    def limit_context_size(prompt: str) -> str:
-        """Ensure prompt doesn't exceed context limits"""
-        if len(prompt) > SecurityConfig.MAX_CONTEXT_LENGTH:
-            # Truncate from middle, keep beginning and end
-            start_len = SecurityConfig.MAX_CONTEXT_LENGTH // 3
-            end_len = SecurityConfig.MAX_CONTEXT_LENGTH // 3
-            
-            start = prompt[:start_len]
-            end = prompt[-end_len:]
-            
-            return f"{start}\n\n[CONTEXT TRUNCATED]\n\n{end}"
-        
-        return prompt
\ No newline at end of file
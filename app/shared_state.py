@@ -0,0 +1,301 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+# (key, amount, ttl_seconds); an amount of 0 only reads the current value,
+# without creating the key or extending its TTL
+Increment = Tuple[str, int, int]
+
+
+class BackendUnavailable(Exception):
+    """The shared store failed recently and is not being retried yet"""
+
+
+class SharedCounterBackend(ABC):
+    """Counter store shared by every worker process.
+
+    ``incr_many`` applies a whole batch of increments in one operation
+    (one transaction or one network round trip) and returns the new values
+    in the same order.
+    """
+
+    @abstractmethod
+    def incr_many(self, increments: List[Increment]) -> List[int]:
+        ...
+
+    def close(self):
+        pass
+
+
+class SQLiteCounterBackend(SharedCounterBackend):
+    """Counters in a SQLite file, for several workers on one node"""
+
+    UPSERT = (
+        "INSERT INTO counters (key, value, expires_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value, expires_at = excluded.expires_at "
+        "RETURNING value"
+    )
+    # RETURNING needs SQLite 3.35; older libraries update, insert and read back
+    # in the same transaction instead
+    HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+    UPDATE = "UPDATE counters SET value = value + ?, expires_at = ? WHERE key = ?"
+    INSERT = "INSERT INTO counters (key, value, expires_at) VALUES (?, ?, ?)"
+    SELECT = "SELECT value FROM counters WHERE key = ?"
+
+    def __init__(self, path: str, cleanup_every: int = 1000):
+        self.path = path
+        self.cleanup_every = cleanup_every
+        self._local = threading.local()
+        self._batches = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections are per thread and never shared across a fork
+        owner = getattr(self._local, "owner", None)
+        if owner != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS counters "
+                "(key TEXT PRIMARY KEY, value INTEGER NOT NULL, expires_at REAL NOT NULL) WITHOUT ROWID"
+            )
+            self._local.conn = conn
+            self._local.owner = os.getpid()
+        return self._local.conn
+
+    def incr_many(self, increments: List[Increment]) -> List[int]:
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            values = [self._apply(conn, key, amount, now + ttl) for key, amount, ttl in increments]
+            self._batches += 1
+            if self._batches % self.cleanup_every == 0:
+                conn.execute("DELETE FROM counters WHERE expires_at < ?", (now,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return values
+
+    def _apply(self, conn: sqlite3.Connection, key: str, amount: int, expires_at: float) -> int:
+        if amount == 0:
+            row = conn.execute(self.SELECT, (key,)).fetchone()
+            return row[0] if row else 0
+        if self.HAS_RETURNING:
+            return conn.execute(self.UPSERT, (key, amount, expires_at)).fetchone()[0]
+        if conn.execute(self.UPDATE, (amount, expires_at, key)).rowcount == 0:
+            conn.execute(self.INSERT, (key, amount, expires_at))
+        return conn.execute(self.SELECT, (key,)).fetchone()[0]
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+            self._local.owner = None
+
+
+class RedisError(Exception):
+    """Error reply from a Redis-protocol server"""
+
+
+class RedisCounterBackend(SharedCounterBackend):
+    """Counters in any Redis-protocol (RESP) server, for workers on many nodes.
+
+    Each batch is written as one pipeline of ``INCRBY``/``EXPIRE`` pairs
+    (``GET`` for reads) and costs a single round trip. The connection is
+    reopened after any error.
+    """
+
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0,
+                 password: Optional[str] = None, timeout: float = 0.5):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock = None
+        self._reader = None
+        self._owner = None
+
+    @staticmethod
+    def _encode(*args) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("Connection closed by server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b":":
+            return int(payload)
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            raise RedisError(payload.decode("utf-8"))
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            return [self._read_reply() for _ in range(int(payload))]
+        raise RedisError(f"Unexpected reply type {kind!r}")
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile("rb")
+        self._owner = os.getpid()
+        setup = []
+        if self.password:
+            setup.append(self._encode("AUTH", self.password))
+        if self.db:
+            setup.append(self._encode("SELECT", self.db))
+        if setup:
+            self._sock.sendall(b"".join(setup))
+            for _ in setup:
+                self._read_reply()
+
+    def incr_many(self, increments: List[Increment]) -> List[int]:
+        payload = b"".join(
+            self._encode("GET", key) if amount == 0
+            else self._encode("INCRBY", key, amount) + self._encode("EXPIRE", key, ttl)
+            for key, amount, ttl in increments
+        )
+        with self._lock:
+            try:
+                if self._sock is None or self._owner != os.getpid():
+                    self._connect()
+                self._sock.sendall(payload)
+                values = []
+                for _, amount, _ in increments:
+                    value = self._read_reply()
+                    if amount != 0:
+                        self._read_reply()  # EXPIRE
+                    values.append(int(value or 0))
+            except (OSError, RedisError):
+                self._disconnect()
+                raise
+        return values
+
+    def _disconnect(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._reader = None
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+
+class CircuitBreakerBackend(SharedCounterBackend):
+    """Stop calling a failing backend for a while.
+
+    After a failure, calls raise ``BackendUnavailable`` at once for a backoff
+    that doubles from ``min_backoff`` up to ``max_backoff`` seconds, so
+    requests fall back to per-process counters instead of each waiting for a
+    connect or busy timeout. Then a single call probes the backend again;
+    a success closes the breaker.
+    """
+
+    def __init__(self, backend: SharedCounterBackend, min_backoff: float = 1.0, max_backoff: float = 30.0):
+        self.backend = backend
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self._backoff = 0.0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def incr_many(self, increments: List[Increment]) -> List[int]:
+        if self._backoff:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._retry_at:
+                    raise BackendUnavailable(f"Retrying the shared store in {self._retry_at - now:.1f}s")
+                # This call probes; the others keep failing fast meanwhile
+                self._retry_at = now + self._backoff
+        try:
+            values = self.backend.incr_many(increments)
+        except Exception:
+            with self._lock:
+                self._backoff = min(max(2 * self._backoff, self.min_backoff), self.max_backoff)
+                self._retry_at = time.monotonic() + self._backoff
+            raise
+        self._backoff = 0.0
+        return values
+
+    def close(self):
+        self.backend.close()
+
+
+def create_counter_backend(url: Optional[str]) -> Optional[SharedCounterBackend]:
+    """Build a backend from ``sqlite:///relative.db``, ``sqlite:////absolute.db`` or
+    ``redis://[:password@]host[:port][/db]``, behind a circuit breaker.
+
+    Returns None for an empty URL or ``memory://`` (per-process counters).
+    """
+    if not url or url.startswith("memory://"):
+        return None
+
+    parts = urlsplit(url)
+    if parts.scheme == "sqlite":
+        return CircuitBreakerBackend(SQLiteCounterBackend(url[len("sqlite:///"):]))
+    if parts.scheme == "redis":
+        return CircuitBreakerBackend(RedisCounterBackend(
+            host=parts.hostname or "localhost",
+            port=parts.port or 6379,
+            db=int(parts.path.lstrip("/") or 0),
+            password=unquote(parts.password) if parts.password else None
+        ))
+    raise ValueError(f"Unsupported shared state URL scheme: {parts.scheme}")
+
+
+class SharedWindowCounters:
+    """Named sliding-window counters per key, kept in a shared backend.
+
+    Each window is approximated from two adjacent fixed windows: the current
+    count plus the previous count weighted by how much of it still overlaps
+    the sliding window. All counters touched for one key are updated in a
+    single backend batch.
+    """
+
+    def __init__(self, backend: SharedCounterBackend, windows: Dict[str, int], prefix: str = "chatbot"):
+        self.backend = backend
+        self.windows = windows
+        self.prefix = prefix
+
+    def update(self, key: str, amounts: Dict[str, int], now: Optional[float] = None) -> Dict[str, float]:
+        """Add ``amounts`` to the named counters of ``key`` and return their window estimates"""
+        now = time.time() if now is None else now
+        increments: List[Increment] = []
+        weights = []
+        for name, amount in amounts.items():
+            window = self.windows[name]
+            index = int(now // window)
+            base = f"{self.prefix}:{name}:{key}"
+            increments.append((f"{base}:{index}", amount, 2 * window))
+            increments.append((f"{base}:{index - 1}", 0, 2 * window))
+            weights.append(1.0 - (now % window) / window)
+
+        values = self.backend.incr_many(increments)
+        return {
+            name: values[2 * i] + values[2 * i + 1] * weights[i]
+            for i, name in enumerate(amounts)
+        }
@@ -1,12 +1,15 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import os
 import json
 import httpx
 import asyncio
+import atexit
 import uuid
 import time
 from dotenv import load_dotenv
+from background_loop import BackgroundLoop
+from static_assets import AssetBundle
 
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.dirname(__file__)), ".env"), override=False)
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), ".env"), override=False)
@@ -14,9 +17,20 @@ load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), ".env"), overrid
 app = Flask(__name__)
 CORS(app)
 
+# Widget files minified, hashed and precompressed once at startup
+widget_assets = AssetBundle(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "widget"))
+
 # Configuration
 GROK_API_KEY = os.getenv("GROK_API_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+UPSTREAM_TIMEOUT = 30
+# Whole upstream call, including connecting; the coroutine is cancelled after this
+REQUEST_TIMEOUT = 35
+
+# One event loop and connection pool for all requests of this process
+background_loop = BackgroundLoop("groq-client-loop")
+_http_client = None
+_http_client_loop = None
 
 @app.route('/')
 def root():
@@ -42,8 +56,11 @@ def chat():
         if not message:
             return jsonify({"error": "Message required"}), 400
         
-        # Simple chat response using httpx
-        response = asyncio.run(call_groq_api(message))
+        # Simple chat response using httpx on the shared background loop
+        try:
+            response = background_loop.run(call_groq_api(message), timeout=REQUEST_TIMEOUT)
+        except TimeoutError:
+            response = "Request timed out. Please try again."
         
         return jsonify({
             "response": response,
@@ -58,39 +75,64 @@ def chat():
             "version": "1.0.0"
         })
 
+def _get_http_client() -> httpx.AsyncClient:
+    """Client bound to the background loop (only call from coroutines running on it)"""
+    global _http_client, _http_client_loop
+    loop = asyncio.get_running_loop()
+    if _http_client is None or _http_client.is_closed or _http_client_loop is not loop:
+        _http_client = httpx.AsyncClient(timeout=UPSTREAM_TIMEOUT)
+        _http_client_loop = loop
+    return _http_client
+
+async def _close_http_client():
+    if _http_client is not None:
+        await _http_client.aclose()
+
+@atexit.register
+def _shutdown_background_loop():
+    if _http_client is not None:
+        try:
+            background_loop.run(_close_http_client(), timeout=5)
+        except Exception:
+            pass
+    background_loop.stop()
+
 async def call_groq_api(message):
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://api.groq.com/openai/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {GROK_API_KEY}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "messages": [
-                        {"role": "system", "content": "You are a helpful AI assistant."},
-                        {"role": "user", "content": message}
-                    ],
-                    "model": "llama3-8b-8192",
-                    "temperature": 0.7,
-                    "max_tokens": 1000
-                },
-                timeout=30
-            )
+        client = _get_http_client()
+        response = await client.post(
+            "https://api.groq.com/openai/v1/chat/completions",
+            headers={
+                "Authorization": f"Bearer {GROK_API_KEY}",
+                "Content-Type": "application/json"
+            },
+            json={
+                "messages": [
+                    {"role": "system", "content": "You are a helpful AI assistant."},
+                    {"role": "user", "content": message}
+                ],
+                "model": "llama3-8b-8192",
+                "temperature": 0.7,
+                "max_tokens": 1000
+            },
+            timeout=UPSTREAM_TIMEOUT
+        )
+        
+        if response.status_code == 200:
+            result = response.json()
+            return result["choices"][0]["message"]["content"]
+        else:
+            return "I'm having trouble connecting. Please try again."
             
-            if response.status_code == 200:
-                result = response.json()
-                return result["choices"][0]["message"]["content"]
-            else:
-                return "I'm having trouble connecting. Please try again."
-                
     except Exception:
         return "I'm experiencing technical difficulties. Please try again."
 
 @app.route('/widget/<path:filename>')
 def serve_widget(filename):
-    return send_from_directory('../widget', filename)
+    status, headers, body = widget_assets.respond(
+        filename, request.headers.get('If-None-Match'), request.headers.get('Accept-Encoding')
+    )
+    return Response(body, status=status, headers=headers)
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 8000))
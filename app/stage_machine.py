@@ -0,0 +1,172 @@
+import re
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Tuple
+
+# Substring keywords, grouped by the signal they raise. Every keyword is
+# matched anywhere in the lower-cased message, like the original
+# ``any(keyword in message_lower ...)`` checks.
+SIGNAL_KEYWORDS: Dict[str, List[str]] = {
+    "emergency": ["chest pain", "can't breathe", "severe bleeding", "emergency"],
+    "treatment": ["treatment", "cure", "medicine", "remedy", "what should i do",
+                  "how to treat", "how to fix", "tell me the treatment"],
+    "confusion": ["what", "what?", "huh", "huh?", "confused", "don't understand"],
+    "goodbye": ["bye", "goodbye", "thanks", "thank you", "that's all"],
+    "what": ["what"],
+    "do_or_should": ["do", "should"],
+    "help": ["help"],
+    "advice": ["advice"],
+    "recommend": ["recommend"],
+    "serious": ["serious"],
+    "fix": ["fix"],
+    "joking": ["joking"],
+}
+
+# Greetings that restart a finished conversation: either the whole message or
+# one of its whitespace-separated words
+RESTART_KEYWORDS = ["hi", "hello", "hey", "start over", "restart", "new chat", "greetings"]
+
+# Short acknowledgements that mean "just give me the answer"
+ACKNOWLEDGEMENTS = ["nothing", "no", "nah", "nahhhh", "none", "ok", "okay", "fine"]
+
+# Composite signals: a signal is raised when all signals of any one group are present
+COMPOSITE_SIGNALS: Dict[str, List[Tuple[str, ...]]] = {
+    "conclusion_request": [
+        ("what", "do_or_should"),
+        ("help", "few_words"),
+        ("advice",),
+        ("recommend",),
+        ("serious", "fix"),
+        ("joking",),
+        ("acknowledgement",),
+    ],
+}
+
+FINAL_STAGES = ("conclusion", "goodbye")
+
+# Ordered transition table; the first matching row wins.
+#   signal        - signal that must be present (None: always)
+#   min_messages  - alternative trigger on the number of user messages
+#   from_stages   - only applies when the current stage is one of these
+#   except_stages - never applies when the current stage is one of these
+#   needs_history - requires more than one line of conversation context
+TRANSITIONS: List[Dict] = [
+    {"signal": "emergency", "target": "emergency_conclusion"},
+    {"signal": "restart", "from_stages": FINAL_STAGES, "target": "greeting"},
+    {"signal": "treatment", "target": "conclusion"},
+    {"signal": "confusion", "needs_history": True, "target": "conclusion"},
+    {"signal": "conclusion_request", "min_messages": 5, "except_stages": FINAL_STAGES, "target": "conclusion"},
+    {"signal": "goodbye", "target": "goodbye"},
+]
+
+# Default progression when no signal fires: stage -> (min_messages, advance_to, otherwise)
+PROGRESSION: Dict[str, Tuple[int, str, str]] = {
+    "greeting": (0, "symptom_gathering", "symptom_gathering"),
+    "symptom_gathering": (2, "follow_up_questions", "symptom_gathering"),
+    "follow_up_questions": (4, "conclusion", "follow_up_questions"),
+    "conclusion": (0, "goodbye", "goodbye"),
+}
+DEFAULT_STAGE = "greeting"
+
+
+class StageClassifier:
+    """Table-driven conversation stage machine with a single-pass keyword matcher"""
+
+    def __init__(self, transitions: List[Dict] = None, progression: Dict[str, Tuple[int, str, str]] = None,
+                 cache_size: int = 4096):
+        self.transitions = transitions or TRANSITIONS
+        self.progression = progression or PROGRESSION
+        self._restart_phrases = frozenset(RESTART_KEYWORDS)
+        self._restart_words = frozenset(k for k in RESTART_KEYWORDS if " " not in k)
+        self._acknowledgements = frozenset(ACKNOWLEDGEMENTS)
+
+        # Message counts above the highest threshold all behave the same, so
+        # they share cache entries
+        thresholds = [row.get("min_messages", 0) for row in self.transitions]
+        thresholds += [row[0] for row in self.progression.values()]
+        self._count_cap = max(thresholds) if thresholds else 0
+
+        self._compile_matcher()
+        self._decide = lru_cache(maxsize=cache_size)(self._decide_uncached)
+
+    def _compile_matcher(self):
+        """Compile all substring keywords into one overlapping-match regex"""
+        keyword_signals: Dict[str, set] = {}
+        for signal, keywords in SIGNAL_KEYWORDS.items():
+            for keyword in keywords:
+                keyword_signals.setdefault(keyword, set()).add(signal)
+
+        # At each position the longest keyword wins, so every keyword that is a
+        # prefix of it must contribute its signals as well
+        self._signals_for: Dict[str, FrozenSet[str]] = {}
+        for keyword in keyword_signals:
+            signals = set()
+            for other, other_signals in keyword_signals.items():
+                if keyword.startswith(other):
+                    signals |= other_signals
+            self._signals_for[keyword] = frozenset(signals)
+
+        alternation = "|".join(re.escape(k) for k in sorted(keyword_signals, key=len, reverse=True))
+        self._matcher = re.compile(f"(?=({alternation}))")
+
+    def normalize(self, message: str) -> str:
+        return message.lower().strip().strip('.,!?')
+
+    def signals(self, normalized: str, word_count: int) -> FrozenSet[str]:
+        """Return every signal raised by a normalized message"""
+        found = set()
+        for match in self._matcher.finditer(normalized):
+            found |= self._signals_for[match.group(1)]
+
+        if normalized in self._acknowledgements:
+            found.add("acknowledgement")
+        if word_count <= 3:
+            found.add("few_words")
+        if normalized in self._restart_phrases or not self._restart_words.isdisjoint(normalized.split()):
+            found.add("restart")
+
+        for composite, groups in COMPOSITE_SIGNALS.items():
+            if any(found.issuperset(group) for group in groups):
+                found.add(composite)
+
+        return frozenset(found)
+
+    def next_stage(self, current_stage: str, message: str, context: str, user_message_count: int) -> str:
+        """Determine the next conversation stage"""
+        return self._decide(
+            current_stage,
+            self.normalize(message),
+            # Only "three words or fewer" matters, so longer messages share a key
+            min(len(message.split()), 4),
+            min(user_message_count, self._count_cap),
+            "\n" in context
+        )
+
+    def _decide_uncached(self, current_stage: str, normalized: str, word_count: int,
+                         user_message_count: int, has_history: bool) -> str:
+        signals = self.signals(normalized, word_count)
+
+        for row in self.transitions:
+            if row.get("from_stages") and current_stage not in row["from_stages"]:
+                continue
+            if row.get("except_stages") and current_stage in row["except_stages"]:
+                continue
+            if row.get("needs_history") and not has_history:
+                continue
+
+            triggered = row.get("signal") is None or row["signal"] in signals
+            if not triggered and "min_messages" in row:
+                triggered = user_message_count >= row["min_messages"]
+            if triggered:
+                return row["target"]
+
+        if current_stage not in self.progression:
+            return DEFAULT_STAGE
+        min_messages, advance_to, otherwise = self.progression[current_stage]
+        return advance_to if user_message_count >= min_messages else otherwise
+
+    def cache_info(self):
+        return self._decide.cache_info()
+
+
+# Global stage classifier
+stage_classifier = StageClassifier()
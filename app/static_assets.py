@@ -0,0 +1,183 @@
+import gzip
+import hashlib
+import mimetypes
+import re
+from pathlib import Path
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Hashed URLs never change content; plain names must revalidate to pick up deploys
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE = "public, max-age=300, must-revalidate"
+
+_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+_CSS_PUNCTUATION = re.compile(r"\s*([{};,])\s*")
+_HASHED_NAME = re.compile(r"^(?P<stem>.+)\.(?P<hash>[0-9a-f]{10})(?P<suffix>\.[^.]+)$")
+
+
+def minify_css(text: str) -> str:
+    """Drop comments and the whitespace around CSS punctuation"""
+    text = _CSS_COMMENT.sub("", text)
+    text = _CSS_PUNCTUATION.sub(r"\1", text)
+    text = re.sub(r":\s+", ":", text)
+    text = re.sub(r"\s+", " ", text)
+    return text.replace(";}", "}").strip()
+
+
+def minify_js(text: str) -> str:
+    """Line-preserving minification: indentation, blank lines and whole-line ``//`` comments.
+
+    Lines are never joined, so automatic semicolon insertion is unaffected.
+    """
+    lines = (line.strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line and not line.startswith("//"))
+
+
+MINIFIERS = {".css": minify_css, ".js": minify_js}
+
+
+class StaticAsset(NamedTuple):
+    """One file, minified and precompressed once, with its content hash"""
+    name: str
+    hashed_name: str
+    content_type: str
+    etag: str
+    # Content-Encoding ("identity", "gzip", "br") -> body
+    bodies: Dict[str, bytes]
+
+
+def _accepted_encodings(accept_encoding: Optional[str]) -> Dict[str, float]:
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    return accepted
+
+
+class AssetBundle:
+    """Static files served from memory with content-hashed URLs.
+
+    Every file in ``directory`` is read once, minified, hashed and
+    precompressed (gzip, and brotli when installed). References between
+    files (``/widget/widget.css?v=...`` inside widget.js) are rewritten to
+    the hashed URL, which is cached as immutable; the plain name stays
+    available with a short cache lifetime and an ETag, so embed snippets
+    revalidate with a 304 instead of downloading again.
+    """
+
+    def __init__(self, directory: str, url_prefix: str = "/widget", names: Optional[Iterable[str]] = None):
+        self.directory = Path(directory)
+        self.url_prefix = url_prefix.rstrip("/")
+        self.assets: Dict[str, StaticAsset] = {}
+        self._by_hashed_name: Dict[str, StaticAsset] = {}
+
+        if names is None:
+            names = sorted(path.name for path in self.directory.iterdir() if path.is_file())
+        # JavaScript last, so it can reference the final names of the other files
+        for name in sorted(names, key=lambda name: name.endswith(".js")):
+            self._add(name)
+
+    def _add(self, name: str):
+        path = self.directory / name
+        suffix = path.suffix.lower()
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+        body = path.read_bytes()
+        if suffix in MINIFIERS:
+            text = self._rewrite_references(body.decode("utf-8"))
+            body = MINIFIERS[suffix](text).encode("utf-8")
+            content_type += "; charset=utf-8"
+
+        digest = hashlib.sha256(body).hexdigest()
+        bodies = {"identity": body}
+        if content_type.startswith(("text/", "application/javascript", "image/svg")):
+            bodies["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+            if brotli is not None:
+                bodies["br"] = brotli.compress(body, quality=11)
+        # Keep only encodings that actually save bytes
+        bodies = {coding: data for coding, data in bodies.items()
+                  if coding == "identity" or len(data) < len(body)}
+
+        asset = StaticAsset(
+            name=name,
+            hashed_name=f"{path.stem}.{digest[:10]}{path.suffix}",
+            content_type=content_type,
+            etag=digest[:16],
+            bodies=bodies
+        )
+        self.assets[name] = asset
+        self._by_hashed_name[asset.hashed_name] = asset
+
+    def _rewrite_references(self, text: str) -> str:
+        for asset in self.assets.values():
+            pattern = re.escape(f"{self.url_prefix}/{asset.name}") + r"(?:\?[^`'\"\s)]*)?"
+            text = re.sub(pattern, f"{self.url_prefix}/{asset.hashed_name}", text)
+        return text
+
+    def url(self, name: str) -> str:
+        """Immutable, content-hashed URL of an asset"""
+        return f"{self.url_prefix}/{self.assets[name].hashed_name}"
+
+    def lookup(self, filename: str) -> Tuple[Optional[StaticAsset], bool]:
+        """(asset, immutable) for a plain or hashed file name"""
+        asset = self._by_hashed_name.get(filename)
+        if asset is not None:
+            return asset, True
+        match = _HASHED_NAME.match(filename)
+        if match:
+            # A hash from an earlier deploy: serve current content, but let it expire
+            filename = match.group("stem") + match.group("suffix")
+        return self.assets.get(filename), False
+
+    def respond(self, filename: str, if_none_match: Optional[str] = None,
+                accept_encoding: Optional[str] = None) -> Tuple[int, Dict[str, str], bytes]:
+        """Status, headers and body for a request, independent of the web framework"""
+        asset, immutable = self.lookup(filename)
+        if asset is None:
+            return 404, {}, b""
+
+        accepted = _accepted_encodings(accept_encoding)
+        coding = "identity"
+        for candidate in ("br", "gzip"):
+            if candidate in asset.bodies and accepted.get(candidate, accepted.get("*", 0.0)) > 0:
+                coding = candidate
+                break
+
+        etag = f'"{asset.etag}"' if coding == "identity" else f'"{asset.etag}-{coding}"'
+        headers = {
+            "ETag": etag,
+            "Cache-Control": IMMUTABLE_CACHE if immutable else REVALIDATE_CACHE,
+            "Vary": "Accept-Encoding",
+        }
+        if if_none_match and self._etag_matches(asset, if_none_match):
+            return 304, headers, b""
+
+        headers["Content-Type"] = asset.content_type
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+        return 200, headers, asset.bodies[coding]
+
+    @staticmethod
+    def _etag_matches(asset: StaticAsset, if_none_match: str) -> bool:
+        # Any encoding of the same content is still current (weak comparison)
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag == "*":
+                return True
+            tag = tag[2:] if tag.startswith("W/") else tag
+            if tag.strip('"').split("-")[0] == asset.etag:
+                return True
+        return False
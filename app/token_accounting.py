@@ -0,0 +1,218 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Optional
+
+from config import get_config
+from shared_state import BackendUnavailable, create_counter_backend
+
+config = get_config()
+
+def _empty_totals() -> Dict[str, int]:
+    return {"prompt": 0, "completion": 0, "turns": 0}
+
+
+class TokenAccountant:
+    """Upstream token usage per stage, provider and hour, with budgets.
+
+    Lifetime totals feed the metrics exporter; per-day totals are written to
+    a daily rollup file (one per worker, see ``merge_rollups``). Tokens that
+    never reached the provider (budget trimming, local templates) are
+    recorded as savings by reason.
+
+    ``check_budget`` enforces per-session and per-day limits. With a shared
+    counter backend the daily total is shared by all workers.
+    """
+
+    def __init__(self, session_budget: int = 0, daily_budget: int = 0, rollup_dir: Optional[str] = None,
+                 shared_backend=None, max_sessions: int = 10000):
+        self.session_budget = session_budget
+        self.daily_budget = daily_budget
+        self.rollup_dir = Path(rollup_dir) if rollup_dir else None
+        self.shared_backend = shared_backend
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+
+        self.totals: Dict[tuple, Dict[str, int]] = defaultdict(_empty_totals)
+        self.saved: Dict[str, int] = defaultdict(int)
+        self.shed: Dict[str, int] = defaultdict(int)
+        self._sessions: "OrderedDict[str, int]" = OrderedDict()
+        self._start_day(self._today())
+        self._thread = None
+        self._stop = threading.Event()
+
+    @staticmethod
+    def _today(now: Optional[float] = None) -> str:
+        return datetime.fromtimestamp(time.time() if now is None else now, timezone.utc).strftime("%Y-%m-%d")
+
+    def _start_day(self, day: str):
+        self.day = day
+        self.day_by_stage: Dict[tuple, Dict[str, int]] = defaultdict(_empty_totals)
+        self.day_by_hour: Dict[str, Dict[str, int]] = defaultdict(_empty_totals)
+        self.day_saved: Dict[str, int] = defaultdict(int)
+        # This worker's own tokens (rollups) and the all-worker total (budget only)
+        self.day_total = 0
+        self.shared_day_total = 0
+
+    def record(self, stage: str, provider: str, usage: Optional[Dict], session_id: Optional[str] = None,
+               saved: Optional[Dict[str, int]] = None, now: Optional[float] = None):
+        """Record one upstream completion (``usage`` as returned by the provider)"""
+        now = time.time() if now is None else now
+        prompt = int((usage or {}).get("prompt_tokens", 0))
+        completion = int((usage or {}).get("completion_tokens", 0))
+        total = prompt + completion
+
+        with self._lock:
+            day = self._today(now)
+            if day != self.day:
+                self._write_rollup(self._build_rollup())
+                self._start_day(day)
+
+            hour = datetime.fromtimestamp(now, timezone.utc).strftime("%H")
+            for bucket in (self.totals[(stage, provider)], self.day_by_stage[(stage, provider)],
+                           self.day_by_hour[hour]):
+                bucket["prompt"] += prompt
+                bucket["completion"] += completion
+                bucket["turns"] += 1
+            for reason, tokens in (saved or {}).items():
+                self.saved[reason] += tokens
+                self.day_saved[reason] += tokens
+            self.day_total += total
+
+            if session_id:
+                self._sessions[session_id] = self._sessions.get(session_id, 0) + total
+                self._sessions.move_to_end(session_id)
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+
+        if self.shared_backend is not None and total:
+            try:
+                shared_total = self.shared_backend.incr_many([(f"chatbot:tokens:{day}", total, 2 * 86400)])[0]
+                with self._lock:
+                    if day == self.day:
+                        self.shared_day_total = max(self.shared_day_total, shared_total)
+            except BackendUnavailable:
+                pass  # failed recently and already reported
+            except Exception as e:
+                logging.getLogger('chatbot.errors').error(
+                    f"Shared token budget unavailable, using per-process totals: {type(e).__name__}"
+                )
+
+    def record_saved(self, reason: str, tokens: int):
+        """Record tokens that did not have to be sent upstream"""
+        with self._lock:
+            self.saved[reason] += tokens
+            self.day_saved[reason] += tokens
+
+    def check_budget(self, session_id: Optional[str] = None) -> Optional[str]:
+        """Name of the exhausted budget ("daily" or "session"), or None"""
+        with self._lock:
+            day_total = max(self.day_total, self.shared_day_total)
+            if self.daily_budget and self._today() == self.day and day_total >= self.daily_budget:
+                self.shed["daily"] += 1
+                return "daily"
+            if self.session_budget and session_id and self._sessions.get(session_id, 0) >= self.session_budget:
+                self.shed["session"] += 1
+                return "session"
+            return None
+
+    def session_tokens(self, session_id: str) -> int:
+        return self._sessions.get(session_id, 0)
+
+    def export_state(self) -> Dict:
+        """Lifetime counters for the metrics exporter"""
+        with self._lock:
+            return {
+                "usage": [
+                    {"stage": stage, "provider": provider, **dict(counts)}
+                    for (stage, provider), counts in self.totals.items()
+                ],
+                "saved": dict(self.saved),
+                "shed": dict(self.shed),
+            }
+
+    def rollup(self) -> Dict:
+        """Today's totals in the daily rollup format"""
+        with self._lock:
+            return self._build_rollup()
+
+    def _build_rollup(self) -> Dict:
+        turns = sum(counts["turns"] for counts in self.day_by_hour.values())
+        return {
+            "day": self.day,
+            "pid": os.getpid(),
+            "total_tokens": self.day_total,
+            "tokens_per_turn": self.day_total / turns if turns else 0.0,
+            "by_stage": [
+                {"stage": stage, "provider": provider, **dict(counts)}
+                for (stage, provider), counts in sorted(self.day_by_stage.items())
+            ],
+            "by_hour": {hour: dict(counts) for hour, counts in sorted(self.day_by_hour.items())},
+            "saved": dict(self.day_saved),
+        }
+
+    def _write_rollup(self, rollup: Dict):
+        """Write a day's rollup atomically to this worker's file"""
+        if self.rollup_dir is None or not rollup["by_hour"]:
+            return
+        self.rollup_dir.mkdir(parents=True, exist_ok=True)
+        target = self.rollup_dir / f"tokens-{rollup['day']}-{os.getpid()}.json"
+        partial = target.with_name(target.name + ".tmp")
+        partial.write_text(json.dumps(rollup, indent=2))
+        os.replace(partial, target)
+
+    def flush(self):
+        self._write_rollup(self.rollup())
+
+    def start(self, interval: float):
+        """Rewrite today's rollup every ``interval`` seconds from a daemon thread"""
+        if self.rollup_dir is None or interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,), name="token-rollup", daemon=True)
+        self._thread.start()
+
+    def _run(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.flush()
+            except OSError as e:
+                logging.getLogger('chatbot.errors').error(f"Token rollup write failed: {e}")
+
+
+def merge_rollups(rollup_dir: str, day: str) -> Dict:
+    """Combine the per-worker rollup files of one day"""
+    merged = {"day": day, "total_tokens": 0, "turns": 0, "by_stage": {}, "by_hour": {}, "saved": {}}
+    for path in sorted(Path(rollup_dir).glob(f"tokens-{day}-*.json")):
+        rollup = json.loads(path.read_text())
+        merged["total_tokens"] += rollup["total_tokens"]
+        for row in rollup["by_stage"]:
+            key = f"{row['stage']}/{row['provider']}"
+            totals = merged["by_stage"].setdefault(key, _empty_totals())
+            for field in totals:
+                totals[field] += row[field]
+            merged["turns"] += row["turns"]
+        for hour, counts in rollup["by_hour"].items():
+            totals = merged["by_hour"].setdefault(hour, _empty_totals())
+            for field in totals:
+                totals[field] += counts[field]
+        for reason, tokens in rollup["saved"].items():
+            merged["saved"][reason] = merged["saved"].get(reason, 0) + tokens
+    merged["tokens_per_turn"] = merged["total_tokens"] / merged["turns"] if merged["turns"] else 0.0
+    return merged
+
+
+# Global token accountant configured from AppConfig
+token_accountant = TokenAccountant(
+    session_budget=config.session_token_budget,
+    daily_budget=config.daily_token_budget,
+    rollup_dir=config.token_rollup_dir,
+    shared_backend=create_counter_backend(config.shared_state_url)
+)
+atexit.register(token_accountant.flush)
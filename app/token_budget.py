@@ -0,0 +1,143 @@
+import re
+from functools import lru_cache
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+from config import get_config
+from conversation_turns import Turn
+
+config = get_config()
+
+# Words and punctuation runs; long pieces cost roughly one token per 4 characters
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]+")
+
+# Fixed per-message overhead of the chat format (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """Fast local token estimate for a text fragment (cached per fragment)"""
+    if not text:
+        return 0
+    return sum((len(piece) + 3) // 4 for piece in _TOKEN_PATTERN.findall(text))
+
+
+@lru_cache(maxsize=32)
+def split_rules(rules: str) -> Tuple[str, ...]:
+    """Split a rules document into whole sections at its ``## `` headings"""
+    sections = re.split(r"\n(?=## )", rules.strip())
+    return tuple(section.strip() for section in sections if section.strip())
+
+
+class PromptBudget(NamedTuple):
+    """Outcome of a budget allocation: the units to send and what they cost"""
+    rules: str
+    knowledge: List[Dict]
+    history: List[Turn]
+    tokens: Dict[str, int]
+    dropped: Dict[str, int]
+
+
+class TokenBudgetAllocator:
+    """Split a per-stage prompt token budget across rules, knowledge and history.
+
+    Units are only ever kept or dropped whole. Rules are packed first within
+    their own stage-independent budget so the system prefix stays identical
+    across stages; knowledge entries are taken in relevance order up to
+    ``knowledge_share`` of what is left; history gets the remainder, newest
+    turn first.
+    """
+
+    def __init__(self, stage_budgets: Dict[str, int], rules_budget: int, knowledge_share: float = 0.4):
+        self.stage_budgets = stage_budgets
+        self.rules_budget = rules_budget
+        self.knowledge_share = knowledge_share
+
+    def budget_for(self, stage: str) -> int:
+        return self.stage_budgets.get(stage, self.stage_budgets.get("default", 3000))
+
+    def allocate(self, rules: str, knowledge: List[Dict], history: List[Turn], user_message: str,
+                 stage: str = "default", knowledge_text: Callable[[Dict], str] = None,
+                 fixed_text: str = "") -> PromptBudget:
+        """Choose which rules sections, knowledge entries and turns fit the stage budget.
+
+        ``knowledge`` must be ordered by relevance and ``history`` oldest first.
+        ``fixed_text`` is any other prompt text that is always sent.
+        """
+        knowledge_text = knowledge_text or (lambda entry: entry.get("response_guidance", ""))
+        remaining = self.budget_for(stage)
+        remaining -= count_tokens(user_message) + count_tokens(fixed_text) + 3 * MESSAGE_OVERHEAD_TOKENS
+
+        rules_kept, rules_tokens, rules_dropped = self._pack_rules(rules, self.rules_budget)
+        remaining -= rules_tokens
+
+        # Tokens of units left out, reported as savings
+        dropped_tokens = count_tokens(rules) - rules_tokens if rules_dropped else 0
+
+        knowledge_kept = []
+        knowledge_tokens = 0
+        knowledge_limit = int(max(remaining, 0) * self.knowledge_share)
+        for entry in knowledge:
+            cost = count_tokens(knowledge_text(entry))
+            if knowledge_tokens + cost <= knowledge_limit:
+                knowledge_kept.append(entry)
+                knowledge_tokens += cost
+            else:
+                dropped_tokens += cost
+        remaining -= knowledge_tokens
+
+        history_kept = []
+        history_tokens = 0
+        for position, turn in enumerate(reversed(history)):
+            cost = count_tokens(turn.user) + count_tokens(turn.bot or "") + 2 * MESSAGE_OVERHEAD_TOKENS
+            if history_tokens + cost > remaining:
+                dropped_tokens += sum(
+                    count_tokens(old.user) + count_tokens(old.bot or "") + 2 * MESSAGE_OVERHEAD_TOKENS
+                    for old in history[:len(history) - position]
+                )
+                break
+            history_kept.append(turn)
+            history_tokens += cost
+        history_kept.reverse()
+
+        return PromptBudget(
+            rules=rules_kept,
+            knowledge=knowledge_kept,
+            history=history_kept,
+            tokens={
+                "budget": self.budget_for(stage),
+                "rules": rules_tokens,
+                "knowledge": knowledge_tokens,
+                "history": history_tokens,
+                "user_message": count_tokens(user_message),
+            },
+            dropped={
+                "rules_sections": rules_dropped,
+                "knowledge_entries": len(knowledge) - len(knowledge_kept),
+                "history_turns": len(history) - len(history_kept),
+                "tokens": dropped_tokens,
+            }
+        )
+
+    def _pack_rules(self, rules: str, budget: int) -> Tuple[str, int, int]:
+        """Keep rules sections in document order while they fit"""
+        if count_tokens(rules) <= budget:
+            return rules, count_tokens(rules), 0
+
+        kept = []
+        used = 0
+        sections = split_rules(rules)
+        for section in sections:
+            cost = count_tokens(section)
+            if used + cost <= budget:
+                kept.append(section)
+                used += cost
+        return "\n\n".join(kept), used, len(sections) - len(kept)
+
+
+# Global allocator configured from AppConfig
+prompt_budget = TokenBudgetAllocator(
+    stage_budgets=config.prompt_token_budgets,
+    rules_budget=config.rules_token_budget,
+    knowledge_share=config.knowledge_token_share
+)
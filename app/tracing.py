@@ -0,0 +1,269 @@
+import functools
+import inspect
+import logging
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import get_config
+
+config = get_config()
+
+# W3C trace context: version-traceid-parentid-flags
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_INVALID_TRACE_ID = "0" * 32
+_INVALID_SPAN_ID = "0" * 16
+
+_current_span: ContextVar[Optional["Span"]] = ContextVar("chatbot_current_span", default=None)
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """(trace_id, parent span_id, sampled) of a W3C ``traceparent`` header, or None if invalid"""
+    match = _TRACEPARENT.match(header.strip().lower()) if header else None
+    if match is None:
+        return None
+    trace_id, parent_id, flags = match.groups()
+    if trace_id == _INVALID_TRACE_ID or parent_id == _INVALID_SPAN_ID:
+        return None
+    return trace_id, parent_id, bool(int(flags, 16) & 0x01)
+
+
+def _new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits) or 1:0{bits // 4}x}"
+
+
+class _NullSpan:
+    """Span used outside of recorded traces; every operation is a no-op"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def record_error(self, error: BaseException):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Trace:
+    """Spans of one request, exported together when the root span ends"""
+
+    __slots__ = ("tracer", "trace_id", "sampled", "root", "spans")
+
+    def __init__(self, tracer: "Tracer", trace_id: str, sampled: bool):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.root = None
+        self.spans: List["Span"] = []
+
+
+class Span:
+    """A timed phase of a request; entering it makes it the current span"""
+
+    __slots__ = ("trace", "name", "span_id", "parent_id", "attributes", "status", "error",
+                 "start_time", "duration_ms", "_started", "_token")
+
+    def __init__(self, trace: _Trace, name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.status = "ok"
+        self.error = None
+        self.start_time = None
+        self.duration_ms = None
+
+    @property
+    def traceparent(self) -> str:
+        """W3C header identifying this span, for outgoing requests"""
+        return f"00-{self.trace.trace_id}-{self.span_id}-{'01' if self.trace.sampled else '00'}"
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException):
+        self.status = "error"
+        self.error = f"{type(error).__name__}: {str(error)[:200]}"
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        self.start_time = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration_ms = (time.perf_counter() - self._started) * 1000
+        if exc is not None and self.status == "ok":
+            self.record_error(exc)
+        _current_span.reset(self._token)
+        trace = self.trace
+        if len(trace.spans) < trace.tracer.max_spans:
+            trace.spans.append(self)
+        if trace.root is self:
+            trace.tracer._finish(trace)
+        return False
+
+    def to_dict(self, trace_start: float) -> Dict[str, Any]:
+        entry = {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_offset_ms": round((self.start_time - trace_start) * 1000, 3),
+            "duration_ms": round(self.duration_ms, 3),
+            "status": self.status,
+        }
+        if self.error:
+            entry["error"] = self.error
+        if self.attributes:
+            entry["attributes"] = self.attributes
+        return entry
+
+
+class RingExporter:
+    """Keeps the most recent finished traces in memory"""
+
+    def __init__(self, capacity: int = 200):
+        self._traces: deque = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def export(self, trace: Dict[str, Any]):
+        with self._lock:
+            self._traces.append(trace)
+
+    def recent(self, limit: int = 20, min_duration_ms: float = 0.0) -> List[Dict[str, Any]]:
+        """Newest traces first, optionally only those slower than ``min_duration_ms``"""
+        with self._lock:
+            traces = list(self._traces)
+        matches = [trace for trace in reversed(traces) if trace["duration_ms"] >= min_duration_ms]
+        return matches[:limit]
+
+    def get(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            for trace in reversed(self._traces):
+                if trace["trace_id"] == trace_id:
+                    return trace
+        return None
+
+
+class LoggerExporter:
+    """Writes each finished trace as one record of a logger (one JSONL line per trace)"""
+
+    def __init__(self, log: logging.Logger):
+        self.log = log
+
+    def export(self, trace: Dict[str, Any]):
+        self.log.info(trace)
+
+
+class Tracer:
+    """Minimal request tracing: spans in a context variable, W3C propagation, sampling.
+
+    ``start_trace`` opens the root span of a request, continuing the caller's
+    trace when a valid ``traceparent`` is given. A trace is recorded when the
+    caller sampled it, with probability ``sample_rate`` otherwise, or - if
+    ``slow_threshold_ms`` is set - always, and then only exported when the
+    request turns out slower than the threshold. ``span`` opens a child of
+    the current span; outside a recorded trace it returns a shared no-op
+    span, so instrumented code costs a context variable lookup when off.
+    """
+
+    def __init__(self, sample_rate: float = 0.0, slow_threshold_ms: float = 0.0,
+                 exporters: Optional[List[Any]] = None, max_spans: int = 256):
+        self.sample_rate = sample_rate
+        self.slow_threshold_ms = slow_threshold_ms
+        self.exporters = list(exporters or [])
+        self.max_spans = max_spans
+
+    def start_trace(self, name: str, traceparent: Optional[str] = None, **attributes):
+        """Root span of a request"""
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = _new_id(128), None
+            sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not sampled and self.slow_threshold_ms <= 0:
+            return _NULL_SPAN
+
+        trace = _Trace(self, trace_id, sampled)
+        trace.root = Span(trace, name, parent_id, attributes)
+        return trace.root
+
+    def span(self, name: str, **attributes):
+        """Child of the current span"""
+        parent = _current_span.get()
+        if parent is None:
+            return _NULL_SPAN
+        return Span(parent.trace, name, parent.span_id, attributes)
+
+    def traced(self, name: str) -> Callable:
+        """Decorator running a function (sync or async) inside a span"""
+        def decorate(func):
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.span(name):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    @staticmethod
+    def current_span():
+        return _current_span.get() or _NULL_SPAN
+
+    @staticmethod
+    def traceparent() -> Optional[str]:
+        """Header value propagating the current span to an outgoing request"""
+        span = _current_span.get()
+        return span.traceparent if span is not None else None
+
+    def _finish(self, trace: _Trace):
+        root = trace.root
+        if not trace.sampled and root.duration_ms < self.slow_threshold_ms:
+            return
+        exported = {
+            "trace_id": trace.trace_id,
+            "name": root.name,
+            "start_time": root.start_time,
+            "duration_ms": round(root.duration_ms, 3),
+            "status": root.status,
+            "sampled": trace.sampled,
+            "spans": [span.to_dict(root.start_time)
+                      for span in sorted(trace.spans, key=lambda span: span._started)],
+        }
+        for exporter in self.exporters:
+            try:
+                exporter.export(exported)
+            except Exception as e:
+                logging.getLogger('chatbot.errors').error(
+                    f"Trace export failed: {type(exporter).__name__}: {type(e).__name__}"
+                )
+
+
+# Global tracer: recent traces in memory, and in logs/traces.jsonl when enabled
+trace_ring = RingExporter(config.trace_ring_size)
+tracer = Tracer(
+    sample_rate=config.trace_sample_rate,
+    slow_threshold_ms=config.trace_slow_threshold_ms,
+    exporters=[trace_ring] + ([LoggerExporter(logging.getLogger('chatbot.traces'))] if config.trace_to_file else [])
+)
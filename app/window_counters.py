@@ -0,0 +1,139 @@
+from array import array
+from collections import OrderedDict
+from typing import Dict, Hashable
+
+
+class SlidingWindowCounter:
+    """Event count over a sliding window, kept in a fixed ring of time buckets.
+
+    Memory is two small arrays regardless of how many events are recorded.
+    Buckets are addressed by absolute bucket index (``timestamp // bucket_seconds``)
+    and reset lazily when the ring wraps around to them.
+    """
+
+    __slots__ = ("_counts", "_stamps", "last_seen")
+
+    def __init__(self, buckets: int):
+        self._counts = array("I", bytes(4 * buckets))
+        self._stamps = array("q", bytes(8 * buckets))
+        self.last_seen = 0
+
+    def add(self, bucket_index: int, amount: int = 1) -> int:
+        """Record ``amount`` events in ``bucket_index`` and return the window total"""
+        slot = bucket_index % len(self._counts)
+        if self._stamps[slot] != bucket_index:
+            self._stamps[slot] = bucket_index
+            self._counts[slot] = 0
+        self._counts[slot] += amount
+        self.last_seen = bucket_index
+        return self.total(bucket_index)
+
+    def total(self, bucket_index: int) -> int:
+        cutoff = bucket_index - len(self._counts)
+        return sum(count for count, stamp in zip(self._counts, self._stamps) if stamp > cutoff)
+
+
+class CountMinSketch:
+    """Approximate windowed counts for an unbounded key population in constant memory.
+
+    One ``depth x width`` sketch per coarse time bucket; estimates never
+    undercount and overcount only through hash collisions.
+    """
+
+    def __init__(self, width: int = 2048, depth: int = 4, buckets: int = 6):
+        self.width = width
+        self.depth = depth
+        self._sketches = [array("I", bytes(4 * width * depth)) for _ in range(buckets)]
+        self._stamps = [None] * buckets
+
+    def _indexes(self, key: Hashable):
+        h1 = hash(key)
+        h2 = (h1 >> 17) | 1
+        return [row * self.width + (h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def add(self, key: Hashable, bucket_index: int, amount: int = 1) -> int:
+        slot = bucket_index % len(self._sketches)
+        if self._stamps[slot] != bucket_index:
+            self._stamps[slot] = bucket_index
+            sketch = self._sketches[slot]
+            sketch[:] = array("I", bytes(len(sketch) * 4))
+        sketch = self._sketches[slot]
+        for index in self._indexes(key):
+            sketch[index] += amount
+        return self.estimate(key, bucket_index)
+
+    def estimate(self, key: Hashable, bucket_index: int) -> int:
+        cutoff = bucket_index - len(self._sketches)
+        live = [sketch for sketch, stamp in zip(self._sketches, self._stamps) if stamp is not None and stamp > cutoff]
+        if not live:
+            return 0
+        return min(sum(sketch[index] for sketch in live) for index in self._indexes(key))
+
+
+class WindowedCounterStore:
+    """Sliding-window counters per key with idle eviction and a hard key cap.
+
+    Up to ``max_keys`` keys get an exact ``SlidingWindowCounter``. Keys idle
+    for a whole window are evicted first; when the cap is still reached (e.g.
+    a scan from many addresses) new keys are counted in a shared
+    ``CountMinSketch`` instead, so memory stays bounded.
+    """
+
+    def __init__(self, window_seconds: int = 3600, bucket_seconds: int = 60, max_keys: int = 10000,
+                 sketch_width: int = 1024):
+        self.bucket_seconds = bucket_seconds
+        self.buckets = max(window_seconds // bucket_seconds, 1)
+        self.max_keys = max_keys
+        self._counters: "OrderedDict[Hashable, SlidingWindowCounter]" = OrderedDict()
+        # Sketch buckets are coarser (1/6 of the window) to keep it small; one
+        # extra bucket holds the current partial period
+        self._sketch_bucket_seconds = max(window_seconds // 6, bucket_seconds)
+        self._sketch = CountMinSketch(width=sketch_width, buckets=7)
+        self.overflow_events = 0
+
+    def add(self, key: Hashable, now: float, amount: int = 1) -> int:
+        """Record events for ``key`` at time ``now``; returns the count within the window"""
+        bucket_index = int(now // self.bucket_seconds)
+        # Amortized cleanup: look at a couple of the least recently used keys per call
+        self._evict_idle(bucket_index, limit=2)
+        
+        counter = self._counters.get(key)
+        if counter is None:
+            if len(self._counters) >= self.max_keys:
+                self._evict_idle(bucket_index)
+            if len(self._counters) >= self.max_keys:
+                self.overflow_events += amount
+                return self._sketch.add(key, int(now // self._sketch_bucket_seconds), amount)
+            counter = self._counters[key] = SlidingWindowCounter(self.buckets)
+        else:
+            self._counters.move_to_end(key)
+        return counter.add(bucket_index, amount)
+
+    def count(self, key: Hashable, now: float) -> int:
+        counter = self._counters.get(key)
+        if counter is not None:
+            return counter.total(int(now // self.bucket_seconds))
+        if self.overflow_events:
+            return self._sketch.estimate(key, int(now // self._sketch_bucket_seconds))
+        return 0
+
+    def _evict_idle(self, bucket_index: int, limit: int = None):
+        """Drop least recently used keys that saw no events within the window"""
+        cutoff = bucket_index - self.buckets
+        evicted = 0
+        while self._counters and (limit is None or evicted < limit):
+            key, counter = next(iter(self._counters.items()))
+            if counter.last_seen > cutoff:
+                break
+            del self._counters[key]
+            evicted += 1
+
+    def __len__(self) -> int:
+        return len(self._counters)
+
+    def get_stats(self) -> Dict:
+        return {
+            "tracked_keys": len(self._counters),
+            "max_keys": self.max_keys,
+            "overflow_events": self.overflow_events,
+        }
@@ -0,0 +1,28 @@
+"""Shared setup for the benchmark scripts.
+
+Benchmarks import modules straight from ``app/`` the same way the server does,
+so the app directory is put on ``sys.path`` and placeholder API keys are set
+for ``AppConfig``. Nothing here talks to an upstream provider.
+"""
+import os
+import sys
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+os.environ.setdefault("GROK_API_KEY", "bench-grok-key")
+os.environ.setdefault("GEMINI_API_KEY", "bench-gemini-key")
+
+
+def timeit(func, iterations: int = 10000) -> float:
+    """Return mean microseconds per call of ``func``"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def report(name: str, value: float, unit: str):
+    print(f"{name:<48} {value:>12.2f} {unit}")
@@ -0,0 +1,57 @@
+"""Measure heap bytes per live session for conversation storage.
+
+Usage: python benchmarks/bench_conversation_memory.py [sessions]
+"""
+import sys
+import tracemalloc
+from datetime import datetime
+
+from _common import report
+from conversation_turns import SessionHistory
+
+TURNS_PER_SESSION = 10
+USER_MESSAGE = "I have had a headache and mild fever since yesterday evening"
+BOT_RESPONSE = (
+    "Based on what you described, conditions like a viral infection are more likely "
+    "than others. How high has your temperature been, and have you noticed chills?"
+)
+
+
+def legacy_session():
+    """Storage layout used before SessionHistory: one dict per turn"""
+    return [
+        {"user": USER_MESSAGE + str(i), "bot": BOT_RESPONSE + str(i),
+         "timestamp": datetime.utcnow().isoformat()}
+        for i in range(TURNS_PER_SESSION)
+    ]
+
+
+def compact_session(compress_cold: bool):
+    history = SessionHistory(compress_cold=compress_cold)
+    for i in range(TURNS_PER_SESSION):
+        history.add_turn(USER_MESSAGE + str(i), BOT_RESPONSE + str(i))
+    return history
+
+
+def bytes_per_session(factory, sessions: int) -> float:
+    tracemalloc.start()
+    baseline = tracemalloc.take_snapshot()
+    store = {f"session-{i}": factory() for i in range(sessions)}
+    current = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in current.compare_to(baseline, "filename"))
+    del store
+    return total / sessions
+
+
+def main():
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print(f"{sessions} sessions x {TURNS_PER_SESSION} turns")
+    report("legacy dict turns", bytes_per_session(legacy_session, sessions), "bytes/session")
+    report("SessionHistory", bytes_per_session(lambda: compact_session(False), sessions), "bytes/session")
+    report("SessionHistory (compressed cold turns)",
+           bytes_per_session(lambda: compact_session(True), sessions), "bytes/session")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Measure private (unshared) memory of forked workers with and without gc.freeze.
+
+Imports the ASGI app and warms the shared state in this process, as the
+gunicorn master does with preload_app, then forks workers that run a full
+garbage collection - what a worker's collector eventually does - and report
+their Private_Dirty from /proc (Linux only).
+
+Usage: python benchmarks/bench_preload_fork.py [workers]
+"""
+import gc
+import os
+import sys
+
+from _common import report
+
+
+def private_dirty_kb() -> int:
+    with open("/proc/self/smaps_rollup") as smaps:
+        for line in smaps:
+            if line.startswith("Private_Dirty:"):
+                return int(line.split()[1])
+    return 0
+
+
+def fork_workers(count: int) -> float:
+    """Mean Private_Dirty (kB) of ``count`` forked workers after a collection"""
+    import preload
+
+    results = []
+    for _ in range(count):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            preload.after_fork()
+            gc.collect()
+            os.write(write_fd, str(private_dirty_kb()).encode())
+            os._exit(0)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as pipe:
+            results.append(int(pipe.read()))
+        os.waitpid(pid, 0)
+    return sum(results) / len(results)
+
+
+def main():
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        print("Needs /proc/self/smaps_rollup (Linux)")
+        return
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+
+    gc.disable()
+    import asgi  # noqa: F401  (the preloaded application)
+    import preload
+    summary = preload.warm_up()
+    print(f"{workers} workers, shared state: {summary}")
+
+    gc.collect()
+    report("private dirty per worker, gc not frozen", fork_workers(workers), "kB")
+    preload.freeze_shared_state()
+    report(f"private dirty per worker, {gc.get_freeze_count()} objects frozen", fork_workers(workers), "kB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""Per-request cost of prompt assembly: time and allocated bytes.
+
+Usage: python benchmarks/bench_prompt_assembly.py
+
+Allocation is measured with tracemalloc as the peak traced memory while
+building one prompt. The prompt text itself has to be allocated, so the
+budget is expressed as a multiple of the final prompt size.
+"""
+import json
+import os
+import tracemalloc
+
+from _common import report, timeit
+from prompt_builder import PromptBuilder
+
+# Peak allocation allowed per prompt, relative to the size of the prompt itself
+ALLOCATION_BUDGET_RATIO = 3.0
+
+KNOWLEDGE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              "knowledge", "core_knowledge.json")
+
+
+def main():
+    with open(KNOWLEDGE_FILE, encoding="utf-8") as f:
+        knowledge = json.load(f)[:10]
+    rules = "Be helpful and accurate.\n" * 40
+    context = "User: I have a headache\nAssistant: How long have you had it?\n" * 5
+    builder = PromptBuilder()
+
+    def build():
+        return builder.build_chat_prompt(rules, knowledge, "It started two days ago", context,
+                                         knowledge_generation=1)
+
+    prompt = build()
+    report("build_chat_prompt (10 knowledge entries)", timeit(build, 5000), "us")
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    build()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    budget = len(prompt) * ALLOCATION_BUDGET_RATIO
+    report("prompt size", len(prompt), "bytes")
+    report("peak allocation per prompt", peak, "bytes")
+    print(f"allocation budget {budget:.0f} bytes: {'OK' if peak <= budget else 'EXCEEDED'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""Microbenchmark for the conversation stage classifier.
+
+Usage: python benchmarks/bench_stage_machine.py
+"""
+from _common import report, timeit
+from stage_machine import StageClassifier
+
+MESSAGES = [
+    ("greeting", "Hello, I have had a headache since yesterday morning", 1),
+    ("symptom_gathering", "It is around a 6 out of 10 and worse at night", 2),
+    ("follow_up_questions", "I tried ibuprofen but it did not help much", 3),
+    ("conclusion", "thank you so much", 5),
+    ("goodbye", "hi", 6),
+]
+CONTEXT = "User: hello\nAssistant: Hi, what brings you here today?"
+
+
+def main():
+    classifier = StageClassifier()
+
+    def uncached():
+        for stage, message, count in MESSAGES:
+            classifier._decide_uncached(stage, classifier.normalize(message), min(len(message.split()), 4),
+                                        count, True)
+
+    def cached():
+        for stage, message, count in MESSAGES:
+            classifier.next_stage(stage, message, CONTEXT, count)
+
+    report("next_stage uncached (per message)", timeit(uncached, 20000) / len(MESSAGES), "us")
+    report("next_stage cached (per message)", timeit(cached, 20000) / len(MESSAGES), "us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Measure cold-start cost: import time of the entry points and the warm-up phase.
+
+Each sample is a fresh interpreter, so nothing is cached in-process. Runs in
+a temporary directory because the app creates logs/, knowledge/ and rules/
+under its working directory.
+
+Usage: python benchmarks/bench_startup.py [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from _common import APP_DIR, report
+
+IMPORT_SNIPPET = (
+    "import time; started = time.perf_counter(); import {module}; "
+    "print(time.perf_counter() - started)"
+)
+WARM_UP_SNIPPET = (
+    "import time, asgi, preload; started = time.perf_counter(); preload.warm_up(); "
+    "print(time.perf_counter() - started)"
+)
+
+
+def run_snippet(snippet: str, workdir: str, *flags: str) -> subprocess.CompletedProcess:
+    env = dict(os.environ, PYTHONPATH=APP_DIR)
+    return subprocess.run([sys.executable, *flags, "-c", snippet], cwd=workdir, env=env,
+                          capture_output=True, text=True, check=True)
+
+
+def median_seconds(snippet: str, workdir: str, runs: int) -> float:
+    return statistics.median(float(run_snippet(snippet, workdir).stdout.split()[-1]) for _ in range(runs))
+
+
+def slowest_app_imports(workdir: str, top: int = 8):
+    """App modules with the highest self import time (from -X importtime)"""
+    app_modules = {name[:-3] for name in os.listdir(APP_DIR) if name.endswith(".py")}
+    stderr = run_snippet("import asgi", workdir, "-X", "importtime").stderr
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, _, module = line[len("import time:"):].split("|")
+        if self_us.strip().isdigit() and module.strip() in app_modules:
+            timings.append((int(self_us), module.strip()))
+    return sorted(timings, reverse=True)[:top]
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    with tempfile.TemporaryDirectory() as workdir:
+        print(f"median of {runs} fresh interpreters")
+        report("import asgi (FastAPI entry point)", median_seconds(IMPORT_SNIPPET.format(module="asgi"), workdir, runs) * 1000, "ms")
+        report("import main (Flask entry point)", median_seconds(IMPORT_SNIPPET.format(module="main"), workdir, runs) * 1000, "ms")
+        report("preload.warm_up()", median_seconds(WARM_UP_SNIPPET, workdir, runs) * 1000, "ms")
+        print("slowest app modules (self import time):")
+        for self_us, module in slowest_app_imports(workdir):
+            report(f"  {module}", self_us / 1000, "ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+import os
+import sys
+import tempfile
+
+# The app modules import each other as top-level modules (``from config import ...``)
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+os.environ.setdefault("GROK_API_KEY", "test-grok-key")
+os.environ.setdefault("GEMINI_API_KEY", "test-gemini-key")
+
+# Log sinks, traces and token rollups are opened at import and flushed at exit;
+# keep them out of the working tree
+RUNTIME_DIR = tempfile.mkdtemp(prefix="chatbot-tests-")
+os.environ.setdefault("LOGS_DIR", os.path.join(RUNTIME_DIR, "logs"))
+os.environ.setdefault("TOKEN_ROLLUP_DIR", os.path.join(RUNTIME_DIR, "logs", "token_usage"))
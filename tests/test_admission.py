@@ -0,0 +1,120 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, Overloaded
+from metrics_export import MetricsExporter, render_prometheus
+from operational_safety import ObservabilityMetrics
+
+
+def _wait_until_queued(controller, count):
+    deadline = time.monotonic() + 1
+    while sum(controller.export_state()["queued"].values()) < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_full_queue_sheds_new_requests_with_retry_after():
+    controller = AdmissionController(max_in_flight=1, max_queue=0)
+    controller.acquire("new")
+
+    with pytest.raises(Overloaded) as shed:
+        controller.acquire("new")
+    assert shed.value.reason == "queue_full"
+    assert 1 <= shed.value.retry_after <= 30
+
+    controller.release()
+    controller.acquire("new")
+    state = controller.export_state()
+    assert state["in_flight"] == 1
+    assert state["admitted"] == {"new": 2}
+    assert state["shed"] == [{"priority": "new", "reason": "queue_full", "count": 1}]
+
+
+def test_waiters_are_admitted_by_priority_then_arrival():
+    controller = AdmissionController(max_in_flight=1, max_queue=10)
+    controller.acquire("new")
+    order = []
+
+    def wait(priority):
+        with controller.slot(priority):
+            order.append(priority)
+
+    threads = []
+    for index, priority in enumerate(["new", "active", "emergency"]):
+        threads.append(threading.Thread(target=wait, args=(priority,)))
+        threads[-1].start()
+        _wait_until_queued(controller, index + 1)
+
+    controller.release()
+    for thread in threads:
+        thread.join(1)
+    assert order == ["emergency", "active", "new"]
+    assert controller.export_state()["in_flight"] == 0
+
+
+def test_higher_priority_evicts_a_queued_new_session():
+    controller = AdmissionController(max_in_flight=1, max_queue=1)
+    controller.acquire("active")
+    errors = []
+
+    def wait():
+        try:
+            controller.acquire("new")
+        except Overloaded as e:
+            errors.append(e.reason)
+
+    thread = threading.Thread(target=wait)
+    thread.start()
+    _wait_until_queued(controller, 1)
+
+    # Equal priority does not evict; the arrival is shed instead
+    with pytest.raises(Overloaded):
+        controller.acquire("new")
+
+    admitted = threading.Thread(target=controller.acquire, args=("emergency",))
+    admitted.start()
+    thread.join(1)
+    assert errors == ["evicted"]
+    assert controller.export_state()["queued"] == {"emergency": 1, "active": 0, "new": 0}
+
+    controller.release()
+    admitted.join(1)
+    assert controller.export_state()["admitted"] == {"active": 1, "emergency": 1}
+
+
+def test_async_waiters_time_out_and_hand_over_slots():
+    controller = AdmissionController(max_in_flight=1, max_queue=5, max_wait=0.05)
+
+    async def scenario():
+        async with controller.slot_async("active"):
+            with pytest.raises(Overloaded) as shed:
+                await controller.acquire_async("new")
+            assert shed.value.reason == "queue_timeout"
+
+            waiter = asyncio.create_task(controller.acquire_async("new"))
+            await asyncio.sleep(0)
+        await asyncio.wait_for(waiter, 1)
+        controller.release()
+
+    asyncio.run(scenario())
+    state = controller.export_state()
+    assert state["in_flight"] == 0
+    assert sum(state["queued"].values()) == 0
+    assert {"priority": "new", "reason": "queue_timeout", "count": 1} in state["shed"]
+
+
+def test_admission_state_is_rendered_as_prometheus_metrics():
+    controller = AdmissionController(max_in_flight=1, max_queue=0)
+    controller.acquire("emergency")
+    with pytest.raises(Overloaded):
+        controller.acquire("new")
+
+    snapshot = MetricsExporter(ObservabilityMetrics(), admission=controller.export_state).snapshot()
+    text = render_prometheus([snapshot, snapshot])
+    assert "chatbot_admission_in_flight 2" in text
+    assert 'chatbot_admission_queue_depth{priority="new"} 0' in text
+    assert 'chatbot_admission_admitted_total{priority="emergency"} 2' in text
+    assert 'chatbot_admission_shed_total{priority="new",reason="queue_full"} 2' in text
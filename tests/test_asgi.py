@@ -0,0 +1,93 @@
+import asyncio
+import threading
+
+from fastapi.testclient import TestClient
+
+import asgi
+import chat_api
+
+
+def test_health_and_widget_are_served():
+    client = TestClient(asgi.app)
+
+    assert client.get("/health").json()["status"] == "healthy"
+    widget = client.get("/widget/widget.js")
+    assert widget.status_code == 200
+    assert "ChatbotConfig" in widget.text
+
+
+def test_chat_goes_through_the_async_router(monkeypatch):
+    async def fake_chat(messages, profile=None):
+        assert messages[-1] == {"role": "user", "content": "How do I reset my password?"}
+        return "Use the reset link.", None
+
+    monkeypatch.setattr(chat_api.grok_client, "chat", fake_chat)
+    client = TestClient(asgi.app)
+
+    reply = client.post("/chat", json={"message": "How do I reset my password?", "session_id": "asgi-test"})
+    assert reply.status_code == 200
+    assert reply.json()["response"] == "Use the reset link."
+    assert reply.json()["session_id"] == "asgi-test"
+
+
+def test_shared_store_calls_run_off_the_event_loop(monkeypatch):
+    loop_threads = []
+
+    async def fake_chat(messages, profile=None):
+        loop_threads.append(threading.current_thread())
+        return "Hello.", {"prompt_tokens": 5, "completion_tokens": 2}
+
+    class RecordingStore:
+        threads = []
+
+        def update(self, ip, amounts, now):
+            self.threads.append(threading.current_thread())
+            return {"chat": 1, "requests": 1, "errors": 0}
+
+        def incr_many(self, increments):
+            self.threads.append(threading.current_thread())
+            return [amount for _, amount, _ in increments]
+
+    monkeypatch.setattr(chat_api.grok_client, "chat", fake_chat)
+    monkeypatch.setattr(chat_api.abuse_detector, "shared", RecordingStore())
+    monkeypatch.setattr(chat_api.token_accountant, "shared_backend", RecordingStore())
+
+    client = TestClient(asgi.app)
+    assert client.post("/chat", json={"message": "Hi there, how are you?"}).status_code == 200
+    assert len(RecordingStore.threads) == 2
+    assert loop_threads and not set(RecordingStore.threads) & set(loop_threads)
+
+
+def test_ready_only_after_warm_up(monkeypatch):
+    async def fake_open_pool(connections=1):
+        return connections
+
+    monkeypatch.setattr(chat_api.grok_client, "open_pool", fake_open_pool)
+    monkeypatch.setitem(asgi.readiness, "ready", False)
+    client = TestClient(asgi.app)
+
+    assert client.get("/ready").status_code == 503
+    assert client.get("/health").status_code == 200
+
+    asyncio.run(asgi.warm_up())
+    ready = client.get("/ready")
+    assert ready.status_code == 200
+    assert ready.json()["warm_up"]["upstream_connections"] == asgi.config.warm_upstream_connections
+
+
+def test_failed_warm_up_still_becomes_ready_degraded(monkeypatch):
+    def broken_warm_up():
+        raise ValueError("bad knowledge JSON")
+
+    async def fake_open_pool(connections=1):
+        return connections
+
+    monkeypatch.setattr(asgi.preload, "warm_up", broken_warm_up)
+    monkeypatch.setattr(chat_api.grok_client, "open_pool", fake_open_pool)
+    monkeypatch.setitem(asgi.readiness, "ready", False)
+    monkeypatch.setitem(asgi.readiness, "warm_up", None)
+
+    asyncio.run(asgi.warm_up())
+    ready = TestClient(asgi.app).get("/ready")
+    assert ready.status_code == 200
+    assert ready.json()["warm_up"]["degraded"] is True
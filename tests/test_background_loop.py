@@ -0,0 +1,55 @@
+import asyncio
+import threading
+
+import pytest
+
+from background_loop import BackgroundLoop
+
+
+def test_coroutines_share_one_long_lived_loop():
+    background = BackgroundLoop()
+
+    async def current_loop():
+        return asyncio.get_running_loop(), threading.current_thread().name
+
+    first = background.run(current_loop())
+    second = background.run(current_loop())
+    assert first == second
+    assert first[1] == "background-loop"
+    background.stop()
+
+
+def test_timeout_cancels_the_coroutine():
+    background = BackgroundLoop()
+    cancelled = threading.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises(TimeoutError) as timed_out:
+        background.run(slow(), timeout=0.05)
+    # The builtin class, which callers catch, on every supported Python
+    assert timed_out.type is TimeoutError
+    assert cancelled.wait(1)
+    background.stop()
+
+
+def test_errors_propagate_and_the_loop_restarts_after_stop():
+    background = BackgroundLoop()
+
+    async def fail():
+        raise ValueError("upstream")
+
+    with pytest.raises(ValueError):
+        background.run(fail())
+    background.stop()
+
+    async def answer():
+        return 42
+
+    assert background.run(answer()) == 42
+    background.stop()
@@ -0,0 +1,35 @@
+from conversation_turns import SessionHistory
+
+
+def make_history(turns, compress_cold):
+    history = SessionHistory(hot_turns=2, cold_chunk=2, compress_cold=compress_cold)
+    for i in range(turns):
+        history.add_turn(f"user {i}", f"bot {i}")
+    return history
+
+
+def test_compressed_history_matches_plain():
+    plain = make_history(9, compress_cold=False)
+    compressed = make_history(9, compress_cold=True)
+
+    assert len(compressed) == 9
+    assert [t.as_tuple()[:2] for t in compressed] == [t.as_tuple()[:2] for t in plain]
+    assert compressed.render() == plain.render()
+
+
+def test_trim_drops_oldest_turns_across_cold_blobs():
+    history = make_history(9, compress_cold=True)
+    history.trim(5)
+
+    assert len(history) == 5
+    assert [t.user for t in history] == [f"user {i}" for i in range(4, 9)]
+    assert [t.user for t in history.recent(2)] == ["user 7", "user 8"]
+
+
+def test_pending_turn_renders_without_response():
+    history = SessionHistory()
+    history.add_turn("hello")
+    assert history.render() == "User: hello"
+
+    history.set_response("Hi there")
+    assert history.render() == "User: hello\nAssistant: Hi there"
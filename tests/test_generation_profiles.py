@@ -0,0 +1,66 @@
+import asyncio
+
+import chat_api
+import main
+from config import AppConfig, GenerationProfile
+
+
+def test_stage_lookup_falls_back_to_default():
+    config = AppConfig()
+    assert config.generation_profile("conclusion").fallback_model == "llama-3.1-8b-instant"
+    assert config.generation_profile("no_such_stage") == config.generation_profiles["default"]
+    assert config.generation_profile() == config.generation_profiles["default"]
+
+    bare = AppConfig(generation_profiles={}, grok_model="some-model")
+    assert bare.generation_profile("greeting") == GenerationProfile(model="some-model")
+
+
+def test_chat_api_retry_switches_to_the_fallback_model(monkeypatch):
+    monkeypatch.setattr(chat_api.config, "retry_delay", 0)
+    models = []
+
+    class FlakyClient:
+        async def chat(self, messages, profile=None):
+            models.append(profile.model)
+            if len(models) == 1:
+                raise RuntimeError("primary model overloaded")
+            return "From the fallback.", None
+
+    profile = GenerationProfile(model="big-model", fallback_model="small-model")
+    response, _ = asyncio.run(chat_api._get_response_with_retry(FlakyClient(), [], "session", profile))
+    assert response == "From the fallback."
+    assert models == ["big-model", "small-model"]
+
+
+class _Reply:
+    def __init__(self, status_code, content=None):
+        self.status_code = status_code
+        self.text = content or ""
+        self._json = {"choices": [{"message": {"content": content}}]} if content else {}
+
+    def json(self):
+        return self._json
+
+
+def test_main_reposts_with_the_fallback_model_on_failure(monkeypatch):
+    models = []
+
+    def fake_post(client, headers, payload, stage):
+        models.append(payload["model"])
+        return _Reply(503) if len(models) == 1 else _Reply(200, "Fallback conclusion.")
+
+    monkeypatch.setattr(main, "_post_completion", fake_post)
+    profile = main.config.generation_profile("conclusion")
+    response = main.call_groq_api("What should I do?", [], "follow_up_questions", "conclusion")
+    assert response == "Fallback conclusion."
+    assert models == [profile.model, profile.fallback_model]
+
+    # An authentication failure is not retried on another model
+    def unauthorized(client, headers, payload, stage):
+        models.append(payload["model"])
+        return _Reply(401)
+
+    models.clear()
+    monkeypatch.setattr(main, "_post_completion", unauthorized)
+    assert "authentication" in main.call_groq_api("What should I do?", [], "follow_up_questions", "conclusion")
+    assert models == [profile.model]
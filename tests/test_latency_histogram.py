@@ -0,0 +1,53 @@
+import random
+
+import pytest
+
+from latency_histogram import LatencyHistogram
+from operational_safety import ObservabilityMetrics
+
+
+def test_percentiles_within_precision():
+    rng = random.Random(7)
+    samples = [rng.lognormvariate(-3, 1.2) for _ in range(20000)]
+    histogram = LatencyHistogram()
+    for sample in samples:
+        histogram.record(sample)
+
+    samples.sort()
+    for name, percent in LatencyHistogram.PERCENTILES:
+        exact = samples[int(len(samples) * percent / 100) - 1]
+        assert histogram.percentile(percent) == pytest.approx(exact, rel=0.03), name
+    assert histogram.snapshot()["max"] == samples[-1]
+
+
+def test_merge_and_clamp():
+    first, second = LatencyHistogram(max_seconds=1.0), LatencyHistogram(max_seconds=1.0)
+    first.record(0.010)
+    second.record(5.0)
+
+    first.merge(second)
+    assert first.count == 2
+    assert first.percentile(100) == pytest.approx(1.0, rel=0.02)
+    with pytest.raises(ValueError):
+        first.merge(LatencyHistogram(max_seconds=10.0))
+
+
+def test_metrics_report_phases_and_rate():
+    metrics = ObservabilityMetrics()
+    timer = metrics.start_timer()
+    timer.lap("sanitize")
+    timer.lap("upstream")
+    metrics.record_request(timer.elapsed())
+
+    report = metrics.get_metrics()
+    assert set(report["phases"]) == {"sanitize", "upstream"}
+    assert report["requests_per_minute"] == 1
+    assert report["response_time"]["count"] == 1
+
+
+def test_bucket_counts_never_include_samples_above_the_bound():
+    histogram = LatencyHistogram()
+    # 10.1 ms shares a bucket (9.984-10.239 ms) with the 10 ms bound
+    for seconds in (0.0099, 0.0101, 0.2):
+        histogram.record(seconds)
+    assert histogram.count_at_or_below([0.005, 0.01, 0.025, 1.0]) == [0, 1, 2, 3]
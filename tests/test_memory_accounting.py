@@ -0,0 +1,41 @@
+import sys
+
+from conversation_turns import SessionHistory
+from memory_accounting import MemoryAccountant, approx_deep_size
+
+
+def test_deep_size_follows_slots_and_containers():
+    history = SessionHistory()
+    for index in range(3):
+        history.add_turn("x" * 1000 + str(index), "y" * 1000)
+
+    # Three distinct user texts plus one shared (constant-folded) reply
+    size = approx_deep_size({"session": history})
+    assert size > 4 * 1000
+    assert approx_deep_size("abc") == sys.getsizeof("abc")
+
+
+def test_large_containers_are_sampled():
+    data = {str(index): "v" * 100 for index in range(10000)}
+    exact = approx_deep_size(data, sample=len(data))
+    sampled = approx_deep_size(data, sample=50)
+    assert abs(sampled - exact) / exact < 0.05
+
+
+def test_accountant_reports_and_diffs_allocations():
+    store = {}
+    accountant = MemoryAccountant()
+    accountant.register("store", lambda: store)
+    accountant.start_tracemalloc()
+    try:
+        store.update({index: bytearray(1024) for index in range(200)})
+        report = accountant.report()
+        diff = accountant.tracemalloc_diff(top=5)
+    finally:
+        accountant.stop_tracemalloc()
+
+    assert report["store"]["entries"] == 200
+    assert report["store"]["approx_bytes"] > 200 * 1024
+    assert accountant.last_report is report
+    assert any("test_memory_accounting.py" in row["location"] and row["size_diff_bytes"] > 200 * 1024
+               for row in diff)
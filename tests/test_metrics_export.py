@@ -0,0 +1,66 @@
+import json
+import os
+
+from metrics_export import MetricsExporter, WorkerMetricsFile, render_prometheus
+from operational_safety import ObservabilityMetrics
+
+
+def _worker_snapshot(latencies, failures=0):
+    metrics = ObservabilityMetrics()
+    for latency in latencies:
+        timer = metrics.start_timer()
+        timer.lap("upstream")
+        metrics.record_request(latency)
+    for _ in range(failures):
+        metrics.record_api_failure("grok_api")
+    exporter = MetricsExporter(metrics, gauges=lambda: {"active_sessions": 2},
+                               caches=lambda: {"token_counts": (3, 1)})
+    return exporter.snapshot()
+
+
+def test_worker_files_round_trip(tmp_path):
+    # Two live processes: this one and its parent
+    for pid, latencies in ((os.getpid(), [0.2]), (os.getppid(), [0.3, 4.0])):
+        WorkerMetricsFile(str(tmp_path), pid=pid).write(json.dumps(_worker_snapshot(latencies)).encode())
+    stale = WorkerMetricsFile(str(tmp_path), pid=2 ** 22 + 12345)
+    stale.write(json.dumps(_worker_snapshot([0.1, 0.1, 0.1], failures=1)).encode())
+
+    snapshots = WorkerMetricsFile.read_all(str(tmp_path))
+    assert sorted(s["requests"] for s in snapshots) == [1, 2]
+    assert not stale.path.exists()
+    # The exited worker's counters are kept, not its gauges
+    retired = WorkerMetricsFile.read_retired(str(tmp_path))
+    assert retired["requests"] == 3
+    assert retired["api_failures"] == {"grok_api": 1}
+    assert retired["gauges"] == {}
+
+
+def test_totals_do_not_go_backwards_when_a_worker_exits(tmp_path):
+    # This process scrapes; its parent stays up and another worker has exited
+    WorkerMetricsFile(str(tmp_path), pid=os.getppid()).write(json.dumps(_worker_snapshot([0.2])).encode())
+    exited = WorkerMetricsFile(str(tmp_path), pid=2 ** 22 + 12346)
+    exited.write(json.dumps(_worker_snapshot([0.3, 4.0], failures=2)).encode())
+    exporter = MetricsExporter(ObservabilityMetrics(), directory=str(tmp_path))
+
+    for _ in range(2):
+        text = exporter.render()
+        assert "chatbot_workers 2" in text
+        assert "chatbot_requests_total 3" in text
+        assert 'chatbot_upstream_failures_total{provider="grok_api"} 2' in text
+        assert 'chatbot_response_seconds_bucket{le="+Inf"} 3' in text
+        assert 'chatbot_cache_hits_total{cache="token_counts"} 6' in text
+        assert "chatbot_active_sessions 2" in text
+    assert not exited.path.exists()
+
+
+def test_render_merges_workers():
+    text = render_prometheus([_worker_snapshot([0.2], failures=1), _worker_snapshot([0.3, 4.0], failures=2)])
+
+    assert "chatbot_workers 2" in text
+    assert "chatbot_requests_total 3" in text
+    assert 'chatbot_upstream_failures_total{provider="grok_api"} 3' in text
+    assert 'chatbot_response_seconds_bucket{le="0.25"} 1' in text
+    assert 'chatbot_response_seconds_bucket{le="+Inf"} 3' in text
+    assert 'chatbot_phase_seconds_count{phase="upstream"} 3' in text
+    assert 'chatbot_cache_hits_total{cache="token_counts"} 6' in text
+    assert "chatbot_active_sessions 4" in text
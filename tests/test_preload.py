@@ -0,0 +1,40 @@
+import json
+import os
+
+import preload
+from log_sinks import JsonLinesFormatter, RotatingJsonlHandler
+from logger import logger
+from prompt_assembly import knowledge_fragments
+
+
+def test_warm_up_builds_shared_caches():
+    summary = preload.warm_up()
+
+    assert summary["rules_tokens"] > 0
+    assert knowledge_fragments.generation == summary["knowledge_generation"]
+    assert knowledge_fragments.get_stats()["entries"] >= min(summary["knowledge_entries"], 1)
+
+
+def test_forked_worker_gets_its_own_log_writer(tmp_path, monkeypatch):
+    # Route the chat sink into tmp_path; the worker's new listener reuses these routes
+    handler = RotatingJsonlHandler(tmp_path, "chat")
+    handler.setFormatter(JsonLinesFormatter())
+    monkeypatch.setitem(logger.listener.routes, "chatbot.chat", handler)
+    monkeypatch.setattr(logger, "logs_dir", tmp_path)
+    marker = f"fork-check-{os.getpid()}"
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            preload.after_fork()
+            logger.chat_logger.info({"marker": marker})
+            logger.shutdown()
+            status = 0
+        finally:
+            os._exit(status)
+    _, status = os.waitpid(pid, 0)
+    handler.close()
+    assert status == 0
+
+    with open(logger.logs_dir / "chat.jsonl") as lines:
+        assert any(json.loads(line).get("marker") == marker for line in lines)
@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+from profiling import Profiler
+
+
+def _busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        sum(range(200))
+
+
+def _handle(profiler, seconds=0.05):
+    with profiler.request("/chat", "conclusion"):
+        _busy(seconds)
+
+
+def test_disabled_profiler_is_a_shared_no_op():
+    profiler = Profiler()
+    assert profiler.request("/chat") is profiler.request("/chat")
+    _handle(profiler, 0.001)
+    assert profiler.collapsed() == ""
+
+
+def test_sampling_collects_tagged_stacks_until_request_budget():
+    profiler = Profiler()
+    profiler.start("sample", max_requests=2, max_seconds=10, interval_ms=1)
+    _handle(profiler)
+    _handle(profiler)
+
+    assert not profiler.status()["active"]
+    assert profiler.status()["requests_profiled"] == 2
+    stacks = profiler.collapsed().splitlines()
+    assert stacks
+    assert all(line.startswith("endpoint=/chat;stage=conclusion;") for line in stacks)
+    assert any("test_profiling.py:_busy" in line for line in stacks)
+
+
+def test_cprofile_mode_outputs_weighted_call_edges():
+    profiler = Profiler()
+    profiler.start("cprofile", max_requests=1, max_seconds=None)
+    _handle(profiler)
+    _handle(profiler)
+
+    assert profiler.status()["requests_profiled"] == 1
+    lines = profiler.collapsed().splitlines()
+    assert any(line.startswith("endpoint=/chat;stage=conclusion;") and ":_busy " in line for line in lines)
+    assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in lines)
+
+
+def test_cprofile_of_async_handlers_is_tagged_loop_wide():
+    profiler = Profiler()
+    profiler.start("cprofile", max_requests=1, max_seconds=None)
+
+    async def handle():
+        with profiler.request("/chat", "conclusion"):
+            await asyncio.sleep(0)
+            _busy(0.01)
+
+    asyncio.run(handle())
+    lines = profiler.collapsed().splitlines()
+    assert lines
+    assert all(line.startswith("endpoint=/chat;stage=conclusion;scope=event_loop;") for line in lines)
+
+
+def test_main_chat_profiles_are_tagged_with_the_picked_stage(monkeypatch):
+    import main
+
+    profiler = Profiler()
+    monkeypatch.setattr(main, "profiler", profiler)
+    monkeypatch.setattr(main, "determine_next_stage", lambda *args: "symptom_gathering")
+    monkeypatch.setattr(main, "call_groq_api", lambda *args: _busy(0.02) or "How long has it hurt?")
+    profiler.start("cprofile", max_requests=1, max_seconds=None)
+
+    reply = main.app.test_client().post("/chat", json={"message": "My head hurts", "session_id": "p1"})
+    assert reply.get_json()["stage"] == "symptom_gathering"
+    lines = profiler.collapsed().splitlines()
+    assert any(line.startswith("endpoint=/chat;stage=symptom_gathering;") and ":_busy " in line for line in lines)
+    assert not any("stage=none" in line for line in lines)
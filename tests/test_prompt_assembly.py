@@ -0,0 +1,23 @@
+from prompt_assembly import CompiledTemplate, KnowledgeFragmentCache
+
+
+def test_compiled_template_matches_str_format():
+    source = "Rules:\n{rules}\n\n{{literal}} {message}!"
+    template = CompiledTemplate(source)
+
+    values = {"rules": "be kind {not a slot}", "message": "hi"}
+    assert template.render(**values) == "Rules:\nbe kind {not a slot}\n\n{literal} hi!"
+    assert template.fields == ["rules", "message"]
+
+
+def test_fragment_cache_expires_with_generation():
+    cache = KnowledgeFragmentCache()
+    entry = {"topic": "Fever", "response_guidance": "Rest", "confidence": "0.8", "risk_level": "low"}
+
+    first = cache.get(entry, generation=1)
+    assert cache.get(dict(entry), generation=1) is first
+    assert cache.hits == 1
+
+    cache.get(entry, generation=2)
+    assert cache.misses == 2
+    assert "- Topic: Fever\n- Domain: general\n- Guidance: Rest" in first
@@ -0,0 +1,17 @@
+from conversation_turns import Turn
+from prompt_builder import PromptBuilder
+
+KNOWLEDGE = [{"topic": "Fever", "response_guidance": "Rest and fluids", "confidence": "0.8", "risk_level": "medium"}]
+
+
+def test_messages_keep_static_prefix_and_real_turns():
+    builder = PromptBuilder()
+    first = builder.build_chat_messages("Be kind.", KNOWLEDGE, "I have a fever")
+    second = builder.build_chat_messages("Be kind.", [], "It started yesterday",
+                                         history=[Turn("I have a fever", "How long?")])
+
+    assert first[0] == second[0]
+    assert "Be kind." in first[0]["content"]
+    assert [m["role"] for m in second] == ["system", "system", "user", "assistant", "user"]
+    assert [m["content"] for m in second[2:]] == ["I have a fever", "How long?", "It started yesterday"]
+
@@ -0,0 +1,36 @@
+import json
+import random
+
+from response_templates import ResponseTemplates
+
+
+def write_templates(tmp_path, data):
+    path = tmp_path / "stage_templates.json"
+    path.write_text(json.dumps(data), encoding="utf-8")
+    return path
+
+
+def test_render_fills_placeholders_and_defaults(tmp_path):
+    path = write_templates(tmp_path, {
+        "emergency_conclusion": ["Call now. {reason}"],
+        "_defaults": {"reason": "It is urgent."}
+    })
+    templates = ResponseTemplates(path)
+
+    assert templates.render("emergency_conclusion") == "Call now. It is urgent."
+    assert templates.render("emergency_conclusion", reason="Heart attack risk.") == "Call now. Heart attack risk."
+    assert templates.render("conclusion") is None
+
+
+def test_variants_and_malformed_entries(tmp_path):
+    path = write_templates(tmp_path, {"greeting": ["Hi!", "Hello!", "Broken {", ""], "goodbye": "not a list"})
+    templates = ResponseTemplates(path, rng=random.Random(1))
+
+    assert templates.templates == {"greeting": ["Hi!", "Hello!"]}
+    assert {templates.render("greeting") for _ in range(20)} == {"Hi!", "Hello!"}
+    assert not templates.handles("goodbye")
+
+
+def test_missing_file_disables_templating(tmp_path):
+    templates = ResponseTemplates(tmp_path / "missing.json")
+    assert templates.render("greeting") is None
@@ -0,0 +1,174 @@
+import logging
+import socketserver
+import threading
+
+import pytest
+
+import logger  # noqa: F401  (configures the chatbot.errors level)
+from operational_safety import AbuseDetector
+from shared_state import (BackendUnavailable, CircuitBreakerBackend, RedisCounterBackend, SharedCounterBackend,
+                          SharedWindowCounters, SQLiteCounterBackend, create_counter_backend)
+
+
+class _RespHandler(socketserver.StreamRequestHandler):
+    """Just enough of the Redis protocol for the counter backend"""
+
+    disable_nagle_algorithm = True
+
+    def _read_command(self):
+        header = self.rfile.readline()
+        if not header:
+            return None
+        args = []
+        for _ in range(int(header[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2].decode())
+        return args
+
+    def handle(self):
+        store = self.server.store
+        while True:
+            command = self._read_command()
+            if command is None:
+                return
+            name = command[0].upper()
+            with self.server.lock:
+                self.server.commands.append(name)
+                if name == "INCRBY":
+                    store[command[1]] = store.get(command[1], 0) + int(command[2])
+                    reply = b":%d\r\n" % store[command[1]]
+                elif name == "EXPIRE":
+                    reply = b":1\r\n"
+                elif name == "GET":
+                    value = store.get(command[1])
+                    reply = b"$-1\r\n" if value is None else b"$%d\r\n%d\r\n" % (len(str(value)), value)
+                else:
+                    reply = b"-ERR unknown command\r\n"
+            self.wfile.write(reply)
+
+
+@pytest.fixture
+def resp_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _RespHandler)
+    server.daemon_threads = True
+    server.store = {}
+    server.commands = []
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_sqlite_counters_are_shared_between_connections(tmp_path):
+    path = str(tmp_path / "state.db")
+    first, second = SQLiteCounterBackend(path), SQLiteCounterBackend(path)
+
+    assert first.incr_many([("a", 1, 60), ("b", 0, 60)]) == [1, 0]
+    assert second.incr_many([("a", 2, 60), ("b", 5, 60)]) == [3, 5]
+    assert first.incr_many([("a", 0, 60)]) == [3]
+
+
+def test_sqlite_without_returning_updates_and_reads_back(tmp_path, monkeypatch):
+    # SQLite before 3.35 has no RETURNING clause
+    monkeypatch.setattr(SQLiteCounterBackend, "HAS_RETURNING", False)
+    backend = SQLiteCounterBackend(str(tmp_path / "state.db"))
+
+    assert backend.incr_many([("a", 2, 60), ("b", 0, 60)]) == [2, 0]
+    assert backend.incr_many([("a", 3, 60), ("b", 1, 60)]) == [5, 1]
+
+
+def test_circuit_breaker_fails_fast_then_probes_again(monkeypatch):
+    class FlakyBackend(SharedCounterBackend):
+        calls = 0
+        down = True
+
+        def incr_many(self, increments):
+            self.calls += 1
+            if self.down:
+                raise ConnectionError("store down")
+            return [amount for _, amount, _ in increments]
+
+    clock = [100.0]
+    monkeypatch.setattr("shared_state.time.monotonic", lambda: clock[0])
+    flaky = FlakyBackend()
+    breaker = CircuitBreakerBackend(flaky, min_backoff=1.0, max_backoff=4.0)
+
+    with pytest.raises(ConnectionError):
+        breaker.incr_many([("a", 1, 60)])
+    with pytest.raises(BackendUnavailable):
+        breaker.incr_many([("a", 1, 60)])
+    assert flaky.calls == 1
+
+    # The probe after the backoff fails again: the backoff doubles
+    clock[0] += 1.0
+    with pytest.raises(ConnectionError):
+        breaker.incr_many([("a", 1, 60)])
+    clock[0] += 1.5
+    with pytest.raises(BackendUnavailable):
+        breaker.incr_many([("a", 1, 60)])
+
+    clock[0] += 0.5
+    flaky.down = False
+    assert breaker.incr_many([("a", 1, 60)]) == [1]
+    assert breaker.incr_many([("a", 2, 60)]) == [2]
+    assert flaky.calls == 4
+
+
+def test_redis_backend_pipelines_batches(resp_server):
+    host, port = resp_server.server_address
+    backend = create_counter_backend(f"redis://{host}:{port}")
+    assert isinstance(backend.backend, RedisCounterBackend)
+
+    assert backend.incr_many([("a", 1, 60), ("b", 0, 60)]) == [1, 0]
+    assert backend.incr_many([("a", 4, 60), ("a", 0, 60)]) == [5, 5]
+    # Reads are plain GETs: they neither create keys nor extend their TTL
+    assert resp_server.commands == ["INCRBY", "EXPIRE", "GET", "INCRBY", "EXPIRE", "GET"]
+    assert "b" not in resp_server.store
+    backend.close()
+
+
+def test_window_estimate_weights_previous_window(tmp_path):
+    counters = SharedWindowCounters(SQLiteCounterBackend(str(tmp_path / "state.db")), {"chat": 60})
+    for _ in range(10):
+        counters.update("1.2.3.4", {"chat": 1}, now=59.0)
+
+    # A quarter into the next window, three quarters of the old count still apply
+    assert counters.update("1.2.3.4", {"chat": 1}, now=75.0)["chat"] == pytest.approx(1 + 10 * 0.75)
+    assert counters.update("1.2.3.4", {"chat": 0}, now=200.0)["chat"] == 0
+
+
+def test_abuse_detector_limits_across_workers(resp_server):
+    host, port = resp_server.server_address
+    windows = {"chat": 60, "requests": 3600, "errors": 3600}
+    workers = [AbuseDetector(SharedWindowCounters(RedisCounterBackend(host, port), windows)) for _ in range(2)]
+
+    for _ in range(60):
+        for worker in workers:
+            worker.log_error("5.6.7.8")
+    assert all(worker.is_ip_blocked("5.6.7.8") for worker in workers)
+
+    verdicts = [workers[i % 2].check_ip("9.9.9.9") for i in range(70)]
+    assert not verdicts[0].rate_limited
+    assert verdicts[-1].rate_limited
+
+
+def test_abuse_detector_falls_back_when_store_is_down():
+    backend = RedisCounterBackend("127.0.0.1", 1, timeout=0.1)
+    detector = AbuseDetector(SharedWindowCounters(backend, {"chat": 60, "requests": 3600, "errors": 3600}))
+    errors = logging.getLogger("chatbot.errors")
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    errors.addHandler(handler)
+    try:
+        verdict = detector.check_ip("1.1.1.1")
+    finally:
+        errors.removeHandler(handler)
+
+    # The outage is reported through the errors sink, not filtered out by its level
+    assert [record.levelno for record in records] == [logging.ERROR]
+    assert verdict == (False, False, False)
+    assert detector.shared_failures == 1
+    assert len(detector.ip_requests) == 1
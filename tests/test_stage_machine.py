@@ -0,0 +1,51 @@
+import json
+import os
+
+import pytest
+
+from stage_machine import StageClassifier
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "data", "stage_transitions.json")
+
+
+def load_corpus():
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        cases = json.load(f)["cases"]
+
+    for message, stages in cases.items():
+        for stage, by_lines in stages.items():
+            for lines_key, expected in by_lines.items():
+                context = "\n".join(["line"] * int(lines_key.split("=")[1]))
+                for count, expected_stage in enumerate(expected, 1):
+                    yield stage, message, context, count, expected_stage
+
+
+CORPUS = list(load_corpus())
+
+
+def test_corpus_matches_recorded_transitions():
+    classifier = StageClassifier()
+    mismatches = [
+        (stage, message, context.count("\n") + 1, count, expected, classifier.next_stage(stage, message, context, count))
+        for stage, message, context, count, expected in CORPUS
+        if classifier.next_stage(stage, message, context, count) != expected
+    ]
+    assert not mismatches, mismatches[:10]
+
+
+def test_message_counts_above_threshold_share_cache_entries():
+    classifier = StageClassifier()
+    classifier.next_stage("symptom_gathering", "my head hurts", "User: a", 7)
+    classifier.next_stage("symptom_gathering", "my head hurts", "User: a", 12)
+
+    info = classifier.cache_info()
+    assert info.hits == 1 and info.misses == 1
+
+
+@pytest.mark.parametrize("message,expected", [
+    ("I don't understand", {"confusion", "do_or_should"}),
+    ("what should i do", {"treatment", "confusion", "what", "do_or_should", "conclusion_request"}),
+])
+def test_overlapping_keywords_all_raise_signals(message, expected):
+    signals = StageClassifier().signals(message, len(message.split()))
+    assert expected <= signals
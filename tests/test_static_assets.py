@@ -0,0 +1,54 @@
+import gzip
+
+from static_assets import IMMUTABLE_CACHE, REVALIDATE_CACHE, AssetBundle, minify_css, minify_js
+
+
+def make_bundle(tmp_path):
+    (tmp_path / "widget.css").write_text("/* theme */\n.chat-button {\n    color: white;\n    margin: 0 auto;\n}\n" * 20)
+    (tmp_path / "widget.js").write_text(
+        "(function() {\n    // load styles\n"
+        "    link.href = `${base}/widget/widget.css?v=${version}`;\n})();\n" * 20
+    )
+    return AssetBundle(str(tmp_path))
+
+
+def test_minifiers_keep_meaning():
+    assert minify_css(".a {\n  color: red;\n  margin: 0 auto;\n}\n/* x */\n.b > .c { top: 0 }") == \
+        ".a{color:red;margin:0 auto}.b > .c{top:0}"
+    assert minify_js("  // note\n  var a = 1\n\n  var b = 'http://x'\n") == "var a = 1\nvar b = 'http://x'"
+
+
+def test_references_use_hashed_urls(tmp_path):
+    bundle = make_bundle(tmp_path)
+    script = bundle.assets["widget.js"].bodies["identity"].decode()
+
+    assert bundle.url("widget.css") in script
+    assert "?v=" not in script
+    assert bundle.assets["widget.css"].hashed_name.startswith("widget.") and bundle.url("widget.css").endswith(".css")
+
+
+def test_negotiates_encoding_and_revalidates(tmp_path):
+    bundle = make_bundle(tmp_path)
+
+    status, headers, body = bundle.respond("widget.css", accept_encoding="gzip, deflate;q=0.5")
+    assert status == 200
+    assert headers["Content-Encoding"] == "gzip"
+    assert headers["Cache-Control"] == REVALIDATE_CACHE
+    assert gzip.decompress(body) == bundle.assets["widget.css"].bodies["identity"]
+
+    status, _, body = bundle.respond("widget.css", if_none_match=headers["ETag"])
+    assert (status, body) == (304, b"")
+
+    status, headers, body = bundle.respond("widget.css", accept_encoding="gzip;q=0")
+    assert "Content-Encoding" not in headers
+    assert body == bundle.assets["widget.css"].bodies["identity"]
+
+
+def test_hashed_names_are_immutable_and_stale_hashes_expire(tmp_path):
+    bundle = make_bundle(tmp_path)
+    hashed = bundle.assets["widget.js"].hashed_name
+
+    assert bundle.respond(hashed)[1]["Cache-Control"] == IMMUTABLE_CACHE
+    status, headers, _ = bundle.respond("widget.0123456789.js")
+    assert status == 200 and headers["Cache-Control"] == REVALIDATE_CACHE
+    assert bundle.respond("missing.js")[0] == 404
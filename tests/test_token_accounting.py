@@ -0,0 +1,74 @@
+import json
+from datetime import datetime, timezone
+
+from shared_state import SQLiteCounterBackend
+from token_accounting import TokenAccountant, merge_rollups
+
+DAY_ONE = datetime(2026, 3, 1, 10, 30, tzinfo=timezone.utc).timestamp()
+DAY_TWO = datetime(2026, 3, 2, 8, 0, tzinfo=timezone.utc).timestamp()
+
+
+def test_usage_is_aggregated_by_stage_provider_and_hour():
+    accountant = TokenAccountant()
+    usage = {"prompt_tokens": 300, "completion_tokens": 50}
+    accountant.record("conclusion", "grok", usage, "s1", saved={"prompt_budget": 120}, now=DAY_ONE)
+    accountant.record("conclusion", "grok", usage, "s1", now=DAY_ONE + 60)
+    accountant.record_saved("response_template", 400)
+
+    state = accountant.export_state()
+    assert state["usage"] == [{"stage": "conclusion", "provider": "grok", "prompt": 600, "completion": 100, "turns": 2}]
+    assert state["saved"] == {"prompt_budget": 120, "response_template": 400}
+
+    rollup = accountant.rollup()
+    assert rollup["by_hour"] == {"10": {"prompt": 600, "completion": 100, "turns": 2}}
+    assert rollup["tokens_per_turn"] == 350
+
+
+def test_budgets_shed_sessions_and_days():
+    accountant = TokenAccountant(session_budget=500, daily_budget=1000)
+    accountant.record("default", "grok", {"prompt_tokens": 400, "completion_tokens": 200}, "s1")
+    assert accountant.check_budget("s1") == "session"
+    assert accountant.check_budget("s2") is None
+
+    accountant.record("default", "grok", {"prompt_tokens": 400, "completion_tokens": 0}, "s2")
+    assert accountant.check_budget("s3") == "daily"
+    assert accountant.export_state()["shed"] == {"session": 1, "daily": 1}
+
+
+def test_day_rollover_writes_rollup_and_merge(tmp_path):
+    accountant = TokenAccountant(rollup_dir=str(tmp_path))
+    accountant.record("greeting", "grok", {"prompt_tokens": 100, "completion_tokens": 20}, now=DAY_ONE)
+    accountant.record("greeting", "grok", {"prompt_tokens": 10, "completion_tokens": 2}, now=DAY_TWO)
+
+    files = sorted(path.name for path in tmp_path.iterdir())
+    assert len(files) == 1 and files[0].startswith("tokens-2026-03-01-")
+    assert json.loads((tmp_path / files[0]).read_text())["total_tokens"] == 120
+
+    accountant.flush()
+    merged = merge_rollups(str(tmp_path), "2026-03-02")
+    assert merged["total_tokens"] == 12
+    assert merged["by_stage"] == {"greeting/grok": {"prompt": 10, "completion": 2, "turns": 1}}
+
+
+def test_shared_budget_does_not_inflate_worker_rollups(tmp_path):
+    backend = SQLiteCounterBackend(str(tmp_path / "state.db"))
+    workers = [TokenAccountant(daily_budget=1000, rollup_dir=str(tmp_path / f"w{index}"), shared_backend=backend)
+               for index in range(2)]
+    workers[0].record("greeting", "grok", {"prompt_tokens": 300, "completion_tokens": 0}, now=DAY_ONE)
+    workers[1].record("greeting", "grok", {"prompt_tokens": 400, "completion_tokens": 0}, now=DAY_ONE)
+    workers[0].record("greeting", "grok", {"prompt_tokens": 300, "completion_tokens": 0}, now=DAY_ONE)
+
+    # The budget sees all workers; each rollup only its own tokens
+    assert workers[0].shared_day_total == 1000
+    assert workers[0].rollup()["total_tokens"] == 600
+    assert workers[0].rollup()["tokens_per_turn"] == 300
+
+    merged_dir = tmp_path / "merged"
+    merged_dir.mkdir()
+    for index, worker in enumerate(workers):
+        worker.flush()
+        rollup = next((tmp_path / f"w{index}").iterdir())
+        rollup.rename(merged_dir / f"tokens-2026-03-01-{index}.json")
+    merged = merge_rollups(str(merged_dir), "2026-03-01")
+    assert merged["total_tokens"] == 1000
+    assert merged["tokens_per_turn"] == 1000 / 3
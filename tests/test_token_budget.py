@@ -0,0 +1,29 @@
+from conversation_turns import Turn
+from token_budget import TokenBudgetAllocator, count_tokens, split_rules
+
+RULES = "# Bot\nIntro line.\n\n## Core\n" + "be kind " * 20 + "\n\n## Extra\n" + "details " * 200
+
+
+def test_rules_are_packed_by_whole_sections():
+    allocator = TokenBudgetAllocator({"default": 1000}, rules_budget=count_tokens(RULES) - 1)
+    budget = allocator.allocate(RULES, [], [], "hi")
+
+    assert budget.rules == "\n\n".join(split_rules(RULES)[:2])
+    assert budget.dropped["rules_sections"] == 1
+
+
+def test_knowledge_by_relevance_and_history_by_recency():
+    allocator = TokenBudgetAllocator({"default": 1000, "short": 150}, rules_budget=100, knowledge_share=0.5)
+    knowledge = [{"response_guidance": "rest " * 10}, {"response_guidance": "long " * 200},
+                 {"response_guidance": "fluids " * 10}]
+    history = [Turn(f"question {i} " * 5, f"answer {i} " * 5) for i in range(10)]
+
+    budget = allocator.allocate("Be kind.", knowledge, history, "hello", stage="short")
+
+    assert budget.knowledge == [knowledge[0], knowledge[2]]
+    assert budget.history == history[-len(budget.history):]
+    assert 0 < len(budget.history) < len(history)
+    assert sum(v for k, v in budget.tokens.items() if k != "budget") <= 150
+    assert budget.dropped["tokens"] == count_tokens("long " * 200) + sum(
+        count_tokens(turn.user) + count_tokens(turn.bot) + 8 for turn in history[:-len(budget.history)]
+    )
@@ -0,0 +1,88 @@
+import asyncio
+
+from tracing import RingExporter, Tracer, parse_traceparent
+
+REMOTE_PARENT = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+
+
+def test_spans_nest_through_context_and_export_with_the_root():
+    ring = RingExporter()
+    tracer = Tracer(sample_rate=1.0, exporters=[ring])
+
+    @tracer.traced("inner")
+    def inner():
+        return tracer.traceparent()
+
+    with tracer.start_trace("request", stage="default") as root:
+        with tracer.span("phase", step=1) as phase:
+            header = inner()
+    assert tracer.traceparent() is None
+
+    trace = ring.recent()[0]
+    assert [span["name"] for span in trace["spans"]] == ["request", "phase", "inner"]
+    spans = {span["name"]: span for span in trace["spans"]}
+    assert spans["phase"]["parent_id"] == root.span_id
+    assert spans["inner"]["parent_id"] == phase.span_id
+    assert spans["phase"]["attributes"] == {"step": 1}
+    assert header == f"00-{trace['trace_id']}-{spans['inner']['span_id']}-01"
+    assert ring.get(trace["trace_id"]) is trace
+
+
+def test_traceparent_is_continued_and_invalid_headers_ignored():
+    assert parse_traceparent(REMOTE_PARENT) == ("4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7", True)
+    assert parse_traceparent("00-" + "0" * 32 + "-00f067aa0ba902b7-01") is None
+    assert parse_traceparent("garbage") is None
+
+    ring = RingExporter()
+    tracer = Tracer(sample_rate=0.0, exporters=[ring])
+    with tracer.start_trace("request", REMOTE_PARENT):
+        pass
+    with tracer.start_trace("request", "garbage"):
+        with tracer.span("phase"):
+            assert tracer.traceparent() is None
+
+    [trace] = ring.recent()
+    assert trace["trace_id"] == "4bf92f3577b34da6a3ce929d0e0e4736"
+    assert trace["spans"][0]["parent_id"] == "00f067aa0ba902b7"
+
+
+def test_unsampled_traces_are_kept_only_when_slow():
+    ring = RingExporter()
+    tracer = Tracer(sample_rate=0.0, slow_threshold_ms=10_000, exporters=[ring])
+    with tracer.start_trace("fast"):
+        pass
+    assert ring.recent() == []
+
+    tracer.slow_threshold_ms = 0.000001
+    with tracer.start_trace("slow"):
+        pass
+    assert [trace["sampled"] for trace in ring.recent()] == [False]
+
+
+def test_async_retry_attempts_record_errors():
+    ring = RingExporter()
+    tracer = Tracer(sample_rate=1.0, exporters=[ring])
+    calls = []
+
+    @tracer.traced("provider")
+    async def flaky():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("upstream down")
+        return "ok"
+
+    async def handler():
+        with tracer.start_trace("request"):
+            for attempt in range(2):
+                with tracer.span("attempt", attempt=attempt + 1) as span:
+                    try:
+                        return await flaky()
+                    except RuntimeError as e:
+                        span.record_error(e)
+
+    assert asyncio.run(handler()) == "ok"
+    spans = ring.recent()[0]["spans"]
+    assert [(span["name"], span["status"]) for span in spans] == [
+        ("request", "ok"), ("attempt", "error"), ("provider", "error"), ("attempt", "ok"), ("provider", "ok")
+    ]
+    assert spans[1]["error"] == "RuntimeError: upstream down"